@@ -5,7 +5,7 @@ Flask application for Render deployment
 Complete communications system with JWT authentication and RBAC
 """
 
-from flask import Flask, request, jsonify, render_template_string, send_from_directory
+from flask import Flask, request, jsonify, render_template_string, send_from_directory, Response, g
 from flask_cors import CORS
 import os
 import json
@@ -14,17 +14,33 @@ import hmac
 import hashlib
 import time
 import functools
-from database_postgres import UserDatabase
+from database_postgres import (UserDatabase, decode_cursor, page_size, paginate, iter_json_listing,
+                               SEARCH_SCOPES, encode_offset_cursor, decode_offset_cursor, normalize_recipients)
+from token_cache import VerifiedTokenCache
+from password_hashing import PasswordHasherBusy
+from token_revocation import TokenRevocationStore
+from static_cache import StaticAsset, etag_matches
+from user_bulk import import_users, export_users, detect_format, FORMATS as BULK_FORMATS, CONTENT_TYPES as BULK_CONTENT_TYPES
+from metrics import (metrics, HTTP_REQUEST_DURATION, JWT_VERIFY_DURATION,
+                     CONTENT_TYPE as METRICS_CONTENT_TYPE, authorized as metrics_authorized)
 
 app = Flask(__name__)
 CORS(app)
 
 # Inicializar base de datos
 db = UserDatabase()
+metrics.gauge('db_pool_connections', 'Conexiones del pool de la base de datos',
+              lambda: {(state,): db.pool_stats().get(state) for state in ('in_use', 'idle')}, labels=('state',))
 
 # Clave secreta para JWT
 JWT_SECRET = "mi_clave_secreta_super_segura_2024"
 
+# Tokens ya verificados: evita repetir HMAC y decodificación en cada petición
+verified_tokens = VerifiedTokenCache()
+
+# Revocación compartida entre procesos (logout y usuarios eliminados)
+token_revocations = TokenRevocationStore()
+
 # Funciones JWT
 def base64url_encode(data):
     """Codifica en base64url"""
@@ -46,6 +62,8 @@ def create_jwt(payload):
     
     # Agregar timestamp de expiración (24 horas)
     payload['exp'] = int(time.time()) + 86400
+    # Generación vigente del usuario: al revocarlo, los tokens anteriores dejan de valer
+    payload['gen'] = token_revocations.generation(payload.get('username'))
     
     # Codificar header y payload
     header_encoded = base64url_encode(json.dumps(header).encode('utf-8'))
@@ -63,16 +81,29 @@ def create_jwt(payload):
     return f"{message}.{signature_encoded}"
 
 def verify_jwt(token):
-    """Verificar token JWT"""
+    """Verificar token JWT (consultando primero la caché de tokens verificados)"""
+    start = time.perf_counter()
+    payload, result = _verify_jwt(token)
+    JWT_VERIFY_DURATION.observe(time.perf_counter() - start, result)
+    return payload
+
+def _verify_jwt(token):
+    """(payload o None, resultado para las métricas: 'cached', 'verified' o 'rejected')"""
     try:
+        message, _, signature_encoded = token.rpartition('.')
+        cached = verified_tokens.get(signature_encoded, message)
+        if cached is not None:
+            if token_revocations.is_revoked(signature_encoded, cached):
+                return None, 'rejected'
+            return cached, 'cached'
+        
         parts = token.split('.')
         if len(parts) != 3:
-            return None
+            return None, 'rejected'
         
         header_encoded, payload_encoded, signature_encoded = parts
         
         # Verificar firma
-        message = f"{header_encoded}.{payload_encoded}"
         expected_signature = hmac.new(
             JWT_SECRET.encode('utf-8'),
             message.encode('utf-8'),
@@ -82,18 +113,34 @@ def verify_jwt(token):
         received_signature = base64url_decode(signature_encoded)
         
         if not hmac.compare_digest(expected_signature, received_signature):
-            return None
+            return None, 'rejected'
         
         # Decodificar payload
         payload = json.loads(base64url_decode(payload_encoded))
         
         # Verificar expiración
         if payload.get('exp', 0) < time.time():
-            return None
+            return None, 'rejected'
         
-        return payload
+        verified_tokens.put(signature_encoded, message, payload)
+        if token_revocations.is_revoked(signature_encoded, payload):
+            return None, 'rejected'
+        return payload, 'verified'
     except:
-        return None
+        return None, 'rejected'
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    """Duración de cada petición por ruta (en streaming, hasta que empieza la respuesta)"""
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'not_found'
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, request.method, route, str(response.status_code))
+    return response
 
 def require_auth(f):
     """Decorador para requerir autenticación"""
@@ -514,6 +561,13 @@ HTML_TEMPLATE = """
         
         // Cerrar sesión
         function logout() {
+            if (authToken) {
+                fetch('/logout', {
+                    method: 'POST',
+                    headers: { 'Authorization': `Bearer ${authToken}` },
+                    keepalive: true
+                }).catch(() => {});
+            }
             localStorage.removeItem('authToken');
             authToken = null;
             currentUser = null;
@@ -749,10 +803,22 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# Página principal renderizada una sola vez y guardada comprimida en memoria
+home_asset = None
+
 @app.route('/')
 def home():
     """Página principal con aplicación completa"""
-    return render_template_string(HTML_TEMPLATE)
+    global home_asset
+    if home_asset is None:
+        html = render_template_string(HTML_TEMPLATE)
+        home_asset = StaticAsset('index.html', html.encode('utf-8'), 'text/html; charset=utf-8')
+    
+    status, headers, body = home_asset.response(
+        request.headers.get('Accept-Encoding'),
+        request.headers.get('If-None-Match')
+    )
+    return Response(body, status=status, headers=headers)
 
 @app.route('/login', methods=['POST'])
 def login():
@@ -787,9 +853,20 @@ def login():
                 'role': user['role']
             }
         })
+    except PasswordHasherBusy:
+        return jsonify({'success': False, 'message': 'Servidor ocupado, inténtalo de nuevo'}), 503
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error interno: {str(e)}'})
 
+@app.route('/logout', methods=['POST'])
+@require_auth
+def logout():
+    """Cerrar sesión revocando el token actual"""
+    token = request.headers.get('Authorization')[7:]
+    token_revocations.revoke_token(token.rpartition('.')[2], request.current_user.get('exp', 0))
+    verified_tokens.invalidate(token)
+    return jsonify({'success': True, 'message': 'Sesión cerrada'})
+
 @app.route('/verify-token')
 @require_auth
 def verify_token():
@@ -808,14 +885,40 @@ def verify_token():
 def get_users():
     """Obtener lista de usuarios"""
     try:
-        users = db.get_all_users()
-        return jsonify({
-            'success': True,
-            'users': users
-        })
+        body, etag = db.users.snapshot()
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if etag_matches(request.headers.get('If-None-Match') or '', {etag}):
+            return Response(status=304, headers=headers)
+        return Response(body, mimetype='application/json', headers=headers)
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error obteniendo usuarios: {str(e)}'})
 
+@app.route('/import-users', methods=['POST'])
+@require_auth
+@require_admin
+def import_users_endpoint():
+    """Alta masiva de usuarios desde CSV o JSON lines (solo admin)"""
+    fmt = request.args.get('format') or detect_format(request.content_type)
+    if fmt not in BULK_FORMATS:
+        return jsonify({'success': False, 'message': 'Formato no soportado (csv o jsonl)'}), 400
+    try:
+        lines = (line.decode('utf-8') for line in request.stream)
+        return jsonify(import_users(db, lines, fmt))
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error importando usuarios: {str(e)}'})
+
+@app.route('/export-users')
+@require_auth
+@require_admin
+def export_users_endpoint():
+    """Exportación de todos los usuarios en CSV o JSON lines (solo admin)"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in BULK_FORMATS:
+        return jsonify({'success': False, 'message': 'Formato no soportado (csv o jsonl)'}), 400
+    return Response(export_users(db, fmt), mimetype=BULK_CONTENT_TYPES[fmt], headers={
+        'Content-Disposition': f'attachment; filename="usuarios.{fmt}"'
+    })
+
 @app.route('/add-user', methods=['POST'])
 @require_auth
 @require_admin
@@ -830,16 +933,11 @@ def add_user():
         if not username or not password:
             return jsonify({'success': False, 'message': 'Usuario y contraseña requeridos'})
         
-        # Verificar si el usuario ya existe
-        if db.get_user_by_username(username):
-            return jsonify({'success': False, 'message': 'El usuario ya existe'})
-        
-        # Crear usuario
-        user_id = db.create_user(username, password, role)
-        if user_id:
+        # Crear usuario (add_user ya comprueba si existe)
+        result = db.add_user(username, password, role)
+        if result.get('success'):
             return jsonify({'success': True, 'message': 'Usuario creado exitosamente'})
-        else:
-            return jsonify({'success': False, 'message': 'Error creando usuario'})
+        return jsonify(result)
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error interno: {str(e)}'})
 
@@ -858,8 +956,15 @@ def delete_user():
         if username == request.current_user['username']:
             return jsonify({'success': False, 'message': 'No puedes eliminarte a ti mismo'})
         
+        user = db.get_user_by_username(username)
+        if not user:
+            return jsonify({'success': False, 'message': 'Usuario no encontrado'})
+        
         # Eliminar usuario
-        if db.delete_user(username):
+        result = db.delete_user(user['id'])
+        if result.get('success'):
+            token_revocations.revoke_user(username)
+            verified_tokens.revoke_user(username=username)
             return jsonify({'success': True, 'message': 'Usuario eliminado exitosamente'})
         else:
             return jsonify({'success': False, 'message': 'Error eliminando usuario'})
@@ -869,31 +974,48 @@ def delete_user():
 @app.route('/send-communication', methods=['POST'])
 @require_auth
 def send_communication():
-    """Enviar comunicación"""
+    """Enviar comunicación a uno o varios destinatarios (recipient o recipients, y cc)"""
     try:
         data = request.get_json()
-        recipient = data.get('recipient')
+        recipients = data.get('recipients') or ([data['recipient']] if data.get('recipient') else [])
+        cc = data.get('cc') or []
         subject = data.get('subject')
         message = data.get('message')
         
-        if not recipient or not subject or not message:
+        if not recipients or not subject or not message:
             return jsonify({'success': False, 'message': 'Todos los campos son requeridos'})
+        if not isinstance(recipients, list) or not isinstance(cc, list):
+            return jsonify({'success': False, 'message': 'recipients y cc deben ser listas'})
+        
+        # Sin duplicados, conservando el orden; mismos límites que server.py
+        try:
+            recipients, cc = normalize_recipients(recipients, cc)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)})
+        
+        # Verificar que los destinatarios existen (una sola consulta)
+        existing = db.get_existing_usernames(u for u in recipients + cc if u != 'todos')
+        missing = [u for u in recipients + cc if u != 'todos' and u not in existing]
+        if missing:
+            return jsonify({'success': False, 'message': f'Destinatario no encontrado: {", ".join(missing)}'})
+        
+        # Enviar comunicación: una inserción múltiple y un único commit
+        sender = request.current_user['username']
+        hora = time.strftime('%H:%M')
+        result = db.add_communications([
+            {
+                'titulo': subject if user in recipients else f'[COPIA] {subject}',
+                'mensaje': message,
+                'destinatario': user,
+                'prioridad': data.get('priority', 'normal'),
+                'remitente': sender,
+                'hora': hora
+            }
+            for user in recipients + cc
+        ])
         
-        # Verificar que el destinatario existe
-        recipient_user = db.get_user_by_username(recipient)
-        if not recipient_user:
-            return jsonify({'success': False, 'message': 'Destinatario no encontrado'})
-        
-        # Enviar comunicación
-        comm_id = db.send_communication(
-            request.current_user['username'],
-            recipient,
-            subject,
-            message
-        )
-        
-        if comm_id:
-            return jsonify({'success': True, 'message': 'Comunicación enviada exitosamente'})
+        if result.get('success'):
+            return jsonify({'success': True, 'message': 'Comunicación enviada exitosamente', 'ids': result['ids']})
         else:
             return jsonify({'success': False, 'message': 'Error enviando comunicación'})
     except Exception as e:
@@ -902,16 +1024,63 @@ def send_communication():
 @app.route('/get-communications')
 @require_auth
 def get_communications():
-    """Obtener comunicaciones del usuario"""
+    """Obtener comunicaciones del usuario, paginadas con ?limit=N&before=<cursor>.
+
+    Con ?stream=1 se devuelven todas de una vez en una respuesta chunked,
+    leyendo de un cursor del lado del servidor.
+    """
     try:
-        communications = db.get_user_communications(request.current_user['username'])
+        limit = page_size(request.args.get('limit'))
+        before = decode_cursor(request.args['before']) if request.args.get('before') else None
+        
+        if request.args.get('stream'):
+            rows = db.stream_communications_by_recipient(request.current_user['username'], before)
+            return Response(iter_json_listing(rows), mimetype='application/json')
+        
+        rows = db.get_user_communications(request.current_user['username'], limit + 1, before)
+        communications, next_cursor = paginate(rows, limit)
         return jsonify({
             'success': True,
-            'communications': communications
+            'communications': communications,
+            'next_cursor': next_cursor
         })
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error obteniendo comunicaciones: {str(e)}'})
 
+@app.route('/unread-count')
+@require_auth
+def unread_count():
+    """Número de comunicaciones sin leer del usuario (desde memoria)"""
+    return jsonify({'success': True, 'count': db.unread.get(request.current_user['username'])})
+
+@app.route('/search-communications')
+@require_auth
+def search_communications():
+    """Buscar comunicaciones con ?q=texto&scope=inbox|sent|all, por relevancia y paginadas con ?cursor="""
+    try:
+        scope = request.args.get('scope', 'inbox')
+        if scope not in SEARCH_SCOPES:
+            return jsonify({'success': False, 'message': 'Ámbito de búsqueda inválido'})
+        if scope == 'all' and request.current_user.get('role') != 'admin':
+            return jsonify({'success': False, 'message': 'Acceso denegado. Se requiere rol de administrador'}), 403
+        
+        limit = page_size(request.args.get('limit'))
+        offset = decode_offset_cursor(request.args['cursor']) if request.args.get('cursor') else 0
+        
+        rows = db.search_communications(request.current_user['username'], request.args.get('q', ''),
+                                        scope, limit + 1, offset)
+        return jsonify({
+            'success': True,
+            'communications': rows[:limit],
+            'next_cursor': encode_offset_cursor(offset + limit) if len(rows) > limit else None
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error buscando comunicaciones: {str(e)}'})
+
 @app.route('/health')
 def health_check():
     """Health check endpoint"""
@@ -928,6 +1097,8 @@ def api_status():
         'status': 'running',
         'version': '1.0.0',
         'database': 'connected' if db else 'disconnected',
+        'database_pool': db.pool_stats(),
+        'token_cache': verified_tokens.stats(),
         'features': [
             'JWT Authentication',
             'User Management',
@@ -936,6 +1107,13 @@ def api_status():
         ]
     })
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Métricas en formato Prometheus (con METRICS_TOKEN definido, exige ese token)"""
+    if not metrics_authorized(request.headers.get('Authorization')):
+        return jsonify({'success': False, 'message': 'Token de métricas requerido'}), 401
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Endpoint no encontrado'}), 404
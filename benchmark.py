@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+Benchmark de carga para el servidor de comunicaciones internas
+Mide la latencia de peticiones REST mientras hay clientes SSE conectados
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values, pct):
+    """Percentil por el método del rango más cercano"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def free_port():
+    """Obtener un puerto TCP libre en localhost"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=15):
+    """Esperar a que el servidor acepte conexiones"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def start_server(port, workdir):
+    """Arrancar server.py en un subproceso con una base de datos SQLite temporal"""
+    env = dict(os.environ, PORT=str(port))
+    env.pop('DATABASE_URL', None)
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BASE_DIR, 'server.py')],
+        cwd=workdir, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    if not wait_for_port(port):
+        process.kill()
+        raise RuntimeError('El servidor no arrancó a tiempo')
+    return process
+
+
+def make_token(workdir):
+    """Generar un token JWT válido con la misma clave que el servidor"""
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        sys.path.insert(0, BASE_DIR)
+        import server
+        return server.create_jwt({'user_id': 1, 'username': 'admin', 'role': 'admin'})
+    finally:
+        os.chdir(cwd)
+
+
+def open_sse_client(port, token):
+    """Abrir una conexión SSE y esperar el mensaje inicial"""
+    sock = socket.create_connection(('127.0.0.1', port), timeout=10)
+    request = (
+        'GET /api/events HTTP/1.1\r\n'
+        'Host: 127.0.0.1\r\n'
+        f'Authorization: Bearer {token}\r\n'
+        'Accept: text/event-stream\r\n\r\n'
+    )
+    sock.sendall(request.encode('utf-8'))
+    data = b''
+    while b'\n\n' not in data.split(b'\r\n\r\n', 1)[-1]:
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise RuntimeError('Conexión SSE cerrada por el servidor')
+        data += chunk
+    return sock
+
+
+def rest_call(port, token, method, path):
+    """Ejecutar una petición REST y devolver su latencia en milisegundos"""
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        body = json.dumps({}) if method == 'POST' else None
+        conn.request(method, path, body=body, headers={
+            'Authorization': f'Bearer {token}',
+            'Content-Type': 'application/json'
+        })
+        response = conn.getresponse()
+        response.read()
+    finally:
+        conn.close()
+    return (time.perf_counter() - start) * 1000.0
+
+
+def run_rest_load(port, token, requests_total, concurrency):
+    """Lanzar peticiones REST concurrentes alternando verify-token y get-inbox"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(requests_total))
+
+    def worker():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            method, path = ('GET', '/verify-token') if index % 2 == 0 else ('POST', '/get-inbox')
+            try:
+                elapsed = rest_call(port, token, method, path)
+                with lock:
+                    latencies.append(elapsed)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(len(latencies) / duration, 1) if duration else None,
+        'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 2) if latencies else None
+    }
+
+
+def login_call(port, username, password):
+    """Iniciar sesión y devolver (latencia en ms, código HTTP)"""
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('POST', '/authenticate-user',
+                     body=json.dumps({'username': username, 'password': password}),
+                     headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+    finally:
+        conn.close()
+    return (time.perf_counter() - start) * 1000.0, response.status
+
+
+def run_login_load(port, logins_total, concurrency):
+    """Ráfaga de inicios de sesión simultáneos (p. ej. un cambio de turno)"""
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    counter = iter(range(logins_total))
+    # El primer login migra la contraseña heredada: se hace antes de medir
+    login_call(port, 'admin', 'admin123')
+
+    def worker():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            try:
+                elapsed, status = login_call(port, 'admin', 'admin123')
+            except Exception:
+                elapsed, status = None, 'error'
+            with lock:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status == 200:
+                    latencies.append(elapsed)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    return {
+        'logins': logins_total,
+        'status': statuses,
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(len(latencies) / duration, 1) if duration else None,
+        'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 2) if latencies else None
+    }
+
+
+def bench_require_auth(iterations):
+    """Medir el coste de require_auth con y sin la caché de tokens verificados"""
+    with tempfile.TemporaryDirectory() as workdir:
+        token = make_token(workdir)
+    import server
+
+    class FakeHandler:
+        headers = {'Authorization': f'Bearer {token}'}
+
+        def send_error_response(self, status, message):
+            raise RuntimeError(message)
+
+    endpoint = server.require_auth(lambda handler: None)
+    handler = FakeHandler()
+    result = {'iterations': iterations}
+    for label, maxsize in (('sin_cache', 0), ('con_cache', server.verified_tokens.maxsize)):
+        server.verified_tokens.clear()
+        server.verified_tokens.maxsize = maxsize
+        start = time.perf_counter()
+        for _ in range(iterations):
+            endpoint(handler)
+        elapsed = time.perf_counter() - start
+        result[f'{label}_us'] = round(elapsed / iterations * 1e6, 2)
+    return result
+
+
+def run_insert_load(db, inserts_total, concurrency):
+    """Envíos simultáneos directos contra la base de datos (sin HTTP)"""
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(inserts_total))
+
+    def worker():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            start = time.perf_counter()
+            db.add_communication(f'Aviso {index}', 'Comunicado de prueba', 'todos', 'normal', 'admin', '09:00')
+            elapsed = (time.perf_counter() - start) * 1000.0
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+
+    return {
+        'inserts': inserts_total,
+        'duration_s': round(duration, 3),
+        'inserts_per_s': round(inserts_total / duration, 1) if duration else None,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p99_ms': round(percentile(latencies, 99), 2)
+    }
+
+
+def bench_group_commit(inserts_total, concurrency):
+    """Envíos por segundo con y sin escritura agrupada, en SQLite y (si hay DATABASE_URL) en PostgreSQL"""
+    sys.path.insert(0, BASE_DIR)
+    from database_postgres import UserDatabase
+    from db_dialect import POSTGRES_AVAILABLE
+    backends = ['sqlite']
+    if POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL'):
+        backends.append('postgres')
+
+    results = {'concurrency': concurrency}
+    cwd = os.getcwd()
+    for backend in backends:
+        for group_commit in (False, True):
+            with tempfile.TemporaryDirectory() as workdir:
+                os.chdir(workdir)
+                try:
+                    database_url = os.environ['DATABASE_URL'] if backend == 'postgres' else ''
+                    db = UserDatabase(database_url=database_url, group_commit=group_commit)
+                    result = run_insert_load(db, inserts_total, concurrency)
+                    if db.writer is not None:
+                        result['batches'] = db.writer.stats()
+                        db.writer.close()
+                finally:
+                    os.chdir(cwd)
+            results[f"{backend}_{'group_commit' if group_commit else 'commit_por_envio'}"] = result
+    return results
+
+
+def bench_log_overhead(iterations):
+    """Coste por llamada, en el hilo que registra, de print() frente al log estructurado"""
+    sys.path.insert(0, BASE_DIR)
+    import logging
+    import logging.handlers
+    import queue
+    from structured_logging import JsonFormatter, NonBlockingQueueHandler, RateLimitFilter, setup_logging
+
+    setup_logging()
+
+    result = {'iterations': iterations}
+    with open(os.devnull, 'w') as devnull:
+        start = time.perf_counter()
+        for i in range(iterations):
+            print(f"Cliente SSE conectado. Total: {i}", file=devnull, flush=True)
+        result['print_ns'] = round((time.perf_counter() - start) / iterations * 1e9)
+
+        output = logging.StreamHandler(devnull)
+        output.setFormatter(JsonFormatter())
+        cases = (('log_nivel_warning', logging.WARNING, 0), ('log_info', logging.INFO, 0),
+                 ('log_info_limitado', logging.INFO, 20))
+        for label, level, limit in cases:
+            handler = NonBlockingQueueHandler(queue.Queue(iterations + 1))
+            handler.addFilter(RateLimitFilter(limit))
+            logger = logging.Logger(f'bench.{label}', level)
+            logger.addHandler(handler)
+            start = time.perf_counter()
+            for i in range(iterations):
+                logger.info("Cliente SSE conectado", extra={'sse_clients': i})
+            result[f'{label}_ns'] = round((time.perf_counter() - start) / iterations * 1e9)
+            # El hilo escritor se mide aparte: su trabajo no lo paga la petición
+            listener = logging.handlers.QueueListener(handler.queue, output)
+            start = time.perf_counter()
+            listener.start()
+            listener.stop()
+            result[f'{label}_writer_ns'] = round((time.perf_counter() - start) / iterations * 1e9)
+    return result
+
+
+def measure_startup(workdir, token):
+    """Milisegundos desde lanzar server.py hasta aceptar conexiones y hasta responder la primera consulta"""
+    port = free_port()
+    env = dict(os.environ, PORT=str(port))
+    env.pop('DATABASE_URL', None)
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BASE_DIR, 'server.py')],
+        cwd=workdir, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+                break
+            except OSError:
+                if time.perf_counter() - start > 30:
+                    raise RuntimeError('El servidor no arrancó a tiempo')
+                time.sleep(0.002)
+        listening = (time.perf_counter() - start) * 1000.0
+        rest_call(port, token, 'POST', '/get-inbox')
+        first_request = (time.perf_counter() - start) * 1000.0
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    return listening, first_request
+
+
+def bench_startup(runs):
+    """Arranque en frío con la base ya migrada (migrate.py) y sin migrar (el primer uso migra)"""
+    with tempfile.TemporaryDirectory() as tokendir:
+        token = make_token(tokendir)
+    result = {'runs': runs}
+    for label in ('migrada', 'sin_migrar'):
+        listening, first_request = [], []
+        for _ in range(runs):
+            with tempfile.TemporaryDirectory() as workdir:
+                if label == 'migrada':
+                    subprocess.run([sys.executable, os.path.join(BASE_DIR, 'migrate.py')], cwd=workdir,
+                                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                ready_ms, first_ms = measure_startup(workdir, token)
+                listening.append(ready_ms)
+                first_request.append(first_ms)
+        result[label] = {
+            'listening_p50_ms': round(percentile(listening, 50), 1),
+            'first_request_p50_ms': round(percentile(first_request, 50), 1),
+            'first_request_max_ms': round(max(first_request), 1)
+        }
+    return result
+
+
+def check_inbox_plan():
+    """Verificar que la bandeja de entrada usa índices y no recorre la tabla entera"""
+    sys.path.insert(0, BASE_DIR)
+    from database_postgres import UserDatabase
+    db = UserDatabase()
+    plan = db.explain_recipient_query('usuario1')
+    for line in plan:
+        print(f"  {line}")
+    full_scan = any('Seq Scan' in line or line.startswith('SCAN') for line in plan)
+    if full_scan:
+        print("❌ El plan de la bandeja de entrada recorre la tabla completa")
+        return 1
+    print("✅ El plan de la bandeja de entrada usa índices")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de latencia REST con clientes SSE conectados')
+    parser.add_argument('--sse-clients', type=int, default=50, help='Clientes SSE abiertos durante la prueba')
+    parser.add_argument('--requests', type=int, default=500, help='Total de peticiones REST')
+    parser.add_argument('--concurrency', type=int, default=8, help='Peticiones REST simultáneas')
+    parser.add_argument('--check-plan', action='store_true',
+                        help='Solo comprobar con EXPLAIN que la bandeja de entrada usa índices')
+    parser.add_argument('--auth-overhead', type=int, metavar='N', default=0,
+                        help='Solo medir require_auth con y sin caché de tokens durante N llamadas')
+    parser.add_argument('--logins', type=int, metavar='N', default=0,
+                        help='Solo medir N inicios de sesión simultáneos (usa --concurrency)')
+    parser.add_argument('--inserts', type=int, metavar='N', default=0,
+                        help='Solo medir N envíos con y sin escritura agrupada (usa --concurrency)')
+    parser.add_argument('--startup', type=int, metavar='N', default=0,
+                        help='Solo medir N arranques: de lanzar server.py a la primera respuesta')
+    parser.add_argument('--log-overhead', type=int, metavar='N', default=0,
+                        help='Solo medir el coste de N llamadas de log (print frente a log estructurado)')
+    args = parser.parse_args()
+
+    if args.startup:
+        print(json.dumps(bench_startup(args.startup), indent=2))
+        return
+
+    if args.log_overhead:
+        print(json.dumps(bench_log_overhead(args.log_overhead), indent=2))
+        return
+
+    if args.inserts:
+        print(json.dumps(bench_group_commit(args.inserts, args.concurrency), indent=2))
+        return
+
+    if args.logins:
+        with tempfile.TemporaryDirectory() as workdir:
+            port = free_port()
+            process = start_server(port, workdir)
+            try:
+                result = run_login_load(port, args.logins, args.concurrency)
+                print(json.dumps(result, indent=2))
+            finally:
+                process.terminate()
+                process.wait(timeout=10)
+        return
+
+    if args.auth_overhead:
+        print(json.dumps(bench_require_auth(args.auth_overhead), indent=2))
+        return
+
+    if args.check_plan:
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            sys.exit(check_inbox_plan())
+
+    with tempfile.TemporaryDirectory() as workdir:
+        port = free_port()
+        process = start_server(port, workdir)
+        sse_sockets = []
+        try:
+            token = make_token(workdir)
+            for _ in range(args.sse_clients):
+                sse_sockets.append(open_sse_client(port, token))
+            result = run_rest_load(port, token, args.requests, args.concurrency)
+            result['sse_clients'] = len(sse_sockets)
+            print(json.dumps(result, indent=2))
+        finally:
+            for sock in sse_sockets:
+                sock.close()
+            process.terminate()
+            process.wait(timeout=10)
+
+
+if __name__ == '__main__':
+    main()
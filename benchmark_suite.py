@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Suite de carga reproducible para la API de comunicados
+Siembra una base SQLite temporal, arranca server.py o la app Flask (wsgi:application)
+y mide ráfagas de login, lecturas de bandeja, envíos con copias y clientes SSE.
+El resultado es JSON para poder comparar commits:
+
+    python3 benchmark_suite.py --users 500 --messages 50000 --output antes.json
+    python3 benchmark_suite.py --output despues.json
+    python3 benchmark_suite.py --compare antes.json despues.json
+"""
+
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import random
+import re
+import selectors
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmark import BASE_DIR, percentile, free_port, wait_for_port, open_sse_client
+
+# Todos los usuarios sembrados comparten contraseña (su hash se calcula una sola vez)
+BENCH_PASSWORD = 'bench-password'
+SEED_BATCH_SIZE = 5000
+
+# Arranque de la app Flask con el servidor multihilo de werkzeug (viene con Flask)
+WSGI_RUNNER = (
+    "import sys; sys.path.insert(0, sys.argv[2]); "
+    "from werkzeug.serving import run_simple; import wsgi; "
+    "run_simple('127.0.0.1', int(sys.argv[1]), wsgi.application, threaded=True)"
+)
+
+# Marca en el título de los envíos para medir cuánto tarda el evento SSE en llegar
+BENCH_MARK = re.compile(r'\[bench (\d+)\]')
+
+
+class ServerTarget:
+    """server.py (http.server con hilos): rutas y cuerpos de la API original"""
+    name = 'server'
+    login_path = '/authenticate-user'
+    supports_sse = True
+
+    def command(self, port):
+        return [sys.executable, os.path.join(BASE_DIR, 'server.py')]
+
+    def inbox(self):
+        return 'POST', '/get-inbox', {}
+
+    def send(self, recipients, cc, title, message):
+        return 'POST', '/send-communication', {
+            'destinatarios': recipients, 'copia': cc, 'titulo': title, 'mensaje': message, 'prioridad': 'normal'
+        }
+
+
+class FlaskTarget:
+    """app.py servido como wsgi:application; no tiene /api/events"""
+    name = 'flask'
+    login_path = '/login'
+    supports_sse = False
+
+    def command(self, port):
+        return [sys.executable, '-c', WSGI_RUNNER, str(port), BASE_DIR]
+
+    def inbox(self):
+        return 'GET', '/get-communications?limit=50', None
+
+    def send(self, recipients, cc, title, message):
+        return 'POST', '/send-communication', {
+            'recipients': recipients, 'cc': cc, 'subject': title, 'message': message, 'priority': 'normal'
+        }
+
+
+TARGETS = {'server': ServerTarget, 'flask': FlaskTarget}
+
+
+def summarize(latencies, duration=None):
+    """Percentiles (ms) y, si se indica la duración, peticiones por segundo"""
+    result = {'count': len(latencies)}
+    if duration:
+        result['throughput_rps'] = round(len(latencies) / duration, 1)
+    if latencies:
+        result.update({
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p90_ms': round(percentile(latencies, 90), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'max_ms': round(max(latencies), 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 2)
+        })
+    return result
+
+
+def seed_database(workdir, users, messages, todos_ratio, seed):
+    """Crear users.db en ``workdir`` con usuarios y comunicados aleatorios (reproducibles con ``seed``)"""
+    sys.path.insert(0, BASE_DIR)
+    from database_postgres import UserDatabase
+    from password_hashing import hash_password
+
+    rng = random.Random(seed)
+    usernames = [f'bench{i:05d}' for i in range(users)]
+    start = time.perf_counter()
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        db = UserDatabase(database_url='', group_commit=False)
+        password_hash = hash_password(BENCH_PASSWORD)
+        for offset in range(0, users, SEED_BATCH_SIZE):
+            db.add_users([
+                {'username': username, 'password_hash': password_hash, 'role': 'user'}
+                for username in usernames[offset:offset + SEED_BATCH_SIZE]
+            ])
+        for offset in range(0, messages, SEED_BATCH_SIZE):
+            db.add_communications([
+                {
+                    'titulo': f'Comunicado {offset + i}',
+                    'mensaje': f'Texto del comunicado {offset + i} para la prueba de carga',
+                    'destinatario': 'todos' if rng.random() < todos_ratio else rng.choice(usernames),
+                    'prioridad': rng.choice(('baja', 'normal', 'alta')),
+                    'remitente': rng.choice(usernames),
+                    'hora': '09:00'
+                }
+                for i in range(min(SEED_BATCH_SIZE, messages - offset))
+            ])
+    finally:
+        os.chdir(cwd)
+    return usernames, round(time.perf_counter() - start, 3)
+
+
+def start_target(target, port, workdir):
+    """Arrancar el servidor elegido sobre la base sembrada"""
+    env = dict(os.environ, PORT=str(port))
+    env.pop('DATABASE_URL', None)
+    process = subprocess.Popen(
+        target.command(port), cwd=workdir, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    if not wait_for_port(port, timeout=30):
+        process.kill()
+        raise RuntimeError(f'{target.name} no arrancó a tiempo')
+    return process
+
+
+def http_call(port, method, path, body=None, token=None, timeout=60):
+    """(latencia en ms, código HTTP, JSON de respuesta o None)"""
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = conn.getresponse()
+        raw = response.read()
+    finally:
+        conn.close()
+    elapsed = (time.perf_counter() - start) * 1000.0
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        data = None
+    return elapsed, response.status, data
+
+
+def run_workers(concurrency, work):
+    """Ejecutar ``work(índice_de_hilo)`` en ``concurrency`` hilos; devuelve la duración en segundos"""
+    start = time.perf_counter()
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def login_burst(port, target, usernames, logins, concurrency):
+    """Ráfaga de inicios de sesión; devuelve las métricas y un token por usuario"""
+    latencies = []
+    errors = {}
+    tokens = {}
+    lock = threading.Lock()
+    counter = iter(range(logins))
+
+    def work(_):
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            username = usernames[index % len(usernames)]
+            try:
+                elapsed, status, data = http_call(port, 'POST', target.login_path,
+                                                  {'username': username, 'password': BENCH_PASSWORD})
+            except Exception as e:
+                status, data = type(e).__name__, None
+            with lock:
+                if status == 200 and data and data.get('success'):
+                    latencies.append(elapsed)
+                    tokens[username] = data['token']
+                else:
+                    errors[str(status)] = errors.get(str(status), 0) + 1
+
+    duration = run_workers(concurrency, work)
+    result = summarize(latencies, duration)
+    result.update({'concurrency': concurrency, 'errors': errors})
+    return result, tokens
+
+
+class SSEListeners:
+    """Clientes SSE abiertos durante la prueba, leídos desde un único hilo con selectors.
+
+    Cuentan los eventos recibidos y, para los envíos marcados con
+    ``[bench <ns>]`` en el título, el tiempo desde el envío hasta la entrega.
+    """
+
+    def __init__(self, port, tokens):
+        self.sockets = [open_sse_client(port, token) for token in tokens]
+        self.events = 0
+        self.delivery_ms = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        selector = selectors.DefaultSelector()
+        buffers = {}
+        for sock in self.sockets:
+            sock.setblocking(False)
+            selector.register(sock, selectors.EVENT_READ)
+            buffers[sock] = b''
+        while not self._stop.is_set():
+            for key, _ in selector.select(timeout=0.2):
+                try:
+                    chunk = key.fileobj.recv(65536)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    chunk = b''
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    continue
+                received = time.time_ns()
+                data = buffers[key.fileobj] + chunk
+                *events, buffers[key.fileobj] = data.split(b'\n\n')
+                for event in events:
+                    if b'data: ' not in event:
+                        continue
+                    self.events += 1
+                    match = BENCH_MARK.search(event.decode('utf-8', 'replace'))
+                    if match:
+                        self.delivery_ms.append((received - int(match.group(1))) / 1e6)
+        selector.close()
+
+    def close(self):
+        """Parar la lectura, cerrar las conexiones y devolver las métricas"""
+        time.sleep(0.5)  # Margen para los últimos eventos en vuelo
+        self._stop.set()
+        self._thread.join()
+        for sock in self.sockets:
+            sock.close()
+        result = {'listeners': len(self.sockets), 'events_received': self.events}
+        result['delivery'] = summarize(self.delivery_ms)
+        return result
+
+
+def mixed_load(port, target, tokens, usernames, duration, concurrency, send_ratio, cc, todos_ratio, seed):
+    """Mezcla de lecturas de bandeja y envíos con copias durante ``duration`` segundos"""
+    latencies = {'inbox': [], 'send': []}
+    errors = {'inbox': 0, 'send': 0}
+    lock = threading.Lock()
+    senders = list(tokens.items())
+    deadline = time.perf_counter() + duration
+
+    def work(worker):
+        rng = random.Random(seed * 1000 + worker)
+        username, token = senders[worker % len(senders)]
+        while time.perf_counter() < deadline:
+            if rng.random() < send_ratio:
+                operation = 'send'
+                recipients = ['todos'] if rng.random() < todos_ratio else [rng.choice(usernames)]
+                copies = [user for user in rng.sample(usernames, min(cc, len(usernames))) if user not in recipients]
+                method, path, body = target.send(
+                    recipients, copies, f'Aviso de carga [bench {time.time_ns()}]', 'Mensaje de la prueba de carga'
+                )
+            else:
+                operation = 'inbox'
+                method, path, body = target.inbox()
+            try:
+                elapsed, status, data = http_call(port, method, path, body, token)
+                ok = status == 200 and data is not None and data.get('success', True)
+            except Exception:
+                ok = False
+            with lock:
+                if ok:
+                    latencies[operation].append(elapsed)
+                else:
+                    errors[operation] += 1
+
+    elapsed = run_workers(concurrency, work)
+    total = sum(len(values) for values in latencies.values())
+    result = {
+        'concurrency': concurrency,
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(total / elapsed, 1),
+        'errors': errors
+    }
+    for operation, values in latencies.items():
+        result[operation] = summarize(values, elapsed)
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def run_suite(args):
+    target = TARGETS[args.target]()
+    if target.name == 'flask' and importlib.util.find_spec('flask') is None:
+        raise SystemExit('Flask no está instalado: pip install -r requirements.txt')
+
+    report = {
+        'meta': {
+            'target': target.name,
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'seed': args.seed,
+            'users': args.users,
+            'messages': args.messages,
+            'todos_ratio': args.todos_ratio
+        }
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        usernames, report['seed_s'] = seed_database(workdir, args.users, args.messages, args.todos_ratio, args.seed)
+        port = free_port()
+        process = start_target(target, port, workdir)
+        try:
+            report['login_burst'], tokens = login_burst(port, target, usernames, args.logins, args.login_concurrency)
+            if not tokens:
+                raise RuntimeError('Ningún inicio de sesión correcto: no se puede seguir')
+
+            listeners = None
+            if target.supports_sse and args.sse_clients:
+                sse_tokens = [tokens[username] for username in sorted(tokens)]
+                listeners = SSEListeners(port, [sse_tokens[i % len(sse_tokens)] for i in range(args.sse_clients)])
+            try:
+                report['mixed'] = mixed_load(port, target, tokens, usernames, args.duration, args.concurrency,
+                                             args.send_ratio, args.cc, args.todos_ratio, args.seed)
+            finally:
+                if listeners is not None:
+                    report['sse'] = listeners.close()
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+    return report
+
+
+def compare(before_path, after_path):
+    """Tabla con las diferencias entre dos resultados (latencias y throughput)"""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    def walk(a, b, prefix=''):
+        for key, value in a.items():
+            if key == 'meta' or key not in b:
+                continue
+            if isinstance(value, dict):
+                yield from walk(value, b[key], f'{prefix}{key}.')
+            elif isinstance(value, (int, float)) and (key.endswith('_ms') or key.endswith('_rps')):
+                yield f'{prefix}{key}', value, b[key]
+
+    print(f"{'métrica':<36} {'antes':>10} {'después':>10} {'cambio':>8}")
+    for name, old, new in walk(before, after):
+        change = f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+        print(f'{name:<36} {old:>10} {new:>10} {change:>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Suite de carga reproducible de la API de comunicados')
+    parser.add_argument('--target', choices=sorted(TARGETS), default='server',
+                        help='server.py o la app Flask (wsgi:application)')
+    parser.add_argument('--users', type=int, default=200, help='Usuarios sembrados')
+    parser.add_argument('--messages', type=int, default=20000, help='Comunicados sembrados')
+    parser.add_argument('--todos-ratio', type=float, default=0.2,
+                        help="Fracción de comunicados (sembrados y enviados) para 'todos'")
+    parser.add_argument('--seed', type=int, default=1, help='Semilla de los datos y de la mezcla de operaciones')
+    parser.add_argument('--logins', type=int, default=100, help='Inicios de sesión de la ráfaga')
+    parser.add_argument('--login-concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10, help='Segundos de carga mixta')
+    parser.add_argument('--concurrency', type=int, default=16, help='Clientes REST simultáneos en la carga mixta')
+    parser.add_argument('--send-ratio', type=float, default=0.1, help='Fracción de envíos frente a lecturas de bandeja')
+    parser.add_argument('--cc', type=int, default=2, help='Destinatarios en copia por envío')
+    parser.add_argument('--sse-clients', type=int, default=100, help='Clientes SSE conectados durante la carga mixta')
+    parser.add_argument('--output', help='Guardar el resultado JSON en este archivo')
+    parser.add_argument('--compare', nargs=2, metavar=('ANTES', 'DESPUES'),
+                        help='Comparar dos resultados guardados con --output')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = run_suite(args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
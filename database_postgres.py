@@ -1,321 +1,759 @@
 #!/usr/bin/env python3
 """
 Base de datos PostgreSQL para usuarios - Compatible con Render.com
+SQLite como alternativa para desarrollo local (ver db_dialect.py)
 """
 
 import os
 import json
-from datetime import datetime
-try:
-    import psycopg2
-    import psycopg2.extras
-    POSTGRES_AVAILABLE = True
-except ImportError:
-    POSTGRES_AVAILABLE = False
-    # Fallback a SQLite para desarrollo local
-    import sqlite3
+import base64
+import contextlib
+import re
+import threading
+from password_hashing import password_hasher
+from user_directory import UserDirectory
+from unread_counters import UnreadCounters
+from group_commit import GroupCommitWriter, GROUP_COMMIT
+from metrics import instrument_methods, DB_QUERY_DURATION
+from structured_logging import get_logger
+from schema_migrations import apply_migrations, status as schema_status
+from db_dialect import create_dialect, row_factory, fetch_dicts, fetch_dict, INTEGRITY_ERRORS
+
+logger = get_logger('database')
+
+# Si un proceso encuentra el esquema atrasado, migrarlo él mismo (desarrollo) o negarse a arrancar
+DB_AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', '1').lower() not in ('0', 'false', 'no')
+
+SEARCH_SCOPES = ('inbox', 'sent', 'all')
+MAX_SEARCH_TERMS = 8
+
+# Paginación por cursor (keyset) de los listados de comunicados
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Destinatarios (principales + copia) admitidos en un solo envío
+MAX_RECIPIENTS = int(os.environ.get('MAX_RECIPIENTS', 500))
+
+# Filas leídas por lote al transmitir listados completos (respuestas en streaming)
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 500))
+
+COMMUNICATION_COLUMNS = "id, titulo, mensaje, destinatario, prioridad, remitente, fecha, hora, created_at"
+# Estado de lectura calculado en la propia consulta (marca de agua o excepción en communication_reads)
+READ_STATE_COLUMN = (
+    "(communications.id <= COALESCE((SELECT last_read_id FROM read_watermarks WHERE username = ?), 0) "
+    "OR EXISTS (SELECT 1 FROM communication_reads WHERE communication_reads.username = ? "
+    "AND communication_reads.communication_id = communications.id)) AS leido"
+)
+
+def encode_cursor(communication):
+    """Cursor opaco que apunta a la posición (created_at, id) de un comunicado"""
+    raw = json.dumps([communication['created_at'], communication['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+def decode_cursor(cursor):
+    """Decodifica un cursor de paginación; lanza ValueError si no es válido"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, comm_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return str(created_at), int(comm_id)
+    except Exception:
+        raise ValueError('Cursor de paginación inválido')
+
+def page_size(limit):
+    """Normaliza el tamaño de página solicitado al rango permitido"""
+    try:
+        limit = int(limit) if limit is not None else DEFAULT_PAGE_SIZE
+    except (TypeError, ValueError):
+        limit = DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def normalize_recipients(main, cc):
+    """Valida y quita duplicados de los destinatarios principales y en copia de un envío.
+
+    Quien ya está entre los principales no se repite en copia. Lanza
+    ValueError si algún nombre no es texto, si no hay destinatario principal
+    o si se supera MAX_RECIPIENTS.
+    """
+    seen = set()
+    main_out, cc_out = [], []
+    for target, names in ((main_out, main), (cc_out, cc)):
+        for name in names:
+            if not isinstance(name, str) or not name.strip():
+                raise ValueError('Destinatario inválido')
+            if name not in seen:
+                seen.add(name)
+                target.append(name)
+    
+    if not main_out:
+        raise ValueError('Campo destinatario es requerido')
+    if len(main_out) + len(cc_out) > MAX_RECIPIENTS:
+        raise ValueError(f'Máximo {MAX_RECIPIENTS} destinatarios por envío')
+    return main_out, cc_out
+
+def paginate(rows, limit):
+    """Recorta una consulta hecha con limit + 1 y calcula el cursor de la página siguiente"""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+def search_terms(text):
+    """Palabras de la consulta del usuario, sin operadores ni comillas"""
+    return re.findall(r'\w+', (text or '').lower())[:MAX_SEARCH_TERMS]
+
+def encode_offset_cursor(offset):
+    """Cursor opaco de los resultados de búsqueda (ordenados por relevancia, no por fecha)"""
+    return base64.urlsafe_b64encode(json.dumps({'offset': offset}).encode('utf-8')).rstrip(b'=').decode('ascii')
+
+def decode_offset_cursor(cursor):
+    """Posición codificada en un cursor de búsqueda; lanza ValueError si no es válido"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        offset = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))['offset']
+    except (ValueError, TypeError, KeyError):
+        raise ValueError('Cursor de paginación inválido')
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError('Cursor de paginación inválido')
+    return offset
+
+def iter_json_listing(communications, chunk_size=64 * 1024):
+    """Serializa un flujo de comunicados como el JSON de un listado, en bloques de ~chunk_size bytes"""
+    buffer = [b'{"success": true, "communications": [']
+    buffered = 0
+    separator = b''
+    for communication in communications:
+        item = separator + json.dumps(communication).encode('utf-8')
+        separator = b', '
+        buffer.append(item)
+        buffered += len(item)
+        if buffered >= chunk_size:
+            yield b''.join(buffer)
+            buffer, buffered = [], 0
+    buffer.append(b'], "next_cursor": null}')
+    yield b''.join(buffer)
 
 class UserDatabase:
-    def __init__(self):
-        self.use_postgres = POSTGRES_AVAILABLE and os.environ.get('DATABASE_URL')
+    """Repositorio de usuarios y comunicados, igual para PostgreSQL y SQLite.
+
+    Las consultas se escriben una sola vez con marcadores '?'; el dialecto
+    (``db_dialect``) presta las conexiones, traduce los marcadores y resuelve
+    las pocas diferencias de sintaxis. Las consultas de cada petición llevan
+    un nombre para ejecutarse como sentencias preparadas en PostgreSQL.
+    """
+    
+    def __init__(self, db_path='users.db', database_url=None, group_commit=GROUP_COMMIT):
+        self.dialect = create_dialect(database_url, db_path)
         
-        if self.use_postgres:
-            self.database_url = os.environ.get('DATABASE_URL')
-            print("🐘 Usando PostgreSQL (Render)")
-        else:
-            self.db_path = "users.db"
-            print("🗃️ Usando SQLite (desarrollo local)")
+        logger.info("Base de datos seleccionada", extra={'dialect': self.dialect.name})
         
-        self.init_database()
+        # El esquema se comprueba en el primer uso, no al importar (ver migrate.py)
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        # Directorio de usuarios en memoria; se invalida en cada alta, edición o baja
+        self.users = UserDirectory(self.get_all_users)
+        # Contadores de no leídos en memoria, ajustados en cada envío y lectura
+        self.unread = UnreadCounters(self.get_unread_count)
+        # Escritor agrupado de comunicados (opcional): un commit para varias peticiones
+        self.writer = GroupCommitWriter(self._insert_communication_rows) if group_commit else None
     
-    def get_connection(self):
-        """Obtiene conexión a la base de datos"""
-        if self.use_postgres:
-            return psycopg2.connect(self.database_url)
-        else:
-            return sqlite3.connect(self.db_path)
+    @property
+    def use_postgres(self):
+        return self.dialect.name == 'postgres'
     
-    def init_database(self):
-        """Inicializa la base de datos y crea las tablas necesarias"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        if self.use_postgres:
-            # PostgreSQL syntax
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    username VARCHAR(255) UNIQUE NOT NULL,
-                    password VARCHAR(255) NOT NULL,
-                    role VARCHAR(50) NOT NULL DEFAULT 'user',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS communications (
-                    id SERIAL PRIMARY KEY,
-                    titulo VARCHAR(255) NOT NULL,
-                    mensaje TEXT NOT NULL,
-                    destinatario VARCHAR(255) NOT NULL,
-                    prioridad VARCHAR(50) NOT NULL DEFAULT 'normal',
-                    remitente VARCHAR(255) NOT NULL,
-                    fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    hora VARCHAR(10) NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-        else:
-            # SQLite syntax (desarrollo local)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    role TEXT NOT NULL DEFAULT 'user',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS communications (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    titulo TEXT NOT NULL,
-                    mensaje TEXT NOT NULL,
-                    destinatario TEXT NOT NULL,
-                    prioridad TEXT NOT NULL DEFAULT 'normal',
-                    remitente TEXT NOT NULL,
-                    fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    hora TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-        
-        # Insertar usuarios por defecto si no existen
-        default_users = [
-            ('admin', 'admin123', 'admin'),
-            ('usuario1', 'pass123', 'user'),
-            ('usuario2', 'pass456', 'user'),
-            ('gerente', 'gerente123', 'manager')
-        ]
-        
-        for username, password, role in default_users:
-            try:
-                if self.use_postgres:
-                    cursor.execute(
-                        "INSERT INTO users (username, password, role) VALUES (%s, %s, %s) ON CONFLICT (username) DO NOTHING",
-                        (username, password, role)
-                    )
-                else:
-                    cursor.execute(
-                        "INSERT OR IGNORE INTO users (username, password, role) VALUES (?, ?, ?)",
-                        (username, password, role)
+    def connection(self):
+        """Presta una conexión (del pool en PostgreSQL, del hilo en SQLite)"""
+        if not self._schema_ready:
+            self._ensure_schema()
+        return self.dialect.connection()
+    
+    def _execute(self, cursor, query, params=(), prepare=None):
+        return self.dialect.execute(cursor, query, params, prepare)
+    
+    def pool_stats(self):
+        """Métricas de conexiones a la base de datos"""
+        stats = self.dialect.stats()
+        if self.writer is not None:
+            stats['group_commit'] = self.writer.stats()
+        return stats
+    
+    def _ensure_schema(self):
+        """Primer uso del proceso: comprobar la versión del esquema y, si se permite, migrar"""
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            status = schema_status(self.dialect)
+            if status['pending']:
+                if not DB_AUTO_MIGRATE:
+                    raise RuntimeError(
+                        f"Esquema en la versión {status['current']}, se necesita la {status['required']}: "
+                        "ejecutar python3 migrate.py"
                     )
-            except Exception as e:
-                print(f"Error insertando usuario {username}: {e}")
-        
-        conn.commit()
-        conn.close()
-        print("✅ Base de datos inicializada correctamente")
+                apply_migrations(self.dialect)
+            self._schema_ready = True
+        # Conexiones mínimas del pool, sin hacer esperar a esta petición
+        threading.Thread(target=self.dialect.warm, daemon=True).start()
+    
+    def schema_version(self):
+        """Versión aplicada, la que necesita el código y las migraciones pendientes"""
+        return schema_status(self.dialect)
+    
+    def migrate(self, target=None):
+        """Aplica las migraciones pendientes (lo ejecuta migrate.py una vez por despliegue)"""
+        with self._schema_lock:
+            result = apply_migrations(self.dialect, target=target)
+            if target is None:
+                self._schema_ready = True
+        return result
     
     def authenticate_user(self, username, password):
         """Autentica un usuario"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            self._execute(cursor, "SELECT id, username, role, password FROM users WHERE username = ?",
+                          (username,), prepare='user_by_username')
+            user = fetch_dict(cursor)
         
-        if self.use_postgres:
-            cursor.execute("SELECT username, role FROM users WHERE username = %s AND password = %s", (username, password))
-        else:
-            cursor.execute("SELECT username, role FROM users WHERE username = ? AND password = ?", (username, password))
+        # El hash se calcula en el pool, sin tener una conexión ocupada mientras tanto.
+        # Sin usuario se verifica contra un hash ficticio: mismo coste, no revela si existe
+        ok, needs_rehash = password_hasher.verify(password, user.pop('password') if user else None)
+        if not ok:
+            return None
         
-        result = cursor.fetchone()
-        conn.close()
+        if needs_rehash:
+            # Contraseña heredada en texto plano (o con otro coste): guardar el hash actual
+            new_hash = password_hasher.hash(password)
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                self._execute(cursor, "UPDATE users SET password = ? WHERE id = ?", (new_hash, user['id']))
+                conn.commit()
         
-        if result:
-            return {
-                'username': result[0],
-                'role': result[1]
-            }
-        return None
+        return user
     
     def get_all_users(self):
         """Obtiene todos los usuarios"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT id, username, role, created_at FROM users ORDER BY username")
-        
-        users = []
-        for row in cursor.fetchall():
-            users.append({
-                'id': row[0],
-                'username': row[1],
-                'role': row[2],
-                'created_at': str(row[3]) if row[3] else None
-            })
-        
-        conn.close()
-        return users
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            self._execute(cursor, "SELECT id, username, role, created_at, updated_at FROM users ORDER BY username")
+            return fetch_dicts(cursor)
     
     def add_user(self, username, password, role='user'):
         """Agrega un nuevo usuario"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        # Atajo sin tocar la base de datos; la restricción UNIQUE es la que decide
+        if self.users.get(username):
+            return {'success': False, 'message': f'El usuario {username} ya existe'}
         
+        password = password_hasher.hash(password)
         try:
-            if self.use_postgres:
-                cursor.execute(
-                    "INSERT INTO users (username, password, role) VALUES (%s, %s, %s) RETURNING id",
-                    (username, password, role)
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                user_id = self.dialect.insert_returning_id(
+                    cursor, "INSERT INTO users (username, password, role) VALUES (?, ?, ?)", (username, password, role)
                 )
-                user_id = cursor.fetchone()[0]
-            else:
-                cursor.execute(
-                    "INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
-                    (username, password, role)
+                
+                # Un usuario nuevo empieza sin pendientes: el historial de 'todos' cuenta como leído
+                self._execute(
+                    cursor,
+                    "INSERT INTO read_watermarks (username, last_read_id) SELECT ?, COALESCE(MAX(id), 0) FROM communications",
+                    (username,)
                 )
-                user_id = cursor.lastrowid
-            
-            conn.commit()
-            conn.close()
-            return user_id
-        except Exception as e:
-            conn.close()
-            raise e
+                
+                conn.commit()
+        except INTEGRITY_ERRORS:
+            # Creado por otro proceso o en paralelo: el directorio en memoria aún no lo sabía
+            self.users.invalidate()
+            return {'success': False, 'message': f'El usuario {username} ya existe'}
+        self.users.invalidate()
+        return {'success': True, 'id': user_id, 'message': f'Usuario {username} creado'}
     
     def update_user(self, user_id, username=None, password=None, role=None):
-        """Actualiza un usuario"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        updates = []
-        params = []
-        
-        if username:
-            updates.append("username = %s" if self.use_postgres else "username = ?")
-            params.append(username)
-        if password:
-            updates.append("password = %s" if self.use_postgres else "password = ?")
-            params.append(password)
-        if role:
-            updates.append("role = %s" if self.use_postgres else "role = ?")
-            params.append(role)
-        
-        if updates:
-            updates.append("updated_at = CURRENT_TIMESTAMP")
-            params.append(user_id)
-            
-            query = f"UPDATE users SET {', '.join(updates)} WHERE id = {'%s' if self.use_postgres else '?'}"
-            cursor.execute(query, params)
-            
-            conn.commit()
+        """Actualiza un usuario (los campos que no se indican no cambian)"""
+        if not (username or password or role):
+            return {'success': False, 'message': 'No hay datos para actualizar'}
         
-        conn.close()
+        password = password_hasher.hash(password) if password else None
+        # Texto fijo para cualquier combinación de campos: COALESCE conserva los que llegan vacíos
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                self._execute(
+                    cursor,
+                    "UPDATE users SET username = COALESCE(?, username), password = COALESCE(?, password), "
+                    "role = COALESCE(?, role), updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                    (username or None, password, role or None, user_id)
+                )
+                updated = cursor.rowcount > 0
+                conn.commit()
+        except INTEGRITY_ERRORS:
+            return {'success': False, 'message': f'El usuario {username} ya existe'}
+        self.users.invalidate()
+        if updated:
+            return {'success': True, 'message': 'Usuario actualizado'}
+        return {'success': False, 'message': 'Usuario no encontrado'}
     
     def delete_user(self, user_id):
         """Elimina un usuario"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        if self.use_postgres:
-            cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
-        else:
-            cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-        
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            self._execute(cursor, "SELECT username FROM users WHERE id = ?", (user_id,))
+            row = cursor.fetchone()
+            if not row:
+                return {'success': False, 'message': 'Usuario no encontrado'}
+            username = row[0]
+            
+            self._execute(cursor, "DELETE FROM read_watermarks WHERE username = ?", (username,))
+            self._execute(cursor, "DELETE FROM communication_reads WHERE username = ?", (username,))
+            self._execute(cursor, "DELETE FROM users WHERE id = ?", (user_id,))
+            
+            conn.commit()
+        self.users.invalidate()
+        self.unread.invalidate(username)
+        return {'success': True, 'message': 'Usuario eliminado exitosamente', 'username': username}
     
     def add_communication(self, titulo, mensaje, destinatario, prioridad, remitente, hora):
         """Agrega una nueva comunicación"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        comm_id = self._write_communications([(titulo, mensaje, destinatario, prioridad, remitente, hora)])[0]
+        return {'success': True, 'id': comm_id, 'message': 'Comunicado enviado exitosamente'}
+    
+    def add_communications(self, communications):
+        """Agrega varios comunicados en una sola transacción (un único commit).
+
+        ``communications`` es una lista de diccionarios con titulo, mensaje,
+        destinatario, prioridad, remitente y hora. Devuelve los IDs en el mismo orden.
+        """
+        rows = [
+            (c['titulo'], c['mensaje'], c['destinatario'], c['prioridad'], c['remitente'], c['hora'])
+            for c in communications
+        ]
+        if not rows:
+            return {'success': False, 'message': 'No hay destinatarios'}
         
-        if self.use_postgres:
-            cursor.execute(
-                "INSERT INTO communications (titulo, mensaje, destinatario, prioridad, remitente, hora) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id",
-                (titulo, mensaje, destinatario, prioridad, remitente, hora)
+        ids = self._write_communications(rows)
+        return {'success': True, 'id': ids[0], 'ids': ids, 'message': 'Comunicado enviado exitosamente'}
+    
+    def _write_communications(self, rows):
+        """Inserta filas de comunicados y devuelve sus ids, ya confirmados"""
+        if self.writer is not None:
+            return self.writer.submit(rows)
+        return self._insert_communication_rows(rows)
+    
+    def _insert_communication_rows(self, rows):
+        """Inserta filas (titulo, mensaje, destinatario, prioridad, remitente, hora) en una transacción"""
+        with self.unread.writing(), self.connection() as conn:
+            cursor = conn.cursor()
+            ids = self.dialect.insert_many(
+                cursor, 'communications', ('titulo', 'mensaje', 'destinatario', 'prioridad', 'remitente', 'hora'),
+                rows, returning_id=True
             )
-            comm_id = cursor.fetchone()[0]
-        else:
-            cursor.execute(
-                "INSERT INTO communications (titulo, mensaje, destinatario, prioridad, remitente, hora) VALUES (?, ?, ?, ?, ?, ?)",
-                (titulo, mensaje, destinatario, prioridad, remitente, hora)
+            conn.commit()
+            self.unread.add([row[2] for row in rows])
+        return ids
+    
+    def add_users(self, users):
+        """Alta masiva de usuarios en una sola transacción.
+
+        ``users`` es una lista de diccionarios con username, role y password
+        (en claro) o password_hash (ya en formato scrypt). Los nombres que ya
+        existen no se tocan y se devuelven como conflictos.
+        """
+        if not users:
+            return {'success': True, 'imported': [], 'conflicts': []}
+        
+        plain = [i for i, user in enumerate(users) if not user.get('password_hash')]
+        hashes = password_hasher.hash_many([users[i]['password'] for i in plain])
+        password_hashes = [user.get('password_hash') for user in users]
+        for i, password_hash in zip(plain, hashes):
+            password_hashes[i] = password_hash
+        
+        usernames = [user['username'] for user in users]
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            self._execute(
+                cursor, f"SELECT username FROM users WHERE username IN ({', '.join(['?'] * len(usernames))})", usernames
             )
-            comm_id = cursor.lastrowid
+            existing = {row[0] for row in cursor.fetchall()}
+            rows = [
+                (user['username'], password_hash, user.get('role') or 'user')
+                for user, password_hash in zip(users, password_hashes)
+                if user['username'] not in existing
+            ]
+            
+            if rows:
+                self.dialect.insert_many(cursor, 'users', ('username', 'password', 'role'), rows, conflict='username')
+                
+                # Igual que en add_user: los usuarios nuevos empiezan sin pendientes
+                self._execute(cursor, "SELECT COALESCE(MAX(id), 0) FROM communications")
+                last_id = cursor.fetchone()[0]
+                self.dialect.insert_many(
+                    cursor, 'read_watermarks', ('username', 'last_read_id'),
+                    [(row[0], last_id) for row in rows], conflict='username'
+                )
+            
+            conn.commit()
         
-        conn.commit()
-        conn.close()
-        return comm_id
+        if rows:
+            self.users.invalidate()
+        return {
+            'success': True,
+            'imported': [row[0] for row in rows],
+            'conflicts': [username for username in usernames if username in existing]
+        }
+    
+    def iter_users(self, batch_size=1000, include_password_hashes=False):
+        """Recorre todos los usuarios por orden de ID leyendo de ``batch_size`` en ``batch_size``"""
+        columns = "id, username, role, created_at, updated_at"
+        if include_password_hashes:
+            columns += ", password AS password_hash"
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            self._execute(cursor, f"SELECT {columns} FROM users ORDER BY id")
+            make = row_factory(cursor)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield make(row)
+    
+    def get_existing_usernames(self, usernames):
+        """Devuelve cuáles de los nombres de usuario indicados existen (sin consultar la base de datos)"""
+        return self.users.existing(usernames)
+    
+    def get_user_by_username(self, username):
+        """Usuario por nombre desde el directorio en memoria, o None"""
+        return self.users.get(username)
     
     def get_communications(self, limit=50):
         """Obtiene todas las comunicaciones"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "SELECT id, titulo, mensaje, destinatario, prioridad, remitente, fecha, hora FROM communications ORDER BY fecha DESC LIMIT %s" if self.use_postgres else "SELECT id, titulo, mensaje, destinatario, prioridad, remitente, fecha, hora FROM communications ORDER BY fecha DESC LIMIT ?",
-            (limit,)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            self._execute(
+                cursor,
+                "SELECT id, titulo, mensaje, destinatario, prioridad, remitente, fecha, hora "
+                "FROM communications ORDER BY fecha DESC LIMIT ?",
+                (limit,)
+            )
+            return fetch_dicts(cursor)
+    
+    # Las consultas de listados tienen un texto fijo para cada combinación de
+    # (cursor sí/no, límite sí/no), de modo que cada variante se prepara una vez
+    def _keyset(self, before):
+        """Condición keyset para continuar después de (created_at, id)"""
+        if before is None:
+            return "", ()
+        return " AND (created_at, id) < (?, ?)", tuple(before)
+    
+    def _limit(self, limit):
+        if limit is None:
+            return "", ()
+        return " LIMIT ?", (limit,)
+    
+    def _variant(self, name, before, limit):
+        """Nombre de la sentencia preparada para una variante de listado"""
+        return f"{name}{'_after' if before is not None else ''}{'_page' if limit is not None else ''}"
+    
+    def _recipient_query(self, destinatario, limit=None, before=None, read_state=False):
+        """Bandeja de entrada como UNION ALL de dos rangos del índice (destinatario, created_at).
+
+        Con ``read_state`` cada fila trae además la columna 'leido'.
+        """
+        keyset, keyset_params = self._keyset(before)
+        limit_sql, limit_params = self._limit(limit)
+        columns, column_params = COMMUNICATION_COLUMNS, ()
+        if read_state:
+            columns, column_params = f"{COMMUNICATION_COLUMNS}, {READ_STATE_COLUMN}", (destinatario, destinatario)
+        query = (
+            f"SELECT {columns} FROM communications WHERE destinatario = ?{keyset} "
+            f"UNION ALL "
+            f"SELECT {columns} FROM communications WHERE destinatario = 'todos'{keyset} "
+            f"ORDER BY created_at DESC, id DESC{limit_sql}"
         )
-        
-        communications = []
-        for row in cursor.fetchall():
-            communications.append({
-                'id': row[0],
-                'titulo': row[1],
-                'mensaje': row[2],
-                'destinatario': row[3],
-                'prioridad': row[4],
-                'remitente': row[5],
-                'fecha': str(row[6]) if row[6] else None,
-                'hora': row[7]
-            })
-        
-        conn.close()
-        return communications
+        return query, (column_params + (destinatario,) + keyset_params + column_params + keyset_params
+                       + limit_params)
+    
+    def get_communications_by_recipient(self, destinatario, limit=None, before=None):
+        """Obtiene los comunicados recibidos por un usuario (bandeja de entrada)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            self._execute(cursor, *self._recipient_query(destinatario, limit, before),
+                          prepare=self._variant('inbox', before, limit))
+            return fetch_dicts(cursor)
+    
+    def _sender_query(self, remitente, limit=None, before=None):
+        keyset, keyset_params = self._keyset(before)
+        limit_sql, limit_params = self._limit(limit)
+        query = (
+            f"SELECT {COMMUNICATION_COLUMNS} FROM communications WHERE remitente = ?{keyset} "
+            f"ORDER BY created_at DESC, id DESC{limit_sql}"
+        )
+        return query, (remitente,) + keyset_params + limit_params
+    
+    def _all_query(self, limit=None, before=None):
+        keyset, keyset_params = self._keyset(before)
+        limit_sql, limit_params = self._limit(limit)
+        query = (
+            f"SELECT {COMMUNICATION_COLUMNS} FROM communications WHERE 1 = 1{keyset} "
+            f"ORDER BY created_at DESC, id DESC{limit_sql}"
+        )
+        return query, keyset_params + limit_params
+    
+    def get_communications_by_sender(self, remitente, limit=None, before=None):
+        """Obtiene los comunicados enviados por un usuario"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            self._execute(cursor, *self._sender_query(remitente, limit, before),
+                          prepare=self._variant('sent', before, limit))
+            return fetch_dicts(cursor)
+    
+    def get_all_communications(self, limit=None, before=None):
+        """Obtiene todos los comunicados"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            self._execute(cursor, *self._all_query(limit, before), prepare=self._variant('all', before, limit))
+            return fetch_dicts(cursor)
+    
+    def _iter_communications(self, query, params, batch_size=STREAM_BATCH_SIZE):
+        """Recorre el resultado por lotes sin cargarlo entero en memoria.
+
+        En PostgreSQL usa un cursor con nombre (del lado del servidor); en
+        SQLite, fetchmany sobre el cursor normal, que ya lee bajo demanda.
+        """
+        with self.connection() as conn:
+            cursor = self.dialect.stream_cursor(conn, batch_size)
+            try:
+                self._execute(cursor, query, params)
+                make = None
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    if make is None:
+                        # Un cursor con nombre solo tiene description tras la primera lectura
+                        make = row_factory(cursor)
+                    for row in rows:
+                        yield make(row)
+            finally:
+                # Cerrar el cursor y la transacción de lectura aunque el cliente corte a medias
+                cursor.close()
+                conn.rollback()
+    
+    def stream_communications_by_recipient(self, destinatario, before=None, read_state=False):
+        """Como get_communications_by_recipient, sin límite y fila a fila.
+
+        Con ``read_state`` cada comunicado trae 'leido' de la misma consulta:
+        el recorrido ocupa una sola conexión del pool durante todo el streaming.
+        """
+        rows = self._iter_communications(*self._recipient_query(destinatario, None, before, read_state))
+        if not read_state:
+            return rows
+        return self._with_read_flag(rows)
+    
+    def _with_read_flag(self, rows):
+        """'leido' como booleano (SQLite lo devuelve como 0/1)"""
+        with contextlib.closing(rows):
+            for row in rows:
+                row['leido'] = bool(row['leido'])
+                yield row
+    
+    def stream_communications_by_sender(self, remitente, before=None):
+        """Como get_communications_by_sender, sin límite y fila a fila"""
+        return self._iter_communications(*self._sender_query(remitente, None, before))
+    
+    def stream_all_communications(self, before=None):
+        """Como get_all_communications, sin límite y fila a fila"""
+        return self._iter_communications(*self._all_query(None, before))
     
-    def get_user_communications(self, username, limit=50):
+    def get_user_communications(self, username, limit=50, before=None):
         """Obtiene comunicaciones para un usuario específico"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        return self.get_communications_by_recipient(username, limit, before)
+    
+    def search_communications(self, username, text, scope='inbox', limit=DEFAULT_PAGE_SIZE, offset=0):
+        """Búsqueda de texto completo ordenada por relevancia (título pesa más que el mensaje).
+
+        ``scope`` limita los resultados a lo que el usuario puede ver: 'inbox'
+        (recibidos y 'todos'), 'sent' (enviados) o 'all' (solo administradores;
+        el llamador debe comprobarlo). La última palabra se busca también como
+        prefijo, para poder buscar mientras se escribe.
+        """
+        terms = search_terms(text)
+        if not terms:
+            return []
         
-        if self.use_postgres:
-            cursor.execute(
-                "SELECT id, titulo, mensaje, destinatario, prioridad, remitente, fecha, hora FROM communications WHERE destinatario = %s OR destinatario = 'todos' ORDER BY fecha DESC LIMIT %s",
-                (username, limit)
-            )
+        if scope == 'inbox':
+            scope_sql, scope_params = " AND c.destinatario IN (?, 'todos')", (username,)
+        elif scope == 'sent':
+            scope_sql, scope_params = " AND c.remitente = ?", (username,)
         else:
-            cursor.execute(
-                "SELECT id, titulo, mensaje, destinatario, prioridad, remitente, fecha, hora FROM communications WHERE destinatario = ? OR destinatario = 'todos' ORDER BY fecha DESC LIMIT ?",
-                (username, limit)
-            )
-        
-        communications = []
-        for row in cursor.fetchall():
-            communications.append({
-                'id': row[0],
-                'titulo': row[1],
-                'mensaje': row[2],
-                'destinatario': row[3],
-                'prioridad': row[4],
-                'remitente': row[5],
-                'fecha': str(row[6]) if row[6] else None,
-                'hora': row[7]
-            })
+            scope_sql, scope_params = "", ()
+        columns = ', '.join('c.' + column.strip() for column in COMMUNICATION_COLUMNS.split(','))
+        query = self.dialect.search_query(columns, scope_sql)
         
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            self._execute(cursor, query, (self.dialect.search_match(terms),) + scope_params + (limit, offset),
+                          prepare=f"search_{scope}")
+            return fetch_dicts(cursor)
+    
+    def explain_recipient_query(self, destinatario='usuario1'):
+        """Plan de ejecución de la bandeja de entrada (para verificar el uso de índices)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            return self.dialect.explain(cursor, *self._recipient_query(destinatario, DEFAULT_PAGE_SIZE))
+    
+    def delete_communication(self, comm_id, remitente=None):
+        """Elimina una comunicación; si se indica remitente, solo si le pertenece"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            # Destinatario del comunicado: solo su contador de no leídos puede cambiar
+            if remitente is None:
+                self._execute(cursor, "SELECT destinatario FROM communications WHERE id = ?", (comm_id,))
+            else:
+                self._execute(cursor, "SELECT destinatario FROM communications WHERE id = ? AND remitente = ?",
+                              (comm_id, remitente))
+            row = cursor.fetchone()
+            if row is not None:
+                self._execute(cursor, "DELETE FROM communications WHERE id = ?", (comm_id,))
+            
+            if row is None or cursor.rowcount == 0:
+                conn.rollback()
+                return {'success': False, 'message': 'Comunicado no encontrado o no autorizado'}
+            
+            self._execute(cursor, "DELETE FROM communication_reads WHERE communication_id = ?", (comm_id,))
+            conn.commit()
+        destinatario = row[0]
+        # Borrar es poco frecuente: el contador afectado se recalcula al consultarlo
+        # (el de todos si el comunicado era para 'todos')
+        self.unread.invalidate(None if destinatario == 'todos' else destinatario)
+        return {'success': True, 'destinatario': destinatario, 'message': 'Comunicado eliminado exitosamente'}
+    
+    def _read_state(self, cursor, username):
+        """Marca de agua de lectura del usuario (0 si no tiene)"""
+        self._execute(cursor, "SELECT last_read_id FROM read_watermarks WHERE username = ?", (username,),
+                      prepare='read_watermark')
+        row = cursor.fetchone()
+        return row[0] if row else 0
+    
+    def annotate_read_state(self, username, communications):
+        """Añade 'leido' a comunicados de la bandeja de entrada del usuario"""
+        if not communications:
+            return communications
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            watermark = self._read_state(cursor, username)
+            pending = [c['id'] for c in communications if c['id'] > watermark]
+            read_ids = set()
+            if pending:
+                self._execute(
+                    cursor,
+                    f"SELECT communication_id FROM communication_reads WHERE username = ? "
+                    f"AND communication_id IN ({', '.join(['?'] * len(pending))})",
+                    [username] + pending
+                )
+                read_ids = {row[0] for row in cursor.fetchall()}
+        for communication in communications:
+            communication['leido'] = communication['id'] <= watermark or communication['id'] in read_ids
         return communications
     
-    def delete_communication(self, comm_id):
-        """Elimina una comunicación"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        if self.use_postgres:
-            cursor.execute("DELETE FROM communications WHERE id = %s", (comm_id,))
-        else:
-            cursor.execute("DELETE FROM communications WHERE id = ?", (comm_id,))
-        
-        conn.commit()
-        conn.close()
\ No newline at end of file
+    def get_unread_count(self, username):
+        """Número de comunicados sin leer: rangos de índice por encima de la marca de agua menos excepciones"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            watermark = self._read_state(cursor, username)
+            self._execute(
+                cursor,
+                "SELECT (SELECT COUNT(*) FROM communications WHERE destinatario = ? AND id > ?) "
+                "+ (SELECT COUNT(*) FROM communications WHERE destinatario = 'todos' AND id > ?) "
+                "- (SELECT COUNT(*) FROM communication_reads WHERE username = ? AND communication_id > ?)",
+                (username, watermark, watermark, username, watermark),
+                prepare='unread_count'
+            )
+            return cursor.fetchone()[0]
+    
+    def mark_as_read(self, username, comm_ids=None):
+        """Marca como leídos comunicados de la bandeja del usuario (todos si comm_ids es None).
+
+        Las lecturas por encima de la marca de agua se guardan como excepciones;
+        después la marca avanza mientras los siguientes comunicados de la bandeja
+        estén leídos, y las excepciones que quedan por debajo se borran.
+        """
+        newly_read = 0
+        with self.unread.writing(), self.connection() as conn:
+            cursor = conn.cursor()
+            watermark = self._read_state(cursor, username)
+            
+            if comm_ids is None:
+                # Todo leído: basta con mover la marca de agua al último comunicado de la bandeja
+                self._execute(
+                    cursor, "SELECT MAX(id) FROM communications WHERE destinatario = ? OR destinatario = 'todos'",
+                    (username,)
+                )
+                new_watermark = max(cursor.fetchone()[0] or 0, watermark)
+            else:
+                comm_ids = [int(comm_id) for comm_id in comm_ids if int(comm_id) > watermark]
+                if comm_ids:
+                    # Solo se registran IDs que pertenecen a la bandeja del usuario
+                    self._execute(
+                        cursor,
+                        self.dialect.ignore_conflicts(
+                            f"INSERT INTO communication_reads (username, communication_id) "
+                            f"SELECT ?, id FROM communications WHERE id IN ({', '.join(['?'] * len(comm_ids))}) "
+                            f"AND (destinatario = ? OR destinatario = 'todos')"
+                        ),
+                        [username] + comm_ids + [username]
+                    )
+                    # Filas nuevas = comunicados que no estaban leídos
+                    newly_read = max(cursor.rowcount, 0)
+                
+                # Compactar: avanzar la marca sobre los leídos consecutivos de la bandeja
+                self._execute(
+                    cursor,
+                    "SELECT communication_id FROM communication_reads WHERE username = ? AND communication_id > ? "
+                    "ORDER BY communication_id",
+                    (username, watermark),
+                    prepare='reads_above'
+                )
+                read_ids = [row[0] for row in cursor.fetchall()]
+                self._execute(cursor, *self._unread_ids_query(username, watermark, len(read_ids) + 1),
+                              prepare='inbox_ids_above')
+                new_watermark = watermark
+                read_set = set(read_ids)
+                for (comm_id,) in cursor.fetchall():
+                    if comm_id not in read_set:
+                        break
+                    new_watermark = comm_id
+            
+            if new_watermark != watermark:
+                # La marca solo avanza, aunque haya dos peticiones simultáneas del mismo usuario
+                self._execute(
+                    cursor,
+                    f"INSERT INTO read_watermarks (username, last_read_id) VALUES (?, ?) "
+                    f"ON CONFLICT (username) DO UPDATE SET "
+                    f"last_read_id = {self.dialect.greatest}(read_watermarks.last_read_id, excluded.last_read_id)",
+                    (username, new_watermark)
+                )
+                self._execute(
+                    cursor, "DELETE FROM communication_reads WHERE username = ? AND communication_id <= ?",
+                    (username, new_watermark)
+                )
+            
+            conn.commit()
+            self.unread.read(username, None if comm_ids is None else newly_read)
+        return {'success': True, 'last_read_id': new_watermark}
+    
+    def _unread_ids_query(self, username, after_id, limit):
+        """IDs de la bandeja del usuario por encima de after_id, en orden ascendente"""
+        return (
+            "SELECT id FROM communications WHERE destinatario = ? AND id > ? "
+            "UNION ALL "
+            "SELECT id FROM communications WHERE destinatario = 'todos' AND id > ? "
+            "ORDER BY id LIMIT ?",
+            (username, after_id, after_id, limit)
+        )
+
+
+# Duración de cada método en /metrics (sin los listados en streaming: solo se mediría crear el iterador)
+instrument_methods(UserDatabase, DB_QUERY_DURATION, skip=(
+    'connection', 'stream_communications_by_recipient', 'stream_communications_by_sender', 'stream_all_communications'
+))
@@ -0,0 +1,712 @@
+#!/usr/bin/env python3
+"""
+Dialectos SQL de la capa de datos: PostgreSQL (Render) y SQLite (desarrollo local)
+Cada dialecto presta conexiones y traduce lo poco que cambia entre motores;
+UserDatabase escribe las consultas una sola vez con marcadores '?'.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+try:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.extras
+    POSTGRES_AVAILABLE = True
+except ImportError:
+    POSTGRES_AVAILABLE = False
+
+# Configuración del pool de conexiones (variables de entorno)
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))  # Segundos esperando una conexión libre
+DB_POOL_HEALTHCHECK = float(os.environ.get('DB_POOL_HEALTHCHECK', 30))  # Segundos de inactividad antes de comprobar
+
+# Sentencias preparadas en el servidor (PostgreSQL). Desactivar detrás de un
+# pgbouncer en modo transacción, donde cada transacción puede ir a otra conexión.
+DB_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1').lower() not in ('0', 'false', 'no')
+# Conexiones SQLite abiertas como máximo (se reutilizan entre peticiones)
+SQLITE_POOL_MAX = int(os.environ.get('SQLITE_POOL_MAX', 32))
+# Sentencias compiladas que guarda cada conexión SQLite (por texto de la consulta)
+SQLITE_STATEMENT_CACHE = int(os.environ.get('SQLITE_STATEMENT_CACHE', 256))
+
+# Filas por lote al rellenar la columna de búsqueda en PostgreSQL (cada lote es una transacción)
+SEARCH_BACKFILL_BATCH = int(os.environ.get('SEARCH_BACKFILL_BATCH', 5000))
+
+# Clave del bloqueo consultivo de PostgreSQL que serializa las migraciones
+SCHEMA_LOCK_ID = 727001
+
+# Columnas de fecha que se devuelven como texto en los diccionarios
+TIMESTAMP_COLUMNS = frozenset(('fecha', 'created_at', 'updated_at'))
+
+_PLACEHOLDER = re.compile(r"'[^']*'|\?")
+
+
+def row_factory(cursor):
+    """Función fila -> diccionario para el resultado actual del cursor.
+
+    Los nombres salen de cursor.description una sola vez por consulta; las
+    fechas se convierten a texto para poder serializarlas a JSON.
+    """
+    names = tuple(column[0] for column in cursor.description)
+    timestamps = [name for name in names if name in TIMESTAMP_COLUMNS]
+
+    def make(row):
+        item = dict(zip(names, row))
+        for name in timestamps:
+            value = item[name]
+            item[name] = str(value) if value else None
+        return item
+    return make
+
+
+def fetch_dicts(cursor):
+    """Todas las filas pendientes del cursor como diccionarios"""
+    rows = cursor.fetchall()
+    if not rows:
+        return []
+    make = row_factory(cursor)
+    return [make(row) for row in rows]
+
+
+def fetch_dict(cursor):
+    """Siguiente fila del cursor como diccionario, o None"""
+    row = cursor.fetchone()
+    return row_factory(cursor)(row) if row is not None else None
+
+
+# Violación de una restricción (UNIQUE, PRIMARY KEY...) en cualquiera de los dos motores
+INTEGRITY_ERRORS = (sqlite3.IntegrityError, psycopg2.IntegrityError) if POSTGRES_AVAILABLE else (sqlite3.IntegrityError,)
+
+
+class PoolTimeoutError(Exception):
+    """No se obtuvo una conexión del pool dentro del tiempo límite"""
+
+
+if POSTGRES_AVAILABLE:
+    class PreparedConnection(psycopg2.extensions.connection):
+        """Conexión que recuerda qué sentencias tiene preparadas en el servidor"""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.prepared = set()
+
+
+class ConnectionPool:
+    """Pool de conexiones compartido por todos los hilos del proceso.
+
+    Las conexiones se reutilizan entre peticiones en lugar de abrir una nueva
+    en cada llamada; como mucho hay ``maxconn`` abiertas y quien no encuentra
+    una libre espera hasta ``timeout`` segundos. Cada motor define cómo se abre
+    (``_connect``), cómo se comprueba (``_is_healthy``) y cómo se deja limpia
+    al devolverla (``_reset``).
+    """
+
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self._idle = []  # Pila de (conexión, instante de devolución)
+        self._size = 0  # Conexiones abiertas (libres + prestadas)
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'created': 0,
+            'recycled': 0
+        }
+        # Las conexiones se abren bajo demanda: importar la app no abre ninguna
+
+    def warm(self):
+        """Abrir conexiones hasta tener ``minconn`` (se llama tras el primer uso, en segundo plano)"""
+        while True:
+            with self._cond:
+                if self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                return
+            self.putconn(conn)
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _connect(self):
+        conn = self._open()
+        with self._cond:
+            self._stats['created'] += 1
+        return conn
+
+    def _closed(self, conn):
+        return False
+
+    def _is_healthy(self, conn, idle_since):
+        return not self._closed(conn)
+
+    def _reset(self, conn):
+        """Deshacer la transacción que la conexión tenga abierta"""
+        conn.rollback()
+
+    def getconn(self):
+        """Obtiene una conexión sana, esperando si el pool está agotado"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while not self._idle and self._size >= self.maxconn:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeoutError(f"Sin conexiones libres tras {self.timeout}s")
+                self._cond.wait(remaining)
+            if self._idle:
+                conn, idle_since = self._idle.pop()
+            else:
+                conn, idle_since = None, None
+                self._size += 1
+            waited = time.monotonic() - start
+            self._stats['checkouts'] += 1
+            self._stats['wait_time_total'] += waited
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+
+        # La comprobación y la reconexión se hacen fuera del lock
+        try:
+            if conn is not None and not self._is_healthy(conn, idle_since):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def _discard(self, conn):
+        with self._cond:
+            self._stats['recycled'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def putconn(self, conn, broken=False):
+        """Devuelve una conexión al pool; las rotas se cierran y se reponen"""
+        if not broken and not self._closed(conn):
+            try:
+                self._reset(conn)
+            except Exception:
+                broken = True
+        with self._cond:
+            if broken or self._closed(conn):
+                self._size -= 1
+                self._stats['recycled'] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if broken:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        """Métricas del pool: tamaño, conexiones libres y tiempos de espera"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+            stats['max'] = self.maxconn
+        checkouts = stats['checkouts'] or 1
+        stats['wait_time_avg_ms'] = round(stats.pop('wait_time_total') / checkouts * 1000, 3)
+        stats['wait_time_max_ms'] = round(stats.pop('wait_time_max') * 1000, 3)
+        return stats
+
+    def closeall(self):
+        """Cierra todas las conexiones libres"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            conn.close()
+
+
+class PostgresConnectionPool(ConnectionPool):
+    """Pool de conexiones PostgreSQL.
+
+    Evita abrir una conexión (TCP + TLS + autenticación) en cada llamada. Al
+    entregar una conexión que lleva inactiva más de ``healthcheck_interval``
+    segundos se comprueba con ``SELECT 1``; las conexiones rotas se descartan
+    y se reponen.
+    """
+
+    def __init__(self, dsn, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX,
+                 timeout=DB_POOL_TIMEOUT, healthcheck_interval=DB_POOL_HEALTHCHECK):
+        super().__init__(minconn, maxconn, timeout)
+        self.dsn = dsn
+        self.healthcheck_interval = healthcheck_interval
+
+    def _open(self):
+        return psycopg2.connect(self.dsn, connection_factory=PreparedConnection)
+
+    def _closed(self, conn):
+        return conn.closed
+
+    def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _reset(self, conn):
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+
+
+class SQLiteConnectionPool(ConnectionPool):
+    """Pool de conexiones SQLite: cada conexión abre el archivo y aplica los
+    PRAGMA una sola vez, y conserva su caché de sentencias compiladas entre
+    peticiones aunque cada petición se atienda en un hilo nuevo.
+    """
+
+    def __init__(self, path, minconn=DB_POOL_MIN, maxconn=SQLITE_POOL_MAX, timeout=DB_POOL_TIMEOUT):
+        super().__init__(minconn, maxconn, timeout)
+        self.path = path
+
+    def _open(self):
+        # check_same_thread=False: la conexión pasa de un hilo a otro, pero solo
+        # la usa quien la tiene prestada
+        conn = sqlite3.connect(self.path, timeout=self.timeout, cached_statements=SQLITE_STATEMENT_CACHE,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reset(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+
+
+class SQLiteDialect:
+    """SQLite en modo WAL con un pool de conexiones de larga duración.
+
+    El módulo sqlite3 ya guarda compiladas las últimas sentencias de cada
+    conexión, indexadas por el texto SQL: basta con que cada consulta tenga un
+    texto fijo (parámetros siempre como '?') para que se reutilice. Un hilo que
+    ya tiene una conexión prestada y vuelve a pedir otra recibe la misma.
+    """
+
+    name = 'sqlite'
+    serial = 'INTEGER PRIMARY KEY AUTOINCREMENT'
+    without_rowid = ' WITHOUT ROWID'
+    greatest = 'MAX'
+
+    def __init__(self, path='users.db'):
+        self.path = path
+        self.pool = SQLiteConnectionPool(path)
+        self._local = threading.local()  # Conexión ya prestada al hilo, para los usos anidados
+
+    @contextmanager
+    def connection(self):
+        """Presta una conexión del pool (la que el hilo ya tenga, si la tiene)"""
+        conn = getattr(self._local, 'conn', None)
+        outermost = conn is None
+        if outermost:
+            conn = self._local.conn = self.pool.getconn()
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if outermost:
+                self._local.conn = None
+                self.pool.putconn(conn)
+
+    def stats(self):
+        stats = self.pool.stats()
+        stats.update({'backend': 'sqlite', 'journal_mode': 'wal', 'statement_cache': SQLITE_STATEMENT_CACHE})
+        return stats
+
+    def warm(self):
+        self.pool.warm()
+
+    def table_exists(self, cursor, table):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        return cursor.fetchone() is not None
+
+    # Sin CREATE INDEX CONCURRENTLY: todas las migraciones van en una transacción
+    online_ddl = False
+
+    @contextmanager
+    def schema_lock(self, conn):
+        """En SQLite el bloqueo lo toma cada migración al empezar (``begin``)"""
+        yield
+
+    def begin(self, cursor):
+        """Abre la transacción de una migración con el bloqueo de escritura: una sola a la vez"""
+        cursor.execute("BEGIN IMMEDIATE")
+
+    @contextmanager
+    def autocommit(self, conn):
+        yield
+
+    def create_index(self, cursor, name, table, columns, unique=False, online=False, using=None):
+        if using:
+            raise ValueError(f"SQLite no admite índices {using}")
+        unique_sql = 'UNIQUE ' if unique else ''
+        cursor.execute(f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+    def execute(self, cursor, query, params=(), prepare=None):
+        """Ejecuta una consulta escrita con '?' (``prepare`` solo se usa en PostgreSQL)"""
+        cursor.execute(query, params)
+        return cursor
+
+    def insert_returning_id(self, cursor, query, params):
+        """INSERT de una fila; devuelve el id generado"""
+        cursor.execute(query, params)
+        return cursor.lastrowid
+
+    def ignore_conflicts(self, insert, conflict=None):
+        """Variante de un INSERT que ignora las filas duplicadas"""
+        return insert.replace('INSERT', 'INSERT OR IGNORE', 1)
+
+    def insert_many(self, cursor, table, columns, rows, conflict=None, returning_id=False):
+        """Inserta varias filas; con ``returning_id`` devuelve los ids en el mismo orden"""
+        query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+        if conflict is not None:
+            query = self.ignore_conflicts(query, conflict)
+        if not returning_id:
+            cursor.executemany(query, rows)
+            return None
+        ids = []
+        for row in rows:
+            cursor.execute(query, row)
+            ids.append(cursor.lastrowid)
+        return ids
+
+    def stream_cursor(self, conn, batch_size):
+        """Cursor para recorrer un resultado grande (sqlite3 ya lee bajo demanda)"""
+        return conn.cursor()
+
+    def explain(self, cursor, query, params):
+        cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+        return [row[3] for row in cursor.fetchall()]
+
+    def init_search(self, cursor):
+        """Tabla FTS5 de contenido externo, sin acentos y con índices de prefijo"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'communications_fts'")
+        fts_exists = cursor.fetchone() is not None
+        for statement in SQLITE_SEARCH_SCHEMA:
+            cursor.execute(statement)
+        if not fts_exists:
+            # Indexar los comunicados que ya existían antes de crear la tabla FTS
+            cursor.execute("INSERT INTO communications_fts (communications_fts) VALUES ('rebuild')")
+
+    def search_indexes(self):
+        """La tabla FTS5 ya es el índice: no hay índices de búsqueda aparte"""
+        return []
+
+    def backfill_search(self, cursor, batch_size=SEARCH_BACKFILL_BATCH):
+        """Nada que rellenar: ``init_search`` ya indexa las filas existentes con 'rebuild'"""
+
+    def search_query(self, columns, scope_sql):
+        return (
+            f"SELECT {columns} FROM communications_fts JOIN communications c ON c.id = communications_fts.rowid "
+            f"WHERE communications_fts MATCH ?{scope_sql} "
+            f"ORDER BY bm25(communications_fts, 10.0, 1.0), c.id DESC LIMIT ? OFFSET ?"
+        )
+
+    def search_match(self, terms):
+        return ' '.join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+
+
+class PostgresDialect:
+    """PostgreSQL con pool de conexiones y sentencias preparadas en el servidor.
+
+    Las consultas frecuentes se ejecutan con un nombre (``prepare``): la
+    primera vez en cada conexión se envía ``PREPARE`` y después solo
+    ``EXECUTE``, así el servidor no vuelve a analizar ni planificar la consulta.
+    """
+
+    name = 'postgres'
+    serial = 'SERIAL PRIMARY KEY'
+    without_rowid = ''
+    greatest = 'GREATEST'
+
+    def __init__(self, database_url, prepared_statements=DB_PREPARED_STATEMENTS):
+        self.pool = PostgresConnectionPool(database_url)
+        self.prepared_statements = prepared_statements
+        self._sql = {}
+        self._numbered = {}
+
+    @contextmanager
+    def connection(self):
+        """Presta una conexión del pool"""
+        conn = self.pool.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn, broken=broken)
+
+    def stats(self):
+        return self.pool.stats()
+
+    def warm(self):
+        self.pool.warm()
+
+    def table_exists(self, cursor, table):
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+        return cursor.fetchone()[0]
+
+    # Índices con CREATE INDEX CONCURRENTLY, fuera de transacción y sin bloquear escrituras
+    online_ddl = True
+
+    @contextmanager
+    def schema_lock(self, conn):
+        """Bloqueo consultivo de sesión mientras se migra: un solo proceso a la vez"""
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s)", (SCHEMA_LOCK_ID,))
+        conn.commit()
+        try:
+            yield
+        finally:
+            try:
+                conn.rollback()
+                cursor = conn.cursor()
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_LOCK_ID,))
+                conn.commit()
+            except psycopg2.Error:
+                # Conexión rota: el servidor libera el bloqueo al cerrarse la sesión
+                pass
+
+    def begin(self, cursor):
+        """psycopg2 abre la transacción con la primera sentencia"""
+
+    @contextmanager
+    def autocommit(self, conn):
+        """Sentencias fuera de transacción (CREATE INDEX CONCURRENTLY no admite otra cosa)"""
+        conn.commit()
+        conn.autocommit = True
+        try:
+            yield
+        finally:
+            conn.autocommit = False
+
+    def create_index(self, cursor, name, table, columns, unique=False, online=False, using=None):
+        """CREATE INDEX idempotente; con ``online`` usa CONCURRENTLY (requiere ``autocommit``).
+
+        ``using`` elige el tipo de índice ('gin', 'gist'...); por defecto B-tree.
+        """
+        unique_sql = 'UNIQUE ' if unique else ''
+        using_sql = f' USING {using.upper()}' if using else ''
+        if not online:
+            cursor.execute(f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table}{using_sql} ({columns})")
+            return
+        # Un CREATE INDEX CONCURRENTLY interrumpido deja el índice a medias (no válido): se rehace
+        cursor.execute(
+            "SELECT NOT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = %s",
+            (name,)
+        )
+        row = cursor.fetchone()
+        if row and row[0]:
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        cursor.execute(f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table}{using_sql} ({columns})")
+
+    def sql(self, query):
+        """Consulta con marcadores '?' traducida a '%s' (memorizada por texto)"""
+        translated = self._sql.get(query)
+        if translated is None:
+            translated = self._sql[query] = _PLACEHOLDER.sub(
+                lambda match: '%s' if match.group(0) == '?' else match.group(0), query
+            )
+        return translated
+
+    def _prepared_sql(self, query):
+        """Consulta con marcadores '?' numerados como $1, $2... para PREPARE"""
+        numbered = self._numbered.get(query)
+        if numbered is None:
+            counter = iter(range(1, query.count('?') + 1))
+            numbered = self._numbered[query] = _PLACEHOLDER.sub(
+                lambda match: f"${next(counter)}" if match.group(0) == '?' else match.group(0), query
+            )
+        return numbered
+
+    def execute(self, cursor, query, params=(), prepare=None):
+        """Ejecuta una consulta escrita con '?'; con ``prepare`` usa una sentencia preparada"""
+        if prepare is None or not self.prepared_statements:
+            cursor.execute(self.sql(query), params)
+            return cursor
+        name = f"q_{prepare}"
+        prepared = cursor.connection.prepared
+        if name not in prepared:
+            # PREPARE no es transaccional: sobrevive a un rollback posterior
+            cursor.execute(f"PREPARE {name} AS {self._prepared_sql(query)}")
+            prepared.add(name)
+        if params:
+            cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+        else:
+            cursor.execute(f"EXECUTE {name}")
+        return cursor
+
+    def insert_returning_id(self, cursor, query, params):
+        """INSERT de una fila; devuelve el id generado"""
+        cursor.execute(self.sql(query) + " RETURNING id", params)
+        return cursor.fetchone()[0]
+
+    def ignore_conflicts(self, insert, conflict=None):
+        """Variante de un INSERT que ignora las filas duplicadas"""
+        target = f" ({conflict})" if conflict else ""
+        return f"{insert} ON CONFLICT{target} DO NOTHING"
+
+    def insert_many(self, cursor, table, columns, rows, conflict=None, returning_id=False):
+        """Un único INSERT multi-fila; con ``returning_id`` devuelve los ids en el mismo orden"""
+        query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s"
+        if conflict is not None:
+            query = self.ignore_conflicts(query, conflict)
+        if not returning_id:
+            psycopg2.extras.execute_values(cursor, query, rows)
+            return None
+        result = psycopg2.extras.execute_values(cursor, query + " RETURNING id", rows, fetch=True)
+        return [row[0] for row in result]
+
+    def stream_cursor(self, conn, batch_size):
+        """Cursor con nombre (del lado del servidor) que trae ``batch_size`` filas cada vez"""
+        cursor = conn.cursor(name=f"stream_{threading.get_ident()}_{time.monotonic_ns()}")
+        cursor.itersize = batch_size
+        return cursor
+
+    def explain(self, cursor, query, params):
+        # Sin seq scan disponible, el plan solo lo contiene si ningún índice sirve
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        cursor.execute("EXPLAIN " + self.sql(query), params)
+        return [row[0] for row in cursor.fetchall()]
+
+    def init_search(self, cursor):
+        """Columna tsvector que mantiene un trigger; se rellena con ``backfill_search`` y
+        su índice GIN está en ``search_indexes``.
+
+        Es una columna normal y no GENERATED ... STORED porque añadir una columna
+        generada reescribe la tabla entera con un bloqueo ACCESS EXCLUSIVE.
+        """
+        cursor.execute(
+            "SELECT attgenerated FROM pg_attribute WHERE attrelid = 'communications'::regclass "
+            "AND attname = 'search_vector' AND NOT attisdropped"
+        )
+        row = cursor.fetchone()
+        if row and row[0]:
+            # Columna generada de una versión anterior: ya se mantiene sola
+            return
+        for statement in POSTGRES_SEARCH_SCHEMA:
+            cursor.execute(statement)
+
+    def backfill_search(self, cursor, batch_size=SEARCH_BACKFILL_BATCH):
+        """Rellenar search_vector de las filas anteriores al trigger, por rangos de id.
+
+        Fuera de transacción (``autocommit``) cada lote se confirma solo y bloquea
+        únicamente sus filas; si se interrumpe, se repite sin rehacer lo hecho.
+        """
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM communications")
+        last_id = cursor.fetchone()[0]
+        for start in range(0, last_id, batch_size):
+            cursor.execute(
+                f"UPDATE communications SET search_vector = {POSTGRES_SEARCH_VECTOR.format(row='communications')} "
+                f"WHERE id > %s AND id <= %s AND search_vector IS NULL",
+                (start, start + batch_size)
+            )
+
+    def search_indexes(self):
+        """Índices de búsqueda (nombre, tabla, columnas, tipo) que van aparte de ``init_search``"""
+        return POSTGRES_SEARCH_INDEXES
+
+    def search_query(self, columns, scope_sql):
+        return (
+            f"SELECT {columns} FROM communications c, to_tsquery('spanish', ?) q "
+            f"WHERE c.search_vector @@ q{scope_sql} "
+            f"ORDER BY ts_rank_cd(c.search_vector, q) DESC, c.id DESC LIMIT ? OFFSET ?"
+        )
+
+    def search_match(self, terms):
+        return ' & '.join(terms[:-1] + [f"{terms[-1]}:*"])
+
+
+# Búsqueda de texto completo. PostgreSQL: columna tsvector (configuración 'spanish',
+# título con más peso) mantenida por un trigger, con índice GIN. SQLite: tabla FTS5 de contenido
+# externo sincronizada por triggers, sin acentos y con índices de prefijo.
+POSTGRES_SEARCH_VECTOR = (
+    "setweight(to_tsvector('spanish', coalesce({row}.titulo, '')), 'A') || "
+    "setweight(to_tsvector('spanish', coalesce({row}.mensaje, '')), 'B')"
+)
+POSTGRES_SEARCH_SCHEMA = [
+    # Sin DEFAULT ni GENERATED: solo cambia el catálogo, no reescribe la tabla
+    "ALTER TABLE communications ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    f"""CREATE OR REPLACE FUNCTION communications_search_vector() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := {POSTGRES_SEARCH_VECTOR.format(row='NEW')};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS communications_search_vector ON communications",
+    """CREATE TRIGGER communications_search_vector
+       BEFORE INSERT OR UPDATE OF titulo, mensaje ON communications
+       FOR EACH ROW EXECUTE FUNCTION communications_search_vector()"""
+]
+# Índices de búsqueda (nombre, tabla, columnas, tipo) aparte de la columna: se crean
+# con CONCURRENTLY en una migración sin transacción para no bloquear los envíos
+POSTGRES_SEARCH_INDEXES = [
+    ('idx_communications_search', 'communications', 'search_vector', 'gin')
+]
+SQLITE_SEARCH_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS communications_fts USING fts5(
+           titulo, mensaje, content='communications', content_rowid='id',
+           tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+       )""",
+    """CREATE TRIGGER IF NOT EXISTS communications_fts_insert AFTER INSERT ON communications BEGIN
+           INSERT INTO communications_fts (rowid, titulo, mensaje) VALUES (new.id, new.titulo, new.mensaje);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS communications_fts_delete AFTER DELETE ON communications BEGIN
+           INSERT INTO communications_fts (communications_fts, rowid, titulo, mensaje)
+           VALUES ('delete', old.id, old.titulo, old.mensaje);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS communications_fts_update AFTER UPDATE OF titulo, mensaje ON communications BEGIN
+           INSERT INTO communications_fts (communications_fts, rowid, titulo, mensaje)
+           VALUES ('delete', old.id, old.titulo, old.mensaje);
+           INSERT INTO communications_fts (rowid, titulo, mensaje) VALUES (new.id, new.titulo, new.mensaje);
+       END"""
+]
+
+
+def create_dialect(database_url=None, sqlite_path='users.db'):
+    """PostgreSQL si hay DATABASE_URL y psycopg2; si no, SQLite local ('' fuerza SQLite)"""
+    if database_url is None:
+        database_url = os.environ.get('DATABASE_URL')
+    if POSTGRES_AVAILABLE and database_url:
+        return PostgresDialect(database_url)
+    return SQLiteDialect(sqlite_path)
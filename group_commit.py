@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Escritura agrupada (group commit) de comunicados
+Las peticiones encolan sus filas y un único hilo las confirma por lotes
+"""
+
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+
+# Desactivado por defecto: cada envío hace su propio commit
+GROUP_COMMIT = os.environ.get('GROUP_COMMIT', '0').lower() in ('1', 'true', 'yes')
+# Espera máxima para juntar un lote tras la primera fila (0: solo lo que ya está en cola).
+# Solo se espera mientras hay ráfaga; un envío aislado se confirma sin esperar.
+GROUP_COMMIT_DELAY_MS = float(os.environ.get('GROUP_COMMIT_DELAY_MS', 2))
+# Filas como máximo por transacción
+GROUP_COMMIT_MAX_ROWS = int(os.environ.get('GROUP_COMMIT_MAX_ROWS', 500))
+
+
+class GroupCommitWriter:
+    """Hilo escritor que junta las inserciones de varias peticiones en un commit.
+
+    ``flush`` recibe una lista de filas, las inserta en una transacción y
+    devuelve sus ids en el mismo orden. ``submit`` no vuelve hasta que el lote
+    que contiene sus filas está confirmado, así que quien recibe un id sabe
+    que el comunicado ya es persistente, igual que sin agrupar. Si un lote
+    falla se reintenta petición a petición para que una fila inválida solo
+    haga fallar a la petición que la trajo.
+    """
+
+    def __init__(self, flush, delay_ms=GROUP_COMMIT_DELAY_MS, max_rows=GROUP_COMMIT_MAX_ROWS):
+        self._flush = flush
+        self.delay = delay_ms / 1000.0
+        self.max_rows = max_rows
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'rows': 0, 'batches': 0, 'max_batch_rows': 0, 'retried_batches': 0}
+        self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+        self._thread.start()
+
+    def submit(self, rows):
+        """Encola las filas de una petición y espera a su commit; devuelve sus ids"""
+        future = concurrent.futures.Future()
+        self._queue.put((rows, future))
+        return future.result()
+
+    def close(self):
+        """Confirmar lo pendiente y parar el hilo escritor"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def stats(self):
+        """Lotes confirmados y filas por lote, para monitorización"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['avg_batch_rows'] = round(stats['rows'] / stats['batches'], 2) if stats['batches'] else 0
+        return stats
+
+    def _run(self):
+        bursting = False
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            rows = len(item[0])
+            stop = False
+            # Con una sola petición a la vista no compensa esperar a que lleguen más
+            waiting = bursting or not self._queue.empty()
+            deadline = time.monotonic() + (self.delay if waiting else 0)
+            while rows < self.max_rows:
+                try:
+                    remaining = deadline - time.monotonic()
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                rows += len(item[0])
+            self._commit(batch)
+            bursting = len(batch) > 1
+            if stop:
+                return
+
+    def _commit(self, batch):
+        rows = [row for request_rows, _ in batch for row in request_rows]
+        try:
+            ids = self._flush(rows)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # La transacción se deshizo entera: repetir cada petición por separado
+            with self._lock:
+                self._stats['retried_batches'] += 1
+            for request_rows, future in batch:
+                try:
+                    ids = self._flush(request_rows)
+                except Exception as request_error:
+                    future.set_exception(request_error)
+                    continue
+                self._record(1, len(request_rows))
+                future.set_result(ids)
+            return
+
+        self._record(len(batch), len(rows))
+        position = 0
+        for request_rows, future in batch:
+            future.set_result(ids[position:position + len(request_rows)])
+            position += len(request_rows)
+
+    def _record(self, requests, rows):
+        with self._lock:
+            self._stats['requests'] += requests
+            self._stats['rows'] += rows
+            self._stats['batches'] += 1
+            self._stats['max_batch_rows'] = max(self._stats['max_batch_rows'], rows)
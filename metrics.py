@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Métricas de latencia y contadores en formato de texto de Prometheus
+Cada hilo escribe en sus propios contadores, sin locks; /metrics los suma al leerlos.
+"""
+
+import bisect
+import functools
+import inspect
+import os
+import threading
+import time
+
+# Límites (segundos) de los histogramas de latencia
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Si se define, /metrics exige 'Authorization: Bearer <METRICS_TOKEN>'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Hilos terminados que se dejan acumular antes de fusionar sus contadores
+_MAX_SHARDS = 256
+
+
+class MetricsRegistry:
+    """Registro de métricas con un almacén por hilo.
+
+    ``observe``/``inc`` solo tocan el diccionario del hilo que llama, así que
+    no hay contención entre peticiones. ``render`` recorre todos los almacenes
+    y suma; los de hilos que ya terminaron se fusionan en un acumulado para
+    que servidores con un hilo por conexión no crezcan sin límite.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []  # (hilo, almacén)
+        self._retired = {}
+        self._metrics = {}  # nombre -> métrica, en orden de registro
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                if len(self._shards) >= _MAX_SHARDS:
+                    self._retire_dead()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead(self):
+        """Fusionar en el acumulado los almacenes de hilos terminados (requiere _lock)"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                _merge(self._retired, shard)
+        self._shards = alive
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labels, buckets))
+
+    def counter(self, name, documentation, labels=()):
+        """Contador acumulado; por convención el nombre termina en _total"""
+        return self._register(Counter(self, name, documentation, labels))
+
+    def gauge(self, name, documentation, callback, labels=(), kind='gauge'):
+        """Valor calculado al leer /metrics: ``callback`` devuelve un número o {etiquetas: número}.
+
+        Con ``kind='counter'`` expone un total que ya lleva otro módulo.
+        """
+        return self._register(Gauge(self, name, documentation, labels, callback, kind))
+
+    def snapshot(self):
+        """Suma de todos los hilos: {(nombre, etiquetas): valores}"""
+        with self._lock:
+            self._retire_dead()
+            totals = {}
+            _merge(totals, self._retired)
+            for _, shard in self._shards:
+                # list() copia de una vez: el hilo dueño puede añadir series mientras tanto
+                _merge(totals, dict(list(shard.items())))
+            metrics = list(self._metrics.values())
+        return metrics, totals
+
+    def render(self):
+        """Texto de exposición de Prometheus (versión 0.0.4)"""
+        metrics, totals = self.snapshot()
+        by_metric = {}
+        for (name, label_values), values in totals.items():
+            by_metric.setdefault(name, []).append((label_values, values))
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render(sorted(by_metric.get(metric.name, []))))
+        return '\n'.join(lines) + '\n'
+
+
+def _merge(target, source):
+    for key, values in source.items():
+        current = target.get(key)
+        if current is None:
+            target[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                current[i] += value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labels, buckets):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, seconds, *label_values):
+        """Registrar una duración (o cualquier valor) con sus etiquetas en orden"""
+        shard = self._registry._shard()
+        key = (self.name, label_values)
+        series = shard.get(key)
+        if series is None:
+            # Un contador por intervalo (el último es +Inf) y la suma al final
+            series = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, seconds)] += 1
+        series[-1] += seconds
+
+    def time(self, *label_values):
+        """Context manager que mide el bloque"""
+        return _Timer(self, label_values)
+
+    def render(self, series):
+        lines = []
+        for label_values, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                le = 'le="' + _format_value(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(values[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'label_values', 'start')
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+        return False
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, registry, name, documentation, labels):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def inc(self, *label_values, amount=1):
+        shard = self._registry._shard()
+        key = (self.name, label_values)
+        series = shard.get(key)
+        if series is None:
+            series = shard[key] = [0]
+        series[0] += amount
+
+    def render(self, series):
+        return [f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(values[0])}"
+                for label_values, values in series]
+
+
+class Gauge:
+    def __init__(self, registry, name, documentation, labels, callback, kind='gauge'):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.callback = callback
+
+    def render(self, series):
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(number)}"
+                for label_values, number in sorted(value.items()) if number is not None]
+
+
+def instrument_methods(cls, histogram, skip=()):
+    """Medir con ``histogram`` (etiqueta: nombre del método) los métodos públicos de una clase.
+
+    Los generadores y los métodos que devuelven uno (``skip``) se dejan tal
+    cual: medirían la creación del iterador, no la consulta.
+    """
+    for name, method in list(vars(cls).items()):
+        if name.startswith('_') or name in skip or not inspect.isfunction(method):
+            continue
+        if inspect.isgeneratorfunction(method):
+            continue
+        setattr(cls, name, _timed(method, histogram, name))
+    return cls
+
+
+def _timed(method, histogram, name):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start, name)
+    return wrapper
+
+
+def authorized(authorization_header):
+    """True si la petición puede leer /metrics"""
+    if not METRICS_TOKEN:
+        return True
+    return authorization_header == f'Bearer {METRICS_TOKEN}'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Registro compartido por todo el proceso
+metrics = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = metrics.histogram(
+    'http_request_duration_seconds', 'Duración de las peticiones HTTP por ruta', ('method', 'route', 'status')
+)
+DB_QUERY_DURATION = metrics.histogram(
+    'db_query_duration_seconds', 'Duración de cada método de UserDatabase', ('method',)
+)
+JSON_ENCODE_DURATION = metrics.histogram(
+    'json_encode_duration_seconds', 'Tiempo serializando respuestas JSON', ('route',)
+)
+JWT_VERIFY_DURATION = metrics.histogram(
+    'jwt_verify_duration_seconds', 'Verificación de tokens JWT', ('result',)
+)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Migración del esquema de la base de datos, una vez por despliegue
+Los workers solo comprueban la versión en schema_version; las migraciones de
+migrations/ se aplican aquí, en orden, antes de arrancar el servidor:
+
+    python3 migrate.py                      # aplicar lo pendiente
+    python3 migrate.py --target 2           # aplicar hasta la versión 2
+    python3 migrate.py --status             # versión aplicada, necesaria y pendientes
+    python3 migrate.py --new indice_prioridad  # crear migrations/NNNN_indice_prioridad.py
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+
+from schema_migrations import MIGRATIONS_DIR, MigrationError, discover, latest_version
+
+TEMPLATE = '''"""
+{description}
+"""
+
+# Descomentar para crear índices con CREATE INDEX CONCURRENTLY en PostgreSQL
+# (fuera de transacción: cada sentencia debe poder repetirse sin error)
+# TRANSACTIONAL = False
+
+
+def upgrade(migration):
+    # migration.execute("ALTER TABLE communications ADD COLUMN ...")
+    # migration.create_index('idx_nombre', 'communications', 'columna1, columna2')
+    pass
+'''
+
+
+def new_migration(name):
+    """Crear el siguiente archivo de migración numerado y devolver su ruta"""
+    if not re.fullmatch(r'\w+', name):
+        raise SystemExit('El nombre solo admite letras, números y _')
+    version = latest_version(discover()) + 1
+    path = os.path.join(MIGRATIONS_DIR, f'{version:04d}_{name}.py')
+    with open(path, 'x', encoding='utf-8') as f:
+        f.write(TEMPLATE.format(description=name.replace('_', ' ').capitalize()))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crear o actualizar el esquema de la base de datos')
+    parser.add_argument('--status', action='store_true', help='Solo mostrar la versión del esquema')
+    parser.add_argument('--target', type=int, help='Aplicar solo hasta esta versión')
+    parser.add_argument('--new', metavar='NOMBRE', help='Crear un archivo de migración vacío con la siguiente versión')
+    args = parser.parse_args()
+
+    if args.new:
+        print(new_migration(args.new))
+        return
+
+    from database_postgres import UserDatabase
+    db = UserDatabase(group_commit=False)
+    if args.status:
+        status = db.schema_version()
+        print(json.dumps(status))
+        sys.exit(1 if status['pending'] else 0)
+
+    try:
+        result = db.migrate(target=args.target)
+    except MigrationError as e:
+        print(json.dumps({'success': False, 'message': str(e)}, ensure_ascii=False))
+        sys.exit(1)
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Tablas de usuarios, comunicados y estado de lectura, y usuarios por defecto
+Es el esquema que antes creaba init_database; en una base que ya lo tenía no cambia nada.
+"""
+
+DEFAULT_USERS = [
+    ('admin', 'admin123', 'admin'),
+    ('usuario1', 'pass123', 'user'),
+    ('usuario2', 'pass456', 'user'),
+    ('gerente', 'gerente123', 'manager')
+]
+
+
+def upgrade(migration):
+    serial = migration.dialect.serial
+    without_rowid = migration.dialect.without_rowid
+
+    migration.execute(f'''
+        CREATE TABLE IF NOT EXISTS users (
+            id {serial},
+            username VARCHAR(255) UNIQUE NOT NULL,
+            password VARCHAR(255) NOT NULL,
+            role VARCHAR(50) NOT NULL DEFAULT 'user',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    migration.execute(f'''
+        CREATE TABLE IF NOT EXISTS communications (
+            id {serial},
+            titulo VARCHAR(255) NOT NULL,
+            mensaje TEXT NOT NULL,
+            destinatario VARCHAR(255) NOT NULL,
+            prioridad VARCHAR(50) NOT NULL DEFAULT 'normal',
+            remitente VARCHAR(255) NOT NULL,
+            fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            hora VARCHAR(10) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Estado de lectura disperso: cada usuario tiene una marca de agua (todo id <= last_read_id
+    # está leído) y solo se guardan como excepción los leídos por encima de ella. Un
+    # comunicado a 'todos' sigue siendo una única fila en communications.
+    migration.execute(f'''
+        CREATE TABLE IF NOT EXISTS read_watermarks (
+            username VARCHAR(255) PRIMARY KEY,
+            last_read_id INTEGER NOT NULL DEFAULT 0
+        ){without_rowid}
+    ''')
+    migration.execute(f'''
+        CREATE TABLE IF NOT EXISTS communication_reads (
+            username VARCHAR(255) NOT NULL,
+            communication_id INTEGER NOT NULL,
+            PRIMARY KEY (username, communication_id)
+        ){without_rowid}
+    ''')
+
+    insert = migration.dialect.ignore_conflicts(
+        "INSERT INTO users (username, password, role) VALUES (?, ?, ?)", 'username'
+    )
+    for user in DEFAULT_USERS:
+        migration.execute(insert, user)
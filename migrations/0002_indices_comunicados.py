@@ -0,0 +1,18 @@
+"""
+Índices compuestos de comunicados: cada bandeja se resuelve con un rango de índice ya ordenado
+"""
+
+# Fuera de transacción: en PostgreSQL se crean con CONCURRENTLY, sin bloquear los envíos
+TRANSACTIONAL = False
+
+INDEXES = [
+    ('idx_communications_destinatario_created', 'communications', 'destinatario, created_at, id'),
+    ('idx_communications_remitente_created', 'communications', 'remitente, created_at, id'),
+    ('idx_communications_created', 'communications', 'created_at, id'),
+    ('idx_communications_destinatario_id', 'communications', 'destinatario, id')
+]
+
+
+def upgrade(migration):
+    for name, table, columns in INDEXES:
+        migration.create_index(name, table, columns)
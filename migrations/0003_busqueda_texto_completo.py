@@ -0,0 +1,11 @@
+"""
+Texto completo de comunicados: tabla FTS5 en SQLite y columna tsvector en PostgreSQL
+En PostgreSQL la columna es normal, sin DEFAULT, y la mantiene un trigger: añadirla
+solo toca el catálogo (un bloqueo ACCESS EXCLUSIVE de milisegundos, sin reescribir la
+tabla). Las filas anteriores se rellenan por lotes en 0005 y el índice GIN se crea
+con CONCURRENTLY en 0004.
+"""
+
+
+def upgrade(migration):
+    migration.dialect.init_search(migration.cursor)
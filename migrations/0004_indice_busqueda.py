@@ -0,0 +1,11 @@
+"""
+Índice GIN de la búsqueda de texto completo (solo PostgreSQL; en SQLite la tabla FTS5 ya es el índice)
+"""
+
+# Fuera de transacción: en PostgreSQL se crea con CONCURRENTLY, sin bloquear los envíos
+TRANSACTIONAL = False
+
+
+def upgrade(migration):
+    for name, table, columns, using in migration.dialect.search_indexes():
+        migration.create_index(name, table, columns, using=using)
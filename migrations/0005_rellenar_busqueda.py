@@ -0,0 +1,11 @@
+"""
+Rellenar la columna de búsqueda de los comunicados anteriores a 0003 (solo PostgreSQL)
+Lotes por rango de id, cada uno en su propia transacción: solo bloquea las filas del lote.
+"""
+
+# Fuera de transacción: cada lote se confirma por separado y, si se interrumpe, se retoma
+TRANSACTIONAL = False
+
+
+def upgrade(migration):
+    migration.dialect.backfill_search(migration.cursor)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Hash de contraseñas con scrypt en un pool de hilos acotado
+Las contraseñas antiguas en texto plano se migran en el primer login correcto
+"""
+
+import base64
+import concurrent.futures
+import hashlib
+import hmac
+import os
+import threading
+
+# Coste de scrypt (N debe ser potencia de 2); memoria usada ~ 128 * N * r bytes
+SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 14))
+SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', 8))
+SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', 1))
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+# Hilos que calculan hashes a la vez y peticiones que pueden esperar turno
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 256))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+# Hilos del pool que puede ocupar una importación masiva; el resto quedan para los logins
+PASSWORD_BULK_WORKERS = int(os.environ.get('PASSWORD_BULK_WORKERS', max(1, PASSWORD_HASH_WORKERS // 2)))
+
+
+class PasswordHasherBusy(Exception):
+    """Demasiados logins pendientes: mejor rechazar que acumular esperas"""
+    pass
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def _b64decode(data):
+    return base64.b64decode(data.encode('ascii'))
+
+
+def _scrypt(password, salt, n, r, p):
+    # maxmem por encima del mínimo que pide OpenSSL para estos parámetros
+    return hashlib.scrypt(
+        password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+        maxmem=256 * n * r * p + 1024 * 1024, dklen=KEY_BYTES
+    )
+
+
+def hash_password(password, n=None, r=None, p=None):
+    """Hash en formato ``scrypt$n$r$p$sal$clave`` (cálculo síncrono)"""
+    n, r, p = n or SCRYPT_N, r or SCRYPT_R, p or SCRYPT_P
+    salt = os.urandom(SALT_BYTES)
+    key = _scrypt(password, salt, n, r, p)
+    return f"scrypt${n}${r}${p}${_b64encode(salt)}${_b64encode(key)}"
+
+
+def is_hashed(stored):
+    return stored.startswith('scrypt$')
+
+
+def check_password(password, stored):
+    """Comprobar una contraseña (cálculo síncrono).
+
+    Devuelve (correcta, necesita_rehash). Un valor sin prefijo se trata como
+    texto plano heredado y siempre pide rehash si coincide.
+    """
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8')), True
+    try:
+        _, n, r, p, salt, key = stored.split('$')
+        n, r, p = int(n), int(r), int(p)
+        expected = _b64decode(key)
+        candidate = _scrypt(password, _b64decode(salt), n, r, p)
+    except ValueError:
+        return False, False
+    ok = hmac.compare_digest(candidate, expected)
+    return ok, ok and (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+_dummy_hash = None
+
+
+def dummy_hash():
+    """Hash de una contraseña aleatoria con el coste actual (se calcula una vez).
+
+    Los logins de usuarios inexistentes se comprueban contra él para que
+    tarden lo mismo que los de usuarios reales y el tiempo de respuesta no
+    revele qué nombres existen.
+    """
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(_b64encode(os.urandom(SALT_BYTES)))
+    return _dummy_hash
+
+
+def _check_plaintext(password, stored):
+    """Texto plano heredado con el mismo coste que un hash scrypt"""
+    check_password(password, dummy_hash())
+    return check_password(password, stored)
+
+
+class PasswordHasher:
+    """Ejecuta scrypt en un pool de hilos con un máximo de trabajos pendientes.
+
+    hashlib libera el GIL durante scrypt, así que los hilos del pool usan
+    varios núcleos mientras el resto de peticiones siguen atendiéndose. Si la
+    cola está llena se lanza PasswordHasherBusy en lugar de esperar.
+    """
+
+    def __init__(self, workers=PASSWORD_HASH_WORKERS, max_pending=PASSWORD_HASH_QUEUE,
+                 timeout=PASSWORD_HASH_TIMEOUT, bulk_workers=PASSWORD_BULK_WORKERS):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='password-hash'
+        )
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._bulk_slots = threading.BoundedSemaphore(max(1, min(bulk_workers, workers)))
+        self.rejected = 0
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordHasherBusy('Demasiados inicios de sesión simultáneos')
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            raise PasswordHasherBusy('Tiempo de espera agotado calculando el hash')
+
+    def hash(self, password):
+        """Hash de una contraseña nueva"""
+        return self._run(hash_password, password)
+
+    def hash_many(self, passwords):
+        """Hashes de varias contraseñas (importación masiva).
+
+        Pasan por el mismo pool y la misma cola que los logins, pero con como
+        mucho ``bulk_workers`` en curso: una importación nunca ocupa todos los
+        hilos y un login espera, a lo sumo, detrás de esos pocos trabajos. Aquí
+        se espera turno en vez de lanzar PasswordHasherBusy.
+        """
+        futures = []
+        for password in passwords:
+            self._bulk_slots.acquire()
+            self._slots.acquire()
+            try:
+                future = self._executor.submit(hash_password, password)
+            except BaseException:
+                self._slots.release()
+                self._bulk_slots.release()
+                raise
+            future.add_done_callback(self._release_bulk)
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def _release_bulk(self, future):
+        self._slots.release()
+        self._bulk_slots.release()
+
+    def verify(self, password, stored):
+        """(correcta, necesita_rehash) para la contraseña guardada (None: usuario inexistente).
+
+        Todas las ramas cuestan un scrypt, así que el tiempo de respuesta no
+        distingue un usuario inexistente, uno con contraseña heredada en texto
+        plano y uno con hash.
+        """
+        if stored is None:
+            self._run(check_password, password, dummy_hash())
+            return False, False
+        if not is_hashed(stored):
+            return self._run(_check_plaintext, password, stored)
+        return self._run(check_password, password, stored)
+
+
+# Pool compartido por todo el proceso
+password_hasher = PasswordHasher()
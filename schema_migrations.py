@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Migraciones versionadas del esquema, comunes a PostgreSQL y SQLite
+Cada archivo de migrations/ se llama NNNN_descripcion.py y define ``upgrade(migration)``.
+Se aplican en orden y cada versión aplicada queda anotada en la tabla schema_version.
+"""
+
+import importlib.util
+import os
+import re
+import time
+
+from structured_logging import get_logger
+
+logger = get_logger('migrations')
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+_FILENAME = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+
+class MigrationError(Exception):
+    """Una migración falló; su transacción se deshizo y la versión no se anotó"""
+
+
+class Migration:
+    """Un archivo de migración: versión, nombre y módulo (cargado al aplicarlo).
+
+    Por defecto ``upgrade`` se ejecuta dentro de una transacción junto con la
+    anotación de la versión: o se aplica entera o no se aplica. Un archivo con
+    ``TRANSACTIONAL = False`` se ejecuta fuera de transacción en PostgreSQL
+    para crear índices con CONCURRENTLY; sus sentencias deben ser idempotentes
+    porque, si se interrumpe, se repite entera.
+    """
+
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        self._module = None
+
+    @property
+    def module(self):
+        if self._module is None:
+            spec = importlib.util.spec_from_file_location(f'migrations.m{self.version:04d}_{self.name}', self.path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            self._module = module
+        return self._module
+
+    @property
+    def transactional(self):
+        return getattr(self.module, 'TRANSACTIONAL', True)
+
+    def __repr__(self):
+        return f'{self.version:04d}_{self.name}'
+
+
+class MigrationContext:
+    """Lo que recibe ``upgrade``: el dialecto, un cursor y atajos que resuelven las diferencias"""
+
+    def __init__(self, dialect, cursor, online=False):
+        self.dialect = dialect
+        self.cursor = cursor
+        self.online = online
+
+    def execute(self, query, params=()):
+        """Sentencia escrita con marcadores '?'"""
+        return self.dialect.execute(self.cursor, query, params)
+
+    def create_index(self, name, table, columns, unique=False, using=None):
+        """Índice idempotente (``using``: tipo, p. ej. 'gin'); fuera de transacción en
+        PostgreSQL se crea sin bloquear escrituras"""
+        self.dialect.create_index(self.cursor, name, table, columns, unique=unique, online=self.online, using=using)
+
+
+def discover(directory=MIGRATIONS_DIR):
+    """Migraciones del directorio ordenadas por versión"""
+    migrations = {}
+    for filename in sorted(os.listdir(directory)):
+        match = _FILENAME.match(filename)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise MigrationError(f"Versión {version} repetida: {migrations[version]} y {filename}")
+        migrations[version] = Migration(version, match.group(2), os.path.join(directory, filename))
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def latest_version(migrations=None):
+    migrations = discover() if migrations is None else migrations
+    return migrations[-1].version if migrations else 0
+
+
+def current_version(dialect, cursor):
+    """Versión aplicada (0 si la base está vacía)"""
+    if not dialect.table_exists(cursor, 'schema_version'):
+        return 0
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    return cursor.fetchone()[0] or 0
+
+
+def status(dialect, migrations=None):
+    """Versión aplicada, la última disponible y las migraciones pendientes"""
+    migrations = discover() if migrations is None else migrations
+    with dialect.connection() as conn:
+        current = current_version(dialect, conn.cursor())
+    return {
+        'current': current,
+        'required': latest_version(migrations),
+        'pending': [repr(migration) for migration in migrations if migration.version > current]
+    }
+
+
+def apply_migrations(dialect, migrations=None, target=None):
+    """Aplica en orden las migraciones pendientes (hasta ``target`` si se indica)"""
+    migrations = discover() if migrations is None else migrations
+    applied = []
+    with dialect.connection() as conn, dialect.schema_lock(conn):
+        start = current_version(dialect, conn.cursor())
+        for migration in migrations:
+            if migration.version <= start or (target is not None and migration.version > target):
+                continue
+            try:
+                if _apply(dialect, conn, migration):
+                    applied.append(repr(migration))
+            except Exception as e:
+                conn.rollback()
+                logger.exception("Migración fallida", extra={'migration': repr(migration)})
+                raise MigrationError(f"{migration!r}: {e}") from e
+        final = current_version(dialect, conn.cursor())
+        conn.commit()
+
+    if not applied:
+        return {'success': True, 'message': 'El esquema ya está al día', 'from': start, 'to': final, 'applied': []}
+    return {'success': True, 'message': 'Esquema migrado', 'from': start, 'to': final, 'applied': applied}
+
+
+def _apply(dialect, conn, migration):
+    """Aplica una migración; False si otro proceso ya la había aplicado"""
+    start = time.perf_counter()
+    if migration.transactional or not dialect.online_ddl:
+        cursor = conn.cursor()
+        dialect.begin(cursor)
+        # Con el bloqueo ya tomado: otro proceso pudo aplicarla mientras esperábamos
+        if current_version(dialect, cursor) >= migration.version:
+            conn.commit()
+            return False
+        migration.module.upgrade(MigrationContext(dialect, cursor))
+        _record(dialect, cursor, migration)
+        conn.commit()
+    else:
+        with dialect.autocommit(conn):
+            migration.module.upgrade(MigrationContext(dialect, conn.cursor(), online=True))
+        cursor = conn.cursor()
+        _record(dialect, cursor, migration)
+        conn.commit()
+    logger.info("Migración aplicada", extra={
+        'migration': repr(migration), 'duration_ms': round((time.perf_counter() - start) * 1000, 1)
+    })
+    return True
+
+
+def _record(dialect, cursor, migration):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    dialect.execute(cursor, dialect.ignore_conflicts("INSERT INTO schema_version (version) VALUES (?)", 'version'),
+                    (migration.version,))
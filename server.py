@@ -15,18 +15,87 @@ import hashlib
 import time
 import threading
 import queue
-from database_postgres import UserDatabase
+import collections
+import logging
+import re
+from database_postgres import (UserDatabase, decode_cursor, page_size, paginate, iter_json_listing,
+                               SEARCH_SCOPES, encode_offset_cursor, decode_offset_cursor, normalize_recipients)
+from token_cache import VerifiedTokenCache
+from password_hashing import PasswordHasherBusy
+from token_revocation import TokenRevocationStore
+from static_cache import StaticAssetCache, etag_matches
+from user_bulk import import_users, export_users, detect_format, FORMATS as BULK_FORMATS, CONTENT_TYPES as BULK_CONTENT_TYPES
+from metrics import (metrics, HTTP_REQUEST_DURATION, JSON_ENCODE_DURATION, JWT_VERIFY_DURATION,
+                     CONTENT_TYPE as METRICS_CONTENT_TYPE, authorized as metrics_authorized)
+from structured_logging import get_logger, dropped_records
+
+logger = get_logger('server')
 
 # Inicializar base de datos
 db = UserDatabase()
 
+# Recursos estáticos servidos desde memoria (comprimidos al primer uso, con ETag)
+STATIC_FILES = ['simple.html', 'sw.js', 'manifest.json', 'icon-192x192.svg', 'test.html']
+static_assets = StaticAssetCache('.', STATIC_FILES)
+# El token de /api/events?token=... no debe acabar en el log de acceso
+TOKEN_QUERY_RE = re.compile(r'([?&]token=)[^&\s"]*')
+
+def redact_tokens(args):
+    """Argumentos de un mensaje de log con el valor de ?token= sustituido por ***"""
+    return tuple(TOKEN_QUERY_RE.sub(r'\1***', arg) if isinstance(arg, str) else arg for arg in args)
+
 # Clave secreta para JWT (en producción usar variable de entorno)
 JWT_SECRET = "mi_clave_secreta_super_segura_2024"
 
+# Tokens ya verificados: evita repetir HMAC y decodificación en cada petición
+verified_tokens = VerifiedTokenCache()
+
+# Revocación compartida entre procesos (logout y usuarios eliminados)
+token_revocations = TokenRevocationStore()
+
 # Variables globales para Server-Sent Events
-sse_clients = []  # Lista de clientes conectados
+sse_clients = {}  # Clientes conectados: id(client_info) -> client_info
+sse_channels = {}  # Suscripciones: canal -> {id(client_info): client_info}
 sse_lock = threading.Lock()  # Lock para acceso thread-safe
 
+# Límites de concurrencia del servidor (configurables por variable de entorno)
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 32))  # Hilos para peticiones REST
+MAX_SSE_CLIENTS = int(os.environ.get('MAX_SSE_CLIENTS', 1000))  # Conexiones SSE abiertas
+HANDLER_TIMEOUT = float(os.environ.get('HANDLER_TIMEOUT', 30))  # Segundos de inactividad del socket
+
+# Cola de salida de cada cliente SSE
+SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', 100))  # Eventos pendientes por cliente
+SSE_OVERFLOW_POLICY = os.environ.get('SSE_OVERFLOW_POLICY', 'drop_oldest')  # 'drop_oldest' o 'disconnect'
+SSE_KEEPALIVE_INTERVAL = 30  # Segundos sin eventos antes de enviar un keep-alive
+sse_dropped_total = 0  # Eventos descartados por colas llenas (todos los clientes)
+sse_dropped_lock = threading.Lock()  # Protege sse_dropped_total: cada cliente solo tiene su propio lock
+
+# Reanudación con Last-Event-ID: buffer circular de eventos recientes por canal
+SSE_REPLAY_SIZE = int(os.environ.get('SSE_REPLAY_SIZE', 500))  # Eventos guardados por canal
+SSE_FIRST_EVENT_ID = int(time.time() * 1000)  # Los IDs empiezan en el arranque: un reinicio se detecta como hueco
+sse_last_event_id = SSE_FIRST_EVENT_ID - 1  # Último ID asignado (protegido por sse_lock)
+sse_replay = {}  # canal -> deque de (event_id, mensaje)
+sse_replay_evicted = {}  # canal -> ID más alto expulsado del buffer
+
+# Métricas de SSE: reparto de eventos y espera del lock global
+SSE_FANOUT_DURATION = metrics.histogram(
+    'sse_broadcast_duration_seconds', 'Tiempo en serializar y encolar un evento para sus destinatarios'
+)
+SSE_LOCK_WAIT = metrics.histogram('sse_lock_wait_seconds', 'Espera para obtener sse_lock al publicar un evento')
+SSE_FANOUT_RECIPIENTS = metrics.histogram(
+    'sse_broadcast_recipients', 'Clientes SSE que reciben cada evento', buckets=(0, 1, 10, 100, 1000, 10000)
+)
+metrics.gauge('sse_clients', 'Clientes SSE conectados', lambda: len(sse_clients))
+metrics.gauge('sse_events_dropped_total', 'Eventos SSE descartados por colas llenas',
+              lambda: sse_dropped_total, kind='counter')
+metrics.gauge('log_records_dropped_total', 'Registros de log descartados por cola llena',
+              dropped_records, kind='counter')
+metrics.gauge('db_pool_connections', 'Conexiones del pool de la base de datos',
+              lambda: {(state,): db.pool_stats().get(state) for state in ('in_use', 'idle')}, labels=('state',))
+
+# Tamaño aproximado de cada bloque en las respuestas en streaming
+STREAM_CHUNK_SIZE = 64 * 1024
+
 # Funciones JWT usando solo librerías estándar
 def base64url_encode(data):
     """Codifica en base64url"""
@@ -48,6 +117,8 @@ def create_jwt(payload):
     
     # Agregar timestamp de expiración (24 horas)
     payload['exp'] = int(time.time()) + 86400
+    # Generación vigente del usuario: al revocarlo, los tokens anteriores dejan de valer
+    payload['gen'] = token_revocations.generation(payload.get('username'))
     payload['iat'] = int(time.time())
     
     # Codificar header y payload
@@ -66,16 +137,29 @@ def create_jwt(payload):
     return f"{message}.{signature_encoded}"
 
 def verify_jwt(token):
-    """Verificar token JWT"""
+    """Verificar token JWT (consultando primero la caché de tokens verificados)"""
+    start = time.perf_counter()
+    payload, result = _verify_jwt(token)
+    JWT_VERIFY_DURATION.observe(time.perf_counter() - start, result)
+    return payload
+
+def _verify_jwt(token):
+    """(payload o None, resultado para las métricas: 'cached', 'verified' o 'rejected')"""
     try:
+        message, _, signature_encoded = token.rpartition('.')
+        cached = verified_tokens.get(signature_encoded, message)
+        if cached is not None:
+            if token_revocations.is_revoked(signature_encoded, cached):
+                return None, 'rejected'
+            return cached, 'cached'
+        
         parts = token.split('.')
         if len(parts) != 3:
-            return None
+            return None, 'rejected'
         
         header_encoded, payload_encoded, signature_encoded = parts
         
         # Verificar firma
-        message = f"{header_encoded}.{payload_encoded}"
         expected_signature = hmac.new(
             JWT_SECRET.encode('utf-8'),
             message.encode('utf-8'),
@@ -85,18 +169,21 @@ def verify_jwt(token):
         received_signature = base64url_decode(signature_encoded)
         
         if not hmac.compare_digest(expected_signature, received_signature):
-            return None
+            return None, 'rejected'
         
         # Decodificar payload
         payload = json.loads(base64url_decode(payload_encoded).decode('utf-8'))
         
         # Verificar expiración
         if payload.get('exp', 0) < time.time():
-            return None
+            return None, 'rejected'
         
-        return payload
+        verified_tokens.put(signature_encoded, message, payload)
+        if token_revocations.is_revoked(signature_encoded, payload):
+            return None, 'rejected'
+        return payload, 'verified'
     except Exception:
-        return None
+        return None, 'rejected'
 
 def require_auth(func):
     """Decorador para requerir autenticación"""
@@ -127,49 +214,320 @@ def require_admin(func):
     return wrapper
 
 # Funciones para Server-Sent Events
-def add_sse_client(client_info):
-    """Agregar cliente SSE a la lista"""
+# Canales: 'todos' (todos los clientes), 'user:<username>' y 'role:<rol>'
+def sse_client_channels(username, role):
+    """Canales a los que se suscribe un cliente SSE"""
+    return ['todos', f'user:{username}', f'role:{role}']
+
+def communication_channels(destinatarios, remitente):
+    """Canales que deben recibir un comunicado: sus destinatarios y el remitente"""
+    if isinstance(destinatarios, str):
+        destinatarios = [destinatarios]
+    if 'todos' in destinatarios:
+        return ['todos']
+    return [f'user:{destinatario}' for destinatario in destinatarios] + [f'user:{remitente}']
+
+def parse_recipients(data):
+    """Destinatarios principales y en copia de una petición de envío, sin duplicados.
+
+    Acepta 'destinatario' (texto) o 'destinatarios' (lista) y 'copia' (lista).
+    Lanza ValueError si el formato no es válido.
+    """
+    destinatarios = data.get('destinatarios')
+    if destinatarios is None:
+        destinatarios = [data['destinatario']] if data.get('destinatario') else []
+    copia = data.get('copia') or []
+    if not isinstance(destinatarios, list) or not isinstance(copia, list):
+        raise ValueError('destinatarios y copia deben ser listas')
+    return normalize_recipients(destinatarios, copia)
+
+def add_sse_client(client_info, last_event_id=None):
+    """Agregar cliente SSE, suscribirlo a sus canales y reenviar lo que se perdió.
+
+    El registro y el cálculo de la reanudación se hacen bajo ``sse_lock``, el
+    mismo lock con el que se numeran los eventos: cada evento llega o por el
+    buffer o por la suscripción, nunca por los dos ni por ninguno.
+    """
+    key = id(client_info)
     with sse_lock:
-        sse_clients.append(client_info)
-        print(f"Cliente SSE conectado. Total: {len(sse_clients)}")
+        sse_clients[key] = client_info
+        for channel in client_info['channels']:
+            sse_channels.setdefault(channel, {})[key] = client_info
+        
+        if last_event_id is not None:
+            missed = _replay_events(client_info['channels'], last_event_id)
+            if missed is None or len(missed) > SSE_QUEUE_SIZE:
+                # El hueco es mayor que el buffer: el cliente debe recargar todo
+                resync = {'type': 'resync', 'timestamp': int(time.time())}
+                enqueue_sse_message(client_info, f"id: {sse_last_event_id}\ndata: {json.dumps(resync)}\n\n".encode('utf-8'))
+            else:
+                for message in missed:
+                    enqueue_sse_message(client_info, message)
+        total = len(sse_clients)
+    # Fuera del lock: el log no debe retrasar a los demás clientes
+    logger.info("Cliente SSE conectado", extra={'username': client_info['username'], 'sse_clients': total})
+
+def _replay_events(channels, last_event_id):
+    """Eventos posteriores a last_event_id en los canales, o None si ya no están en el buffer (requiere sse_lock)"""
+    if last_event_id < SSE_FIRST_EVENT_ID - 1 or last_event_id > sse_last_event_id:
+        # ID de otro proceso (reinicio del servidor): no se puede saber qué falta
+        return None
+    missed = {}
+    for channel in channels:
+        if sse_replay_evicted.get(channel, SSE_FIRST_EVENT_ID - 1) > last_event_id:
+            return None
+        for event_id, message in reversed(sse_replay.get(channel, ())):
+            if event_id <= last_event_id:
+                break
+            missed[event_id] = message
+    return [missed[event_id] for event_id in sorted(missed)]
+
+def _unsubscribe(key, client_info):
+    """Quitar un cliente del registro (requiere sse_lock)"""
+    if sse_clients.pop(key, None) is None:
+        return False
+    for channel in client_info['channels']:
+        subscribers = sse_channels.get(channel)
+        if subscribers is not None:
+            subscribers.pop(key, None)
+            if not subscribers:
+                del sse_channels[channel]
+    return True
 
 def remove_sse_client(client_info):
-    """Remover cliente SSE de la lista"""
+    """Remover cliente SSE y sus suscripciones"""
     with sse_lock:
-        if client_info in sse_clients:
-            sse_clients.remove(client_info)
-            print(f"Cliente SSE desconectado. Total: {len(sse_clients)}")
+        removed = _unsubscribe(id(client_info), client_info)
+        total = len(sse_clients)
+    if removed:
+        logger.info("Cliente SSE desconectado", extra={'username': client_info['username'], 'sse_clients': total})
 
-def broadcast_sse_event(event_type, data):
-    """Enviar evento a todos los clientes SSE conectados"""
+def new_sse_client(wfile, user_id, username, role):
+    """Crear el estado de un cliente SSE con su cola de salida acotada"""
+    return {
+        'wfile': wfile,
+        'user_id': user_id,
+        'username': username,
+        'channels': sse_client_channels(username, role),
+        'queue': queue.Queue(maxsize=SSE_QUEUE_SIZE),
+        'lock': threading.Lock(),  # Protege el desbordamiento y los contadores
+        'closed': False,
+        'sent': 0,
+        'dropped': 0
+    }
+
+def enqueue_sse_message(client_info, message):
+    """Encolar un evento sin bloquear; aplica SSE_OVERFLOW_POLICY si la cola está llena"""
+    global sse_dropped_total
+    with client_info['lock']:
+        if client_info['closed']:
+            return False
+        try:
+            client_info['queue'].put_nowait(message)
+            return True
+        except queue.Full:
+            client_info['dropped'] += 1
+            with sse_dropped_lock:
+                sse_dropped_total += 1
+            if SSE_OVERFLOW_POLICY == 'disconnect':
+                # Cliente lento: su hilo escritor cerrará la conexión
+                client_info['closed'] = True
+                return False
+            try:
+                client_info['queue'].get_nowait()
+            except queue.Empty:
+                pass
+            client_info['queue'].put_nowait(message)
+            return True
+
+def broadcast_sse_event(event_type, data, channels=('todos',)):
+    """Encolar un evento para los clientes suscritos a alguno de los canales indicados.
+
+    No escribe en ningún socket: cada cliente tiene su propio hilo escritor,
+    así que un cliente lento no retrasa la petición que genera el evento.
+    """
+    event_data = {
+        'type': event_type,
+        'data': data,
+        'timestamp': int(time.time())
+    }
+    global sse_last_event_id
+    start = time.perf_counter()
+    # Se serializa una sola vez y se reutilizan los mismos bytes para cada suscriptor
+    payload = json.dumps(event_data)
+    
+    lock_requested = time.perf_counter()
     with sse_lock:
-        disconnected_clients = []
+        SSE_LOCK_WAIT.observe(time.perf_counter() - lock_requested)
+        sse_last_event_id += 1
+        event_id = sse_last_event_id
+        message = f"id: {event_id}\ndata: {payload}\n\n".encode('utf-8')
         
-        for client_info in sse_clients[:]:  # Copia de la lista
-            try:
-                event_data = {
-                    'type': event_type,
-                    'data': data,
-                    'timestamp': int(time.time())
-                }
-                
-                message = f"data: {json.dumps(event_data)}\n\n"
-                client_info['wfile'].write(message.encode('utf-8'))
-                client_info['wfile'].flush()
-                
-            except Exception as e:
-                print(f"Error enviando SSE a cliente: {e}")
-                disconnected_clients.append(client_info)
+        recipients = {}
+        for channel in set(channels):
+            buffer = sse_replay.get(channel)
+            if buffer is None:
+                buffer = sse_replay[channel] = collections.deque(maxlen=SSE_REPLAY_SIZE)
+            elif len(buffer) == SSE_REPLAY_SIZE:
+                sse_replay_evicted[channel] = buffer[0][0]
+            buffer.append((event_id, message))
+            recipients.update(sse_channels.get(channel, {}))
         
-        # Remover clientes desconectados
-        for client in disconnected_clients:
-            if client in sse_clients:
-                sse_clients.remove(client)
+        # Todavía bajo sse_lock: cada cliente recibe los eventos en orden de ID y uno que
+        # se conecta ahora lo tiene o en la reanudación o en la cola, nunca en las dos.
+        # enqueue_sse_message no bloquea, así que el lock se mantiene poco tiempo.
+        for client_info in recipients.values():
+            enqueue_sse_message(client_info, message)
+    SSE_FANOUT_RECIPIENTS.observe(len(recipients))
+    SSE_FANOUT_DURATION.observe(time.perf_counter() - start)
+
+# Contadores de no leídos pendientes de enviar por SSE; los calcula y envía un hilo
+# aparte para que la consulta a la base de datos no alargue la petición que los cambia
+unread_pending = set()
+unread_pending_all = False
+unread_pending_cond = threading.Condition()
+unread_publisher = None
+
+def publish_unread_counts(usernames=None):
+    """Programar el envío de su contador de no leídos a los usuarios conectados (None: a todos).
+
+    Solo anota los usuarios y vuelve; las peticiones seguidas se juntan y el
+    hilo publicador calcula cada contador una vez.
+    """
+    global unread_pending_all, unread_publisher
+    with unread_pending_cond:
+        if usernames is None:
+            unread_pending_all = True
+        else:
+            unread_pending.update(usernames)
+        if unread_publisher is None:
+            unread_publisher = threading.Thread(target=run_unread_publisher, name='unread-publisher', daemon=True)
+            unread_publisher.start()
+        unread_pending_cond.notify()
+
+def run_unread_publisher():
+    """Bucle del hilo publicador de contadores de no leídos"""
+    global unread_pending_all
+    while True:
+        with unread_pending_cond:
+            while not unread_pending_all and not unread_pending:
+                unread_pending_cond.wait()
+            usernames = None if unread_pending_all else set(unread_pending)
+            unread_pending.clear()
+            unread_pending_all = False
+        send_unread_counts(usernames)
+
+def send_unread_counts(usernames=None):
+    """Enviar su contador de no leídos a los usuarios conectados (None: a todos los conectados)"""
+    with sse_lock:
+        connected = [channel[5:] for channel in sse_channels if channel.startswith('user:')]
+    if usernames is not None:
+        connected = [username for username in connected if username in usernames]
+    for username in connected:
+        try:
+            count = db.unread.get(username)
+        except Exception as e:
+            logger.error("Error al calcular no leídos: %s", e, extra={'username': username})
+            continue
+        broadcast_sse_event('unread_count', {'count': count}, channels=[f'user:{username}'])
+
+def sse_metrics():
+    """Métricas de las colas SSE: profundidad y eventos descartados por cliente"""
+    with sse_lock:
+        clients = list(sse_clients.values())
+    return {
+        'clients': len(clients),
+        'dropped_total': sse_dropped_total,
+        'queue_size': SSE_QUEUE_SIZE,
+        'overflow_policy': SSE_OVERFLOW_POLICY,
+        'per_client': [
+            {
+                'username': client_info['username'],
+                'queue_depth': client_info['queue'].qsize(),
+                'sent': client_info['sent'],
+                'dropped': client_info['dropped']
+            }
+            for client_info in clients
+        ]
+    }
+
+class ThreadedCommunicationServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Servidor HTTP concurrente con un número acotado de peticiones REST a la vez.
+
+    Cada conexión se atiende en su propio hilo y el hilo que acepta conexiones
+    nunca espera. El handler reserva una de las ``max_workers`` plazas cuando
+    ya ha leído la línea de petición y las cabeceras; si no queda ninguna
+    responde 503. Las conexiones SSE no ocupan plaza (tienen su propio límite,
+    MAX_SSE_CLIENTS), de modo que los clientes de eventos inactivos no bloquean
+    logins ni consultas de bandeja de entrada.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, max_workers=MAX_WORKERS):
+        super().__init__(server_address, handler_class)
+        self.worker_slots = threading.BoundedSemaphore(max_workers)
 
 class CommunicationHandler(http.server.SimpleHTTPRequestHandler):
+    # Segundos sin recibir ni poder enviar datos antes de cerrar la conexión:
+    # un cliente que no termina de mandar la petición no retiene un hilo indefinidamente
+    timeout = HANDLER_TIMEOUT
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, directory='.', **kwargs)
     
+    def handle_one_request(self):
+        """Atender una petición y registrar su duración por ruta"""
+        self.response_status = None
+        self.worker_slot = False
+        start = time.perf_counter()
+        try:
+            super().handle_one_request()
+        finally:
+            if self.worker_slot:
+                self.worker_slot = False
+                self.server.worker_slots.release()
+        if self.response_status is None or not getattr(self, 'command', None):
+            return
+        path = self.path.split('?', 1)[0]
+        if path == '/api/events':
+            # Conexión de larga duración: su duración no es latencia
+            return
+        if self.response_status == 404:
+            route = 'not_found'
+        elif '.' in path:
+            route = 'static'
+        else:
+            route = path
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, self.command, route, str(self.response_status))
+    
+    def parse_request(self):
+        """Tras leer la línea de petición y las cabeceras, reservar una plaza REST; 503 si no hay"""
+        if not super().parse_request():
+            return False
+        slots = getattr(self.server, 'worker_slots', None)
+        if slots is None or self.path.split('?', 1)[0] == '/api/events':
+            return True
+        if not slots.acquire(blocking=False):
+            self.close_connection = True
+            self.send_error_response(503, 'Servidor ocupado, inténtalo de nuevo')
+            return False
+        self.worker_slot = True
+        return True
+    
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+    
+    def log_message(self, format, *args):
+        """Log de acceso por la cola estructurada (DEBUG) en vez de escribir a stderr en cada petición"""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(format, *redact_tokens(args), extra={'client': self.address_string()})
+    
+    def log_error(self, format, *args):
+        logger.warning(format, *redact_tokens(args), extra={'client': self.address_string()})
+
     def send_error_response(self, status_code, message):
         """Enviar respuesta de error"""
         self.send_response(status_code)
@@ -191,12 +549,35 @@ class CommunicationHandler(http.server.SimpleHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
         self.end_headers()
         
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        with JSON_ENCODE_DURATION.time(self.path.split('?', 1)[0]):
+            body = json.dumps(data).encode('utf-8')
+        self.wfile.write(body)
+    
+    def serve_static(self, name):
+        """Servir un recurso desde la caché en memoria; False si no está en ella"""
+        asset = static_assets.get(name)
+        if asset is None:
+            return False
+        
+        status, headers, body = asset.response(
+            self.headers.get('Accept-Encoding'),
+            self.headers.get('If-None-Match')
+        )
+        self.send_response(status)
+        for header, value in headers:
+            self.send_header(header, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+        return True
     
     def do_GET(self):
         """Manejar peticiones GET"""
-        if self.path == '/' or self.path == '/simple.html':
+        path = self.path.split('?', 1)[0]
+        if path == '/' or path == '/simple.html':
             self.path = '/simple.html'
+            if self.serve_static('simple.html'):
+                return
             return super().do_GET()
         elif self.path == '/get-users':
             # Verificar autenticación para obtener usuarios
@@ -213,8 +594,7 @@ class CommunicationHandler(http.server.SimpleHTTPRequestHandler):
                 return
             
             self.current_user = payload
-            response = self.get_users()
-            self.send_success_response(response)
+            self.send_users()
             return
         elif self.path == '/verify-token':
             # Endpoint para verificar si el token es válido
@@ -239,20 +619,31 @@ class CommunicationHandler(http.server.SimpleHTTPRequestHandler):
                 }
             })
             return
-        elif self.path == '/api/events':
+        elif self.path.split('?', 1)[0] == '/api/events':
             # Endpoint para Server-Sent Events
+            # EventSource no permite cabeceras propias: se acepta también ?token=
             auth_header = self.headers.get('Authorization')
-            if not auth_header or not auth_header.startswith('Bearer '):
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+            if auth_header and auth_header.startswith('Bearer '):
+                token = auth_header[7:]
+            elif query.get('token'):
+                token = query['token'][0]
+            else:
                 self.send_error_response(401, 'Token de autenticación requerido')
                 return
             
-            token = auth_header[7:]
             payload = verify_jwt(token)
             
             if not payload:
                 self.send_error_response(401, 'Token inválido o expirado')
                 return
             
+            with sse_lock:
+                sse_full = len(sse_clients) >= MAX_SSE_CLIENTS
+            if sse_full:
+                self.send_error_response(503, 'Demasiadas conexiones de eventos abiertas')
+                return
+            
             # Configurar headers para SSE
             self.send_response(200)
             self.send_header('Content-Type', 'text/event-stream')
@@ -262,13 +653,16 @@ class CommunicationHandler(http.server.SimpleHTTPRequestHandler):
             self.send_header('Access-Control-Allow-Headers', 'Authorization')
             self.end_headers()
             
+            # Reanudación: cabecera Last-Event-ID (reconexión automática) o ?lastEventId= (manual)
+            last_event_id = self.headers.get('Last-Event-ID') or (query.get('lastEventId') or [None])[0]
+            try:
+                last_event_id = int(last_event_id) if last_event_id else None
+            except ValueError:
+                last_event_id = None
+            
             # Agregar cliente a la lista
-            client_info = {
-                'wfile': self.wfile,
-                'user_id': payload['user_id'],
-                'username': payload['username']
-            }
-            add_sse_client(client_info)
+            client_info = new_sse_client(self.wfile, payload['user_id'], payload['username'], payload.get('role'))
+            add_sse_client(client_info, last_event_id)
             
             try:
                 # Enviar mensaje inicial
@@ -276,21 +670,74 @@ class CommunicationHandler(http.server.SimpleHTTPRequestHandler):
                 self.wfile.write(initial_message.encode('utf-8'))
                 self.wfile.flush()
                 
-                # Mantener conexión abierta
-                while True:
-                    time.sleep(30)  # Enviar keep-alive cada 30 segundos
+                # Este hilo es el único escritor del socket: vacía la cola del cliente
+                while not client_info['closed']:
+                    try:
+                        message = client_info['queue'].get(timeout=SSE_KEEPALIVE_INTERVAL)
+                    except queue.Empty:
+                        message = f"data: {json.dumps({'type': 'keepalive', 'timestamp': int(time.time())})}\n\n".encode('utf-8')
                     try:
-                        keepalive = f"data: {json.dumps({'type': 'keepalive', 'timestamp': int(time.time())})}\n\n"
-                        self.wfile.write(keepalive.encode('utf-8'))
+                        self.wfile.write(message)
                         self.wfile.flush()
-                    except:
+                    except Exception:
                         break
+                    client_info['sent'] += 1
                         
             except Exception as e:
-                print(f"Error en conexión SSE: {e}")
+                logger.warning("Error en conexión SSE: %s", e)
             finally:
+                client_info['closed'] = True
                 remove_sse_client(client_info)
             return
+        elif self.path == '/api/sse-stats':
+            # Métricas de las colas SSE (solo administradores)
+            auth_header = self.headers.get('Authorization')
+            if not auth_header or not auth_header.startswith('Bearer '):
+                self.send_error_response(401, 'Token de autenticación requerido')
+                return
+            
+            payload = verify_jwt(auth_header[7:])
+            if not payload:
+                self.send_error_response(401, 'Token inválido o expirado')
+                return
+            
+            if payload.get('role') != 'admin':
+                self.send_error_response(403, 'Acceso denegado: se requiere rol de administrador')
+                return
+            
+            self.send_success_response({'success': True, 'sse': sse_metrics()})
+            return
+        elif path == '/unread-count':
+            # Contador de no leídos desde memoria: pensado para sondear un indicador
+            auth_header = self.headers.get('Authorization')
+            if not auth_header or not auth_header.startswith('Bearer '):
+                self.send_error_response(401, 'Token de autenticación requerido')
+                return
+            
+            payload = verify_jwt(auth_header[7:])
+            if not payload:
+                self.send_error_response(401, 'Token inválido o expirado')
+                return
+            
+            self.send_success_response({'success': True, 'count': db.unread.get(payload['username'])})
+            return
+        elif path == '/export-users':
+            # Exportación masiva de usuarios (solo administradores)
+            if self.require_admin_token():
+                self.export_users()
+            return
+        elif path == '/metrics':
+            # Métricas en formato Prometheus (con METRICS_TOKEN definido, exige ese token)
+            if not metrics_authorized(self.headers.get('Authorization')):
+                self.send_error_response(401, 'Token de métricas requerido')
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', METRICS_CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
         elif self.path == '/api/dev/check-updates':
             # Endpoint para hot reload - verificar cambios en archivos
             try:
@@ -319,10 +766,17 @@ class CommunicationHandler(http.server.SimpleHTTPRequestHandler):
             return
         
         # Servir archivos estáticos
+        if path.lstrip('/') in STATIC_FILES and self.serve_static(path.lstrip('/')):
+            return
         return super().do_GET()
     
     def do_POST(self):
         """Manejar peticiones POST"""
+        if self.path.split('?', 1)[0] == '/import-users':
+            # El cuerpo es CSV o JSON lines y se procesa por lotes sin cargarlo entero
+            self.import_users()
+            return
+        
         try:
             # Leer datos del cuerpo de la petición
             content_length = int(self.headers['Content-Length'])
@@ -331,7 +785,11 @@ class CommunicationHandler(http.server.SimpleHTTPRequestHandler):
             
             # Enrutar según la URL
             if self.path == '/authenticate-user':
-                response = self.authenticate_user(data)
+                try:
+                    response = self.authenticate_user(data)
+                except PasswordHasherBusy:
+                    self.send_error_response(503, 'Servidor ocupado, inténtalo de nuevo')
+                    return
                 self.send_success_response(response)
             elif self.path == '/logout':
                 response = self.logout()
@@ -431,7 +889,10 @@ class CommunicationHandler(http.server.SimpleHTTPRequestHandler):
                     return
                 
                 self.current_user = payload
-                response = self.get_communications()
+                if data.get('stream'):
+                    self.stream_communications(data, inbox=False)
+                    return
+                response = self.get_communications(data)
                 self.send_success_response(response)
             elif self.path == '/delete-communication':
                 # Verificar autenticación
@@ -465,13 +926,48 @@ class CommunicationHandler(http.server.SimpleHTTPRequestHandler):
                     return
                 
                 self.current_user = payload
-                response = self.get_inbox()
+                if data.get('stream'):
+                    self.stream_communications(data, inbox=True)
+                    return
+                response = self.get_inbox(data)
+                self.send_success_response(response)
+            elif self.path == '/search-communications':
+                # Verificar autenticación
+                auth_header = self.headers.get('Authorization')
+                if not auth_header or not auth_header.startswith('Bearer '):
+                    self.send_error_response(401, 'Token de autenticación requerido')
+                    return
+                
+                payload = verify_jwt(auth_header[7:])
+                if not payload:
+                    self.send_error_response(401, 'Token inválido o expirado')
+                    return
+                
+                self.current_user = payload
+                response = self.search_communications(data)
+                self.send_success_response(response)
+            elif self.path == '/mark-as-read':
+                # Verificar autenticación
+                auth_header = self.headers.get('Authorization')
+                if not auth_header or not auth_header.startswith('Bearer '):
+                    self.send_error_response(401, 'Token de autenticación requerido')
+                    return
+                
+                token = auth_header[7:]
+                payload = verify_jwt(token)
+                
+                if not payload:
+                    self.send_error_response(401, 'Token inválido o expirado')
+                    return
+                
+                self.current_user = payload
+                response = self.mark_as_read(data)
                 self.send_success_response(response)
             else:
                 self.send_error_response(404, 'Endpoint no encontrado')
             
-        except Exception as e:
-            print(f"Error en POST: {e}")
+        except Exception:
+            logger.exception("Error en POST")
             self.send_error_response(500, 'Error interno del servidor')
     
     def do_OPTIONS(self):
@@ -490,14 +986,14 @@ class CommunicationHandler(http.server.SimpleHTTPRequestHandler):
         if not username or not password:
             return {'success': False, 'message': 'Usuario y contraseña son requeridos'}
         
-        result = db.authenticate_user(username, password)
+        user = db.authenticate_user(username, password)
         
-        if result['success']:
+        if user:
             # Crear token JWT
             payload = {
-                'user_id': result['user']['id'],
-                'username': result['user']['username'],
-                'role': result['user']['role']
+                'user_id': user['id'],
+                'username': user['username'],
+                'role': user['role']
             }
             
             token = create_jwt(payload)
@@ -505,35 +1001,112 @@ class CommunicationHandler(http.server.SimpleHTTPRequestHandler):
             return {
                 'success': True,
                 'user': {
-                    'id': result['user']['id'],
-                    'username': result['user']['username'],
-                    'role': result['user']['role']
+                    'id': user['id'],
+                    'username': user['username'],
+                    'role': user['role']
                 },
                 'token': token,
                 'message': 'Autenticación exitosa'
             }
         else:
-            return result
+            return {'success': False, 'message': 'Credenciales inválidas'}
     
-    def get_users(self):
-        """Obtener todos los usuarios"""
+    def require_admin_token(self):
+        """Comprobar que la petición trae un token de administrador; si no, responder con error"""
+        auth_header = self.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            self.send_error_response(401, 'Token de autenticación requerido')
+            return None
+        
+        payload = verify_jwt(auth_header[7:])
+        if not payload:
+            self.send_error_response(401, 'Token inválido o expirado')
+            return None
+        
+        if payload.get('role') != 'admin':
+            self.send_error_response(403, 'Acceso denegado: se requiere rol de administrador')
+            return None
+        
+        self.current_user = payload
+        return payload
+    
+    def iter_body_lines(self):
+        """Líneas del cuerpo de la petición, leídas del socket según se necesitan"""
+        remaining = int(self.headers.get('Content-Length') or 0)
+        while remaining > 0:
+            line = self.rfile.readline(min(remaining, 65536))
+            if not line:
+                break
+            remaining -= len(line)
+            yield line.decode('utf-8')
+    
+    def import_users(self):
+        """Alta masiva de usuarios desde CSV o JSON lines (solo administradores)"""
+        if not self.require_admin_token():
+            return
+        
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        fmt = query.get('format', [None])[0] or detect_format(self.headers.get('Content-Type'))
+        if fmt not in BULK_FORMATS:
+            self.send_error_response(400, 'Formato no soportado (csv o jsonl)')
+            return
+        
         try:
-            users = db.get_all_users()
-            # Incluir contraseñas para permitir edición
-            safe_users = []
-            for user in users:
-                safe_users.append({
-                    'id': user['id'],
-                    'username': user['username'],
-                    'password': user['password'],
-                    'role': user['role'],
-                    'created_at': user['created_at'],
-                    'updated_at': user['updated_at']
-                })
-            return {'success': True, 'users': safe_users}
-        except Exception as e:
-            print(f"Error al obtener usuarios: {e}")
-            return {'success': False, 'message': 'Error al obtener usuarios'}
+            report = import_users(db, self.iter_body_lines(), fmt)
+        except Exception:
+            logger.exception("Error al importar usuarios")
+            self.send_error_response(500, 'Error al importar usuarios')
+            return
+        
+        if report['imported']:
+            broadcast_sse_event('users_imported', {
+                'count': report['imported'],
+                'message': f"{report['imported']} usuarios importados"
+            }, channels=['role:admin'])
+        self.send_success_response(report)
+    
+    def export_users(self):
+        """Enviar todos los usuarios en CSV o JSON lines según se leen de la base de datos"""
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        fmt = query.get('format', ['csv'])[0]
+        if fmt not in BULK_FORMATS:
+            self.send_error_response(400, 'Formato no soportado (csv o jsonl)')
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', BULK_CONTENT_TYPES[fmt])
+        self.send_header('Content-Disposition', f'attachment; filename="usuarios.{fmt}"')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        # Sin Content-Length: la respuesta termina al cerrar la conexión
+        try:
+            for chunk in export_users(db, fmt):
+                self.wfile.write(chunk.encode('utf-8'))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+    
+    def send_users(self):
+        """Enviar todos los usuarios desde el directorio en memoria (304 si no han cambiado)"""
+        try:
+            body, etag = db.users.snapshot()
+        except Exception:
+            logger.exception("Error al obtener usuarios")
+            self.send_error_response(500, 'Error al obtener usuarios')
+            return
+        
+        not_modified = etag_matches(self.headers.get('If-None-Match') or '', {etag})
+        self.send_response(304 if not_modified else 200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'private, no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+        if not not_modified:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not not_modified:
+            self.wfile.write(body)
     
     def add_user(self, data):
         """Añadir nuevo usuario"""
@@ -555,12 +1128,12 @@ class CommunicationHandler(http.server.SimpleHTTPRequestHandler):
                     'username': username,
                     'role': role,
                     'message': f'Nuevo usuario {username} agregado'
-                })
+                }, channels=['role:admin'])
             
             return result
             
-        except Exception as e:
-            print(f"Error al añadir usuario: {e}")
+        except Exception:
+            logger.exception("Error al añadir usuario")
             return {'success': False, 'message': 'Error al añadir usuario'}
     
     def update_user(self, data):
@@ -583,12 +1156,12 @@ class CommunicationHandler(http.server.SimpleHTTPRequestHandler):
                     'username': username,
                     'role': role,
                     'message': f'Usuario {username} actualizado'
-                })
+                }, channels=['role:admin'])
             
             return result
             
-        except Exception as e:
-            print(f"Error al actualizar usuario: {e}")
+        except Exception:
+            logger.exception("Error al actualizar usuario")
             return {'success': False, 'message': 'Error al actualizar usuario'}
     
     def delete_user(self, data):
@@ -603,97 +1176,242 @@ class CommunicationHandler(http.server.SimpleHTTPRequestHandler):
             
             # Enviar notificación en tiempo real si el usuario se eliminó exitosamente
             if result.get('success'):
+                token_revocations.revoke_user(result['username'])
+                verified_tokens.revoke_user(user_id=user_id)
                 broadcast_sse_event('user_deleted', {
                     'user_id': user_id,
                     'message': f'Usuario eliminado'
-                })
+                }, channels=['role:admin'])
             
             return result
             
-        except Exception as e:
-            print(f"Error al eliminar usuario: {e}")
+        except Exception:
+            logger.exception("Error al eliminar usuario")
             return {'success': False, 'message': 'Error al eliminar usuario'}
     
     def logout(self):
         """Cerrar sesión"""
+        auth_header = self.headers.get('Authorization')
+        if auth_header and auth_header.startswith('Bearer '):
+            token = auth_header[7:]
+            payload = verify_jwt(token)
+            if payload:
+                # El token queda revocado en todos los procesos hasta que expire
+                token_revocations.revoke_token(token.rpartition('.')[2], payload.get('exp', 0))
+            verified_tokens.invalidate(token)
         return {'success': True, 'message': 'Sesión cerrada'}
     
     def send_communication(self, data):
-        """Enviar un nuevo comunicado"""
+        """Enviar un comunicado a uno o varios destinatarios, con copias, en una sola transacción"""
         try:
             # Validar datos requeridos
-            required_fields = ['destinatario', 'mensaje', 'prioridad']
+            required_fields = ['mensaje', 'prioridad']
             for field in required_fields:
                 if field not in data or not data[field]:
                     return {'success': False, 'message': f'Campo {field} es requerido'}
             
+            try:
+                destinatarios, copia = parse_recipients(data)
+            except ValueError as e:
+                return {'success': False, 'message': str(e)}
+            
             # Generar título automáticamente si no se proporciona
-            titulo = data.get('titulo', f"Comunicado de {self.current_user['username']}")
+            remitente = self.current_user['username']
+            titulo = data.get('titulo', f"Comunicado de {remitente}")
             
             # Obtener hora actual
             from datetime import datetime
             now = datetime.now()
             hora = now.strftime("%H:%M")
             
-            # Guardar en la base de datos
-            result = db.add_communication(
-                titulo=titulo,
-                mensaje=data['mensaje'],
-                destinatario=data['destinatario'],
-                prioridad=data['prioridad'],
-                remitente=self.current_user['username'],
-                hora=hora
-            )
-            
-            # Enviar notificación en tiempo real si el comunicado se guardó exitosamente
+            # Una fila por destinatario; las copias llevan el prefijo [COPIA]
+            rows = [
+                {
+                    'titulo': titulo if destinatario in destinatarios else f"[COPIA] {titulo}",
+                    'mensaje': data['mensaje'],
+                    'destinatario': destinatario,
+                    'prioridad': data['prioridad'],
+                    'remitente': remitente,
+                    'hora': hora
+                }
+                for destinatario in destinatarios + copia
+            ]
+            
+            # Guardar en la base de datos (inserción múltiple, un único commit)
+            result = db.add_communications(rows)
+            
+            # Un único evento para todos los destinatarios
             if result.get('success'):
                 broadcast_sse_event('new_communication', {
+                    'id': result['id'],
                     'titulo': titulo,
                     'mensaje': data['mensaje'],
-                    'destinatario': data['destinatario'],
+                    'destinatario': destinatarios[0],
+                    'destinatarios': destinatarios,
+                    'copia': copia,
                     'prioridad': data['prioridad'],
-                    'remitente': self.current_user['username'],
+                    'remitente': remitente,
                     'hora': hora
-                })
+                }, channels=communication_channels(destinatarios + copia, remitente))
+                publish_unread_counts(None if 'todos' in destinatarios else destinatarios + copia)
             
             return result
             
-        except Exception as e:
-            print(f"Error al enviar comunicado: {e}")
+        except Exception:
+            logger.exception("Error al enviar comunicado")
             return {'success': False, 'message': 'Error interno del servidor'}
     
-    def get_communications(self):
-        """Obtener comunicados del usuario actual"""
+    def get_communications(self, data):
+        """Obtener comunicados del usuario actual, paginados por cursor"""
         try:
+            limit = page_size(data.get('limit'))
+            before = decode_cursor(data['before']) if data.get('before') else None
+            
             # Los administradores pueden ver todos los comunicados
             if self.current_user['role'] == 'admin':
-                communications = db.get_all_communications()
+                rows = db.get_all_communications(limit + 1, before)
             else:
                 # Los usuarios regulares solo ven sus propios comunicados enviados
-                communications = db.get_communications_by_sender(self.current_user['username'])
+                rows = db.get_communications_by_sender(self.current_user['username'], limit + 1, before)
             
+            communications, next_cursor = paginate(rows, limit)
             return {
                 'success': True,
-                'communications': communications
+                'communications': communications,
+                'next_cursor': next_cursor
             }
             
-        except Exception as e:
-            print(f"Error al obtener comunicados: {e}")
+        except ValueError as e:
+            return {'success': False, 'message': str(e)}
+        except Exception:
+            logger.exception("Error al obtener comunicados")
             return {'success': False, 'message': 'Error interno del servidor'}
     
-    def get_inbox(self):
-        """Obtener bandeja de entrada del usuario actual (mensajes recibidos)"""
+    def get_inbox(self, data):
+        """Obtener bandeja de entrada del usuario actual (mensajes recibidos), paginada por cursor"""
         try:
+            limit = page_size(data.get('limit'))
+            before = decode_cursor(data['before']) if data.get('before') else None
+            
             # Obtener mensajes recibidos por el usuario actual
-            communications = db.get_communications_by_recipient(self.current_user['username'])
+            rows = db.get_communications_by_recipient(self.current_user['username'], limit + 1, before)
+            communications, next_cursor = paginate(rows, limit)
+            db.annotate_read_state(self.current_user['username'], communications)
             
             return {
                 'success': True,
-                'communications': communications
+                'communications': communications,
+                'next_cursor': next_cursor
             }
             
-        except Exception as e:
-            print(f"Error al obtener bandeja de entrada: {e}")
+        except ValueError as e:
+            return {'success': False, 'message': str(e)}
+        except Exception:
+            logger.exception("Error al obtener bandeja de entrada")
+            return {'success': False, 'message': 'Error interno del servidor'}
+    
+    def stream_communications(self, data, inbox):
+        """Listado completo en streaming: mismo JSON que la versión paginada, sin siguiente página.
+
+        Las filas salen de un cursor del lado del servidor y se envían con
+        Transfer-Encoding: chunked según se leen, de modo que la memoria no
+        crece con el número de comunicados.
+        """
+        try:
+            before = decode_cursor(data['before']) if data.get('before') else None
+        except ValueError as e:
+            self.send_success_response({'success': False, 'message': str(e)})
+            return
+        
+        username = self.current_user['username']
+        if inbox:
+            rows = db.stream_communications_by_recipient(username, before, read_state=True)
+        elif self.current_user['role'] == 'admin':
+            rows = db.stream_all_communications(before)
+        else:
+            rows = db.stream_communications_by_sender(username, before)
+        
+        # Chunked solo existe en HTTP/1.1; con clientes 1.0 el final lo marca el cierre
+        chunked = self.request_version == 'HTTP/1.1'
+        if chunked:
+            self.protocol_version = 'HTTP/1.1'
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        
+        def write(payload):
+            if chunked:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(payload), payload))
+            else:
+                self.wfile.write(payload)
+        
+        try:
+            for block in iter_json_listing(rows, STREAM_CHUNK_SIZE):
+                write(block)
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            rows.close()
+        except Exception:
+            # Las cabeceras ya salieron: se corta sin el bloque final y el cliente ve la respuesta incompleta
+            logger.exception("Error transmitiendo comunicados")
+            rows.close()
+    
+    def search_communications(self, data):
+        """Buscar comunicados por texto ('q'), ordenados por relevancia y paginados con 'cursor'"""
+        try:
+            text = data.get('q') or ''
+            scope = data.get('scope', 'inbox')
+            if scope not in SEARCH_SCOPES:
+                return {'success': False, 'message': 'Ámbito de búsqueda inválido'}
+            if scope == 'all' and self.current_user['role'] != 'admin':
+                return {'success': False, 'message': 'Acceso denegado: se requiere rol de administrador'}
+            
+            limit = page_size(data.get('limit'))
+            offset = decode_offset_cursor(data['cursor']) if data.get('cursor') else 0
+            
+            username = self.current_user['username']
+            rows = db.search_communications(username, text, scope, limit + 1, offset)
+            communications = rows[:limit]
+            next_cursor = encode_offset_cursor(offset + limit) if len(rows) > limit else None
+            if scope == 'inbox':
+                db.annotate_read_state(username, communications)
+            
+            return {
+                'success': True,
+                'communications': communications,
+                'next_cursor': next_cursor
+            }
+            
+        except ValueError as e:
+            return {'success': False, 'message': str(e)}
+        except Exception:
+            logger.exception("Error al buscar comunicados")
+            return {'success': False, 'message': 'Error interno del servidor'}
+    
+    def mark_as_read(self, data):
+        """Marcar como leídos comunicados de la bandeja ('ids') o todos ('all': true)"""
+        try:
+            if data.get('all'):
+                comm_ids = None
+            else:
+                comm_ids = data.get('ids')
+                if not isinstance(comm_ids, list) or not comm_ids:
+                    return {'success': False, 'message': 'Lista de IDs requerida'}
+            
+            result = db.mark_as_read(self.current_user['username'], comm_ids)
+            publish_unread_counts([self.current_user['username']])
+            return result
+            
+        except (TypeError, ValueError):
+            return {'success': False, 'message': 'IDs inválidos'}
+        except Exception:
+            logger.exception("Error al marcar como leído")
             return {'success': False, 'message': 'Error interno del servidor'}
     
     def delete_communication(self, data):
@@ -712,21 +1430,24 @@ class CommunicationHandler(http.server.SimpleHTTPRequestHandler):
                 # Los usuarios regulares solo pueden eliminar sus propios comunicados
                 result = db.delete_communication(comm_id, self.current_user['username'])
             
+            if result.get('success'):
+                destinatario = result['destinatario']
+                publish_unread_counts(None if destinatario == 'todos' else [destinatario])
             return result
             
-        except Exception as e:
-            print(f"Error al eliminar comunicado: {e}")
+        except Exception:
+            logger.exception("Error al eliminar comunicado")
             return {'success': False, 'message': 'Error interno del servidor'}
 
 if __name__ == '__main__':
     # Usar puerto asignado por el hosting o 8000 por defecto
     PORT = int(os.environ.get('PORT', 8000))
 
-    print("🚀 Iniciando servidor de comunicaciones internas...")
-    print(f"📱 Aplicación disponible en puerto {PORT}")
-    print("👤 Usuario admin: admin / admin123")
-    print("👤 Usuario regular: usuario1 / pass123")
+    logger.info("Iniciando servidor de comunicaciones internas", extra={'port': PORT})
+    logger.info("Usuarios de prueba: admin / admin123, usuario1 / pass123")
 
-    with socketserver.TCPServer(("", PORT), CommunicationHandler) as httpd:
-        print(f"✅ Servidor ejecutándose en puerto {PORT}")
+    with ThreadedCommunicationServer(("", PORT), CommunicationHandler) as httpd:
+        logger.info("Servidor ejecutándose", extra={
+            'port': PORT, 'max_workers': MAX_WORKERS, 'max_sse_clients': MAX_SSE_CLIENTS
+        })
         httpd.serve_forever()
\ No newline at end of file
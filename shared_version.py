@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Contador de versión compartido entre procesos mediante un archivo mapeado en memoria
+Permite a cada worker saber, sin consultar la base de datos, si su caché está obsoleta
+"""
+
+import mmap
+import os
+import struct
+
+try:
+    import fcntl
+except ImportError:  # Windows: un solo proceso, no hace falta bloquear el archivo
+    fcntl = None
+
+VERSION_FORMAT = '<Q'
+VERSION_SIZE = struct.calcsize(VERSION_FORMAT)
+
+
+class SharedVersion:
+    """Entero de 64 bits en un archivo que todos los procesos mapean.
+
+    Leerlo es un acceso a memoria; quien modifica los datos protegidos llama
+    a ``bump`` y el resto detecta el cambio en su siguiente lectura. Con
+    ``slots`` > 1 el archivo guarda varios contadores independientes (por
+    ejemplo, uno por grupo de usuarios) y el 0 es el principal.
+    """
+
+    def __init__(self, path, slots=1):
+        self.path = path
+        self.slots = slots
+        size = VERSION_SIZE * slots
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size < size:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+    def value(self, slot=0):
+        return struct.unpack_from(VERSION_FORMAT, self._map, slot * VERSION_SIZE)[0]
+
+    def values(self, start=0, count=None):
+        """Varios contadores consecutivos de una sola lectura"""
+        count = self.slots - start if count is None else count
+        return struct.unpack_from(f'<{count}Q', self._map, start * VERSION_SIZE)
+
+    def bump(self, slot=0):
+        """Incrementar la versión de forma atómica entre procesos"""
+        return self.bump_many([slot])[0]
+
+    def bump_many(self, slots):
+        """Incrementar varios contadores con un solo bloqueo, en el orden dado; devuelve sus nuevos valores"""
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            versions = []
+            for slot in slots:
+                version = self.value(slot) + 1
+                struct.pack_into(VERSION_FORMAT, self._map, slot * VERSION_SIZE, version)
+                versions.append(version)
+        finally:
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        return versions
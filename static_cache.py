@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Caché en memoria de archivos estáticos con compresión bajo demanda
+Sirve simple.html y demás recursos con ETag, 304 y variantes gzip/brotli
+(brotli es opcional: sin el paquete solo se ofrece gzip)
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from email.utils import formatdate
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# Tipos que merece la pena comprimir
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/manifest+json', 'image/svg+xml')
+
+# Recursos con huella en el nombre (p. ej. app.3f2a9c1b.js): su contenido nunca cambia
+FINGERPRINT_RE = re.compile(r'\.[0-9a-f]{8,}\.[a-z0-9]+$')
+
+CACHE_IMMUTABLE = 'public, max-age=31536000, immutable'
+CACHE_REVALIDATE = 'no-cache'  # Se puede guardar, pero siempre se valida con ETag
+
+mimetypes.add_type('image/svg+xml', '.svg')
+mimetypes.add_type('application/javascript', '.js')
+
+
+class StaticAsset:
+    """Contenido de un recurso y sus variantes comprimidas.
+
+    Cada variante se comprime la primera vez que un cliente la pide y se
+    guarda; así el arranque de un worker no paga gzip -9 ni brotli -11 de
+    recursos que quizá nunca sirva.
+    """
+
+    def __init__(self, name, body, content_type, mtime=None):
+        self.name = name
+        self.content_type = content_type
+        self.mtime = mtime
+        self.last_modified = formatdate(mtime, usegmt=True) if mtime else None
+        self.cache_control = CACHE_IMMUTABLE if FINGERPRINT_RE.search(name) else CACHE_REVALIDATE
+
+        self._digest = hashlib.sha256(body).hexdigest()[:32]
+        self._lock = threading.Lock()
+        # Una ETag fuerte distinta por representación
+        self.variants = {None: (body, f'"{self._digest}"')}
+        self._encodings = ()
+        if content_type.startswith(COMPRESSIBLE_TYPES):
+            self._encodings = ('br', 'gzip') if BROTLI_AVAILABLE else ('gzip',)
+
+    def _variant(self, encoding):
+        """(cuerpo, etag) de una codificación, comprimiendo la primera vez; None si no reduce tamaño"""
+        if encoding in self.variants:
+            return self.variants[encoding]
+        with self._lock:
+            if encoding not in self.variants:
+                body = self.variants[None][0]
+                if encoding == 'br':
+                    compressed = brotli.compress(body, quality=11)
+                    etag = f'"{self._digest}-br"'
+                else:
+                    compressed = gzip.compress(body, compresslevel=9, mtime=0)
+                    etag = f'"{self._digest}-gz"'
+                self.variants[encoding] = (compressed, etag) if len(compressed) < len(body) else None
+        return self.variants[encoding]
+
+    def etags(self):
+        # Incluye las variantes aún sin comprimir: otro worker pudo haberlas servido ya
+        suffixes = {'br': '-br', 'gzip': '-gz'}
+        return {f'"{self._digest}"'} | {f'"{self._digest}{suffixes[e]}"' for e in self._encodings}
+
+    def select_encoding(self, accept_encoding):
+        """Elige la mejor variante aceptada por el cliente (brotli > gzip > sin comprimir)"""
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding in self._encodings:
+            if encoding in accepted and self._variant(encoding) is not None:
+                return encoding
+        return None
+
+    def response(self, accept_encoding=None, if_none_match=None):
+        """Devuelve (status, cabeceras, cuerpo) para una petición GET"""
+        encoding = self.select_encoding(accept_encoding)
+        body, etag = self.variants[encoding]
+        headers = [
+            ('Content-Type', self.content_type),
+            ('ETag', etag),
+            ('Cache-Control', self.cache_control),
+            ('Vary', 'Accept-Encoding')
+        ]
+        if self.last_modified:
+            headers.append(('Last-Modified', self.last_modified))
+
+        if if_none_match and etag_matches(if_none_match, self.etags()):
+            return 304, headers, b''
+
+        if encoding:
+            headers.append(('Content-Encoding', encoding))
+        headers.append(('Content-Length', str(len(body))))
+        return 200, headers, body
+
+
+def parse_accept_encoding(header):
+    """Codificaciones aceptadas (ignora las que llevan q=0)"""
+    accepted = set()
+    for part in (header or '').split(','):
+        token, _, params = part.partition(';')
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(token)
+    return accepted
+
+
+def etag_matches(if_none_match, etags):
+    """Comparación débil de If-None-Match, como exige RFC 9110 para GET"""
+    if if_none_match.strip() == '*':
+        return True
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate in etags:
+            return True
+    return False
+
+
+class StaticAssetCache:
+    """Recursos estáticos precargados al arrancar (la compresión se hace al servirlos).
+
+    Cada ``get`` comprueba la fecha de modificación del archivo (una llamada a
+    ``stat``) y solo vuelve a leer y comprimir si ha cambiado, de modo que las
+    ediciones en desarrollo se ven sin reiniciar.
+    """
+
+    def __init__(self, root, names=()):
+        self.root = os.path.abspath(root)
+        self._assets = {}
+        self._lock = threading.Lock()
+        for name in names:
+            self.get(name)
+
+    def _path(self, name):
+        path = os.path.abspath(os.path.join(self.root, name.lstrip('/')))
+        if not path.startswith(self.root + os.sep):
+            return None
+        return path
+
+    def get(self, name):
+        """Recurso precargado o None si no existe"""
+        path = self._path(name)
+        if path is None:
+            return None
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+
+        asset = self._assets.get(name)
+        if asset is not None and asset.mtime == mtime:
+            return asset
+
+        with open(path, 'rb') as f:
+            body = f.read()
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if content_type.startswith('text/'):
+            content_type += '; charset=utf-8'
+        asset = StaticAsset(name, body, content_type, mtime)
+        with self._lock:
+            self._assets[name] = asset
+        return asset
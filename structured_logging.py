@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Logs estructurados (JSON lines) escritos fuera del hilo de la petición
+Las peticiones solo encolan el registro; un hilo aparte lo formatea y lo escribe.
+Los mensajes repetidos se limitan por segundo para que una ráfaga no sature la salida.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# Nivel mínimo (DEBUG, INFO, WARNING, ERROR)
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# 'json' (una línea JSON por registro) o 'text' (legible, para desarrollo)
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+# Registros por segundo de un mismo mensaje (0: sin límite); el resto se cuentan y se descartan
+LOG_RATE_LIMIT = int(os.environ.get('LOG_RATE_LIMIT', 20))
+# Mensajes distintos a los que se sigue la pista antes de reiniciar el límite
+_MAX_RATE_KEYS = 10000
+# Registros pendientes de escribir; si la salida no da abasto se descartan en vez de bloquear
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+# Atributos estándar de LogRecord: el resto son campos pasados con extra={...}
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_PID = os.getpid()
+_setup_lock = threading.Lock()
+_listener = None
+_queue_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos de ``extra`` al mismo nivel"""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': _PID,
+            'msg': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formato legible: hora, nivel, logger, mensaje y campos clave=valor"""
+
+    def format(self, record):
+        fields = ' '.join(
+            f'{key}={value}' for key, value in vars(record).items()
+            if key not in _RESERVED and not key.startswith('_')
+        )
+        line = f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        if fields:
+            line += f' {fields}'
+        if record.exc_text:
+            line += '\n' + record.exc_text
+        return line
+
+
+class RateLimitFilter(logging.Filter):
+    """Deja pasar como mucho ``limit`` registros por segundo de cada mensaje.
+
+    La clave es (logger, plantilla del mensaje), así que errores distintos no
+    se tapan entre sí. Lo descartado se informa en el siguiente registro que
+    pasa con el campo ``suppressed``.
+    """
+
+    def __init__(self, limit=LOG_RATE_LIMIT):
+        super().__init__()
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._windows = {}  # clave -> [segundo, emitidos, descartados]
+
+    def filter(self, record):
+        if not self.limit:
+            return True
+        key = (record.name, record.msg)
+        second = int(record.created)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None and len(self._windows) >= _MAX_RATE_KEYS:
+                self._windows.clear()
+            if window is None or window[0] != second:
+                suppressed = window[2] if window is not None else 0
+                window = self._windows[key] = [second, 0, suppressed]
+            if window[1] >= self.limit:
+                window[2] += 1
+                return False
+            window[1] += 1
+            suppressed, window[2] = window[2], 0
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que nunca bloquea: con la cola llena descarta y cuenta"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Solo lo imprescindible en el hilo de la petición: el mensaje con sus
+        # argumentos (pueden cambiar después) y el traceback, que no se puede copiar
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """Configurar una vez el logger raíz con la cola y el hilo escritor (idempotente)"""
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(TextFormatter() if fmt == 'text' else JsonFormatter())
+
+        _queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _queue_handler.addFilter(RateLimitFilter())
+
+        # Datos de LogRecord que no se escriben y que cuestan en cada llamada:
+        # archivo/línea de origen (recorre la pila), hilo y proceso (optimización documentada en logging)
+        logging._srcfile = None
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(_queue_handler)
+
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, output, respect_handler_level=True)
+        _listener.start()
+        # Escribir lo pendiente al salir
+        atexit.register(_listener.stop)
+
+
+def get_logger(name):
+    """Logger con nombre; configura la salida estructurada la primera vez"""
+    setup_logging()
+    return logging.getLogger(name)
+
+
+def dropped_records():
+    """Registros descartados por cola llena (para /metrics)"""
+    return _queue_handler.dropped if _queue_handler is not None else 0
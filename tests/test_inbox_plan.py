@@ -0,0 +1,73 @@
+"""
+Planes de los listados de comunicados: cada uno debe resolverse con su índice
+compuesto (migración 0002) y nunca recorrer la tabla communications entera
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from database_postgres import UserDatabase  # noqa: E402
+
+
+class InboxPlanTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._cwd = os.getcwd()
+        cls._workdir = tempfile.TemporaryDirectory()
+        # Los archivos de versión compartidos se crean en el directorio actual
+        os.chdir(cls._workdir.name)
+        cls.db = UserDatabase(db_path=os.path.join(cls._workdir.name, 'users.db'), database_url='',
+                              group_commit=False)
+        cls.db.add_communications([
+            {'titulo': f'Comunicado {i}', 'mensaje': 'Texto', 'prioridad': 'normal', 'hora': '09:00',
+             'destinatario': 'todos' if i % 5 == 0 else f'usuario{i % 20}', 'remitente': f'usuario{i % 7}'}
+            for i in range(500)
+        ])
+        first = cls.db.get_all_communications(limit=1)[0]
+        cls.before = (first['created_at'], first['id'])
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls._cwd)
+        cls._workdir.cleanup()
+
+    def explain(self, query, params):
+        with self.db.connection() as conn:
+            return self.db.dialect.explain(conn.cursor(), query, params)
+
+    def assert_uses_index(self, name, build):
+        for limit in (None, 50):
+            for before in (None, self.before):
+                with self.subTest(limit=limit, before=before):
+                    plan = self.explain(*build(limit, before))
+                    # 'SCAN communications' a secas es la tabla entera; recorrer el índice en orden
+                    # (listado completo sin filtro) aparece como 'SCAN ... USING INDEX'
+                    self.assertNotIn('SCAN communications', plan)
+                    self.assertFalse([line for line in plan if 'TEMP B-TREE' in line], plan)
+                    self.assertTrue([line for line in plan if name in line], plan)
+
+    def test_recipient_query_uses_index(self):
+        self.assert_uses_index('idx_communications_destinatario_created',
+                               lambda limit, before: self.db._recipient_query('usuario1', limit, before))
+
+    def test_recipient_query_with_read_state_uses_index(self):
+        self.assert_uses_index('idx_communications_destinatario_created',
+                               lambda limit, before: self.db._recipient_query('usuario1', limit, before, True))
+
+    def test_sender_query_uses_index(self):
+        self.assert_uses_index('idx_communications_remitente_created',
+                               lambda limit, before: self.db._sender_query('usuario1', limit, before))
+
+    def test_all_query_uses_index(self):
+        self.assert_uses_index('idx_communications_created',
+                               lambda limit, before: self.db._all_query(limit, before))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Caché LRU de tokens JWT ya verificados
+Evita repetir decodificación base64, HMAC-SHA256 y json.loads para el mismo token
+"""
+
+import collections
+import os
+import threading
+import time
+
+# Entradas máximas en memoria (una por token activo)
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+# Segundos entre barridos de entradas caducadas (los hace put(), como mucho uno por intervalo)
+TOKEN_CACHE_PURGE_INTERVAL = float(os.environ.get('TOKEN_CACHE_PURGE_INTERVAL', 60))
+
+
+class VerifiedTokenCache:
+    """Tokens verificados indexados por su firma, con expiración y revocación.
+
+    Cada entrada guarda también la parte firmada (``header.payload``) y solo
+    se da por buena si coincide exactamente con la del token recibido, así que
+    reutilizar una firma conocida con otro payload nunca acierta en la caché.
+    """
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, purge_interval=TOKEN_CACHE_PURGE_INTERVAL):
+        self.maxsize = maxsize
+        self.purge_interval = purge_interval
+        self._next_purge = time.monotonic() + purge_interval
+        self._entries = collections.OrderedDict()  # firma -> (mensaje, payload, exp)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, signature, message):
+        """Payload del token si está en caché y no ha expirado, o None"""
+        with self._lock:
+            entry = self._entries.get(signature)
+            if entry is None or entry[0] != message:
+                self.misses += 1
+                return None
+            if entry[2] < time.time():
+                del self._entries[signature]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(signature)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, signature, message, payload):
+        """Guardar un token recién verificado (y, cada ``purge_interval``, barrer los caducados)"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[signature] = (message, payload, payload.get('exp', 0))
+            self._entries.move_to_end(signature)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            purge = time.monotonic() >= self._next_purge
+            if purge:
+                self._next_purge = time.monotonic() + self.purge_interval
+        if purge:
+            self.purge_expired()
+
+    def invalidate(self, token):
+        """Quitar un token concreto (p. ej. al cerrar sesión)"""
+        signature = token.rpartition('.')[2]
+        with self._lock:
+            self._entries.pop(signature, None)
+
+    def revoke_user(self, user_id=None, username=None):
+        """Quitar todos los tokens de un usuario (p. ej. al eliminarlo)"""
+        with self._lock:
+            stale = [
+                signature for signature, (_, payload, _) in self._entries.items()
+                if (user_id is not None and str(payload.get('user_id')) == str(user_id))
+                or (username is not None and payload.get('username') == username)
+            ]
+            for signature in stale:
+                del self._entries[signature]
+        return len(stale)
+
+    def purge_expired(self):
+        """Eliminar las entradas caducadas (lo llama put() periódicamente)"""
+        now = time.time()
+        with self._lock:
+            stale = [signature for signature, entry in self._entries.items() if entry[2] < now]
+            for signature in stale:
+                del self._entries[signature]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Estado de la caché para monitorización"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Revocación de tokens JWT compartida entre procesos
+Generación por usuario (invalida todas sus sesiones) y lista de tokens cerrados
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from shared_version import SharedVersion
+
+# Almacén local compartido por todos los workers de la misma máquina
+TOKEN_REVOCATION_DB = os.environ.get('TOKEN_REVOCATION_DB', 'token_revocations.db')
+# Cada cuánto se descartan de la copia en memoria los tokens ya expirados (segundos)
+PRUNE_INTERVAL = 60
+
+# Registros solo de inserción con id AUTOINCREMENT (nunca se reutiliza): cada
+# proceso recuerda el último id leído y después solo carga lo posterior
+REVOCATION_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS token_revocations (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           signature TEXT UNIQUE NOT NULL,
+           expires_at INTEGER NOT NULL
+       )''',
+    'CREATE INDEX IF NOT EXISTS idx_token_revocations_expires ON token_revocations (expires_at)',
+    '''CREATE TABLE IF NOT EXISTS user_revocations (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           username TEXT NOT NULL,
+           generation INTEGER NOT NULL
+       )''',
+    'CREATE INDEX IF NOT EXISTS idx_user_revocations_username ON user_revocations (username, generation)'
+]
+
+
+class TokenRevocationStore:
+    """Estado de revocación en SQLite con copia en memoria en cada proceso.
+
+    Cada cambio incrementa un contador de versión guardado en un archivo
+    mapeado en memoria (``<db>.version``). En cada petición solo se lee ese
+    contador; cuando ha cambiado se cargan únicamente las filas nuevas (id
+    mayor que el último leído), así que un cierre de sesión le cuesta a cada
+    proceso una fila y no una recarga completa. El archivo y sus tablas se
+    crean en el primer uso, no al importar.
+    """
+
+    def __init__(self, path=TOKEN_REVOCATION_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._version = None
+        self._seen_version = None
+        self._last_token_id = 0
+        self._last_user_id = 0
+        self._pruned_at = time.monotonic()
+        self._generations = {}  # username -> generación vigente
+        self._revoked = {}  # firma -> expiración del token
+
+    def _shared_version(self):
+        """Contador compartido; la primera vez crea también las tablas"""
+        if self._version is None:
+            with self._lock:
+                if self._version is None:
+                    self._create_tables()
+                    self._version = SharedVersion(self.path + '.version')
+        return self._version
+
+    def _create_tables(self):
+        """Crear el esquema y pasar a él los datos del formato anterior (una sola tabla por tipo)"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for statement in REVOCATION_SCHEMA:
+                conn.execute(statement)
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            if 'revoked_tokens' in tables:
+                conn.execute('''
+                    INSERT OR IGNORE INTO token_revocations (signature, expires_at)
+                    SELECT signature, expires_at FROM revoked_tokens WHERE expires_at >= ?
+                ''', (int(time.time()),))
+                conn.execute('DROP TABLE revoked_tokens')
+            if 'user_generations' in tables:
+                conn.execute('''
+                    INSERT INTO user_revocations (username, generation)
+                    SELECT username, generation FROM user_generations
+                ''')
+                conn.execute('DROP TABLE user_generations')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _refresh(self):
+        """Cargar lo que otro proceso (o este) haya revocado desde la última vez"""
+        version = self._shared_version().value()
+        if version == self._seen_version:
+            return
+        with self._lock:
+            if version == self._seen_version:
+                return
+            now = int(time.time())
+            conn = self._connect()
+            try:
+                users = conn.execute(
+                    'SELECT id, username, generation FROM user_revocations WHERE id > ? ORDER BY id',
+                    (self._last_user_id,)
+                ).fetchall()
+                tokens = conn.execute(
+                    'SELECT id, signature, expires_at FROM token_revocations WHERE id > ? AND expires_at >= ? '
+                    'ORDER BY id',
+                    (self._last_token_id, now)
+                ).fetchall()
+            finally:
+                conn.close()
+            # Se sustituyen los diccionarios en vez de modificarlos: is_revoked los lee sin lock
+            if users:
+                generations = dict(self._generations)
+                for row_id, username, generation in users:
+                    generations[username] = max(generation, generations.get(username, 0))
+                self._generations = generations
+                self._last_user_id = users[-1][0]
+            prune = time.monotonic() - self._pruned_at >= PRUNE_INTERVAL
+            if tokens or prune:
+                if prune:
+                    revoked = {signature: expires for signature, expires in self._revoked.items() if expires >= now}
+                    self._pruned_at = time.monotonic()
+                else:
+                    revoked = dict(self._revoked)
+                for row_id, signature, expires_at in tokens:
+                    revoked[signature] = expires_at
+                self._revoked = revoked
+                if tokens:
+                    self._last_token_id = tokens[-1][0]
+            # Lo confirmado antes de anunciarlo ya está en la consulta: la versión leída al principio basta
+            self._seen_version = version
+
+    def generation(self, username):
+        """Generación que se incluye en los tokens nuevos del usuario"""
+        self._refresh()
+        return self._generations.get(username, 0)
+
+    def is_revoked(self, signature, payload):
+        """True si el token se cerró o es de una generación anterior del usuario"""
+        self._refresh()
+        if signature in self._revoked:
+            return True
+        return payload.get('gen', 0) < self._generations.get(payload.get('username'), 0)
+
+    def revoke_token(self, signature, expires_at):
+        """Invalidar un token concreto hasta su expiración (cierre de sesión)"""
+        version = self._shared_version()
+        conn = self._connect()
+        try:
+            conn.execute('DELETE FROM token_revocations WHERE expires_at < ?', (int(time.time()),))
+            # Cerrar dos veces el mismo token no añade fila: no hay nada nuevo que cargar
+            conn.execute(
+                'INSERT OR IGNORE INTO token_revocations (signature, expires_at) VALUES (?, ?)',
+                (signature, int(expires_at))
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        version.bump()
+
+    def revoke_user(self, username):
+        """Invalidar todos los tokens emitidos hasta ahora para un usuario"""
+        version = self._shared_version()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('''
+                INSERT INTO user_revocations (username, generation)
+                SELECT ?, COALESCE(MAX(generation), 0) + 1 FROM user_revocations WHERE username = ?
+            ''', (username, username))
+            # Solo cuenta la última generación de cada usuario
+            conn.execute('DELETE FROM user_revocations WHERE username = ? AND id < last_insert_rowid()', (username,))
+            conn.commit()
+        finally:
+            conn.close()
+        version.bump()
+
+    def stats(self):
+        """Estado de la copia local para monitorización"""
+        self._refresh()
+        return {
+            'version': self._seen_version,
+            'revoked_tokens': len(self._revoked),
+            'revoked_users': len(self._generations)
+        }
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Contadores de comunicados sin leer en memoria
+Se cargan una vez por usuario y después se actualizan al enviar y al marcar como leído
+"""
+
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+
+from shared_version import SharedVersion
+
+# Archivo con la versión de los contadores, compartido por los workers de la máquina
+UNREAD_VERSION_FILE = os.environ.get('UNREAD_VERSION_FILE', 'unread_counters.version')
+# Grupos de usuarios con versión propia en ese archivo: un cambio en otro proceso
+# solo obliga a recargar a los usuarios de los grupos que ha tocado
+UNREAD_VERSION_BUCKETS = int(os.environ.get('UNREAD_VERSION_BUCKETS', 1024))
+
+# Posiciones en el archivo de versión: la global (vaciar toda la caché), la
+# generación (avanza con cualquier cambio de grupo) y después un contador por grupo
+_GLOBAL = 0
+_GENERATION = 1
+_FIRST_BUCKET = 2
+
+
+class UnreadCounters:
+    """Contador de no leídos por usuario.
+
+    ``load_count`` calcula el valor real en la base de datos y solo se usa la
+    primera vez o tras una invalidación. Los cambios hechos en este proceso
+    ajustan los contadores en memoria. Para el resto de procesos, un cambio
+    que afecta a usuarios concretos (envío directo, marcar como leído) solo
+    avanza la versión de su grupo y ellos recargan únicamente a esos usuarios;
+    la versión global, que vacía la caché entera, queda para lo que no se
+    puede acotar: envíos a 'todos' e invalidaciones generales.
+    """
+
+    def __init__(self, load_count, version_path=UNREAD_VERSION_FILE, buckets=UNREAD_VERSION_BUCKETS):
+        self._load_count = load_count
+        self._buckets = buckets
+        self._version = SharedVersion(version_path, slots=_FIRST_BUCKET + buckets)
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._reset(self._version.value(_GLOBAL))
+        self._changes = 0  # Cambios locales empezados, para descartar cargas que se cruzan con ellos
+        self._in_flight = 0  # Escrituras en curso cuyo ajuste aún no se ha aplicado
+
+    def _bucket(self, username):
+        """Grupo del usuario; crc32 y no hash() para que coincida en todos los procesos"""
+        return _FIRST_BUCKET + zlib.crc32(username.encode('utf-8')) % self._buckets
+
+    def _reset(self, version):
+        """Tomar como vistas todas las versiones actuales (requiere _lock)"""
+        self._seen_version = version
+        self._seen_generation = self._version.value(_GENERATION)
+        self._seen_buckets = list(self._version.values(_FIRST_BUCKET))
+
+    def _sync(self):
+        """Olvidar lo que otro proceso haya modificado (requiere _lock)"""
+        version = self._version.value(_GLOBAL)
+        if version != self._seen_version:
+            self._counts.clear()
+            self._reset(version)
+            return
+        generation = self._version.value(_GENERATION)
+        if generation == self._seen_generation:
+            return
+        # La generación se escribe después de los grupos: si ya la vemos, también sus cambios
+        buckets = self._version.values(_FIRST_BUCKET)
+        changed = {
+            _FIRST_BUCKET + i for i, (new, seen) in enumerate(zip(buckets, self._seen_buckets)) if new != seen
+        }
+        for username in [username for username in self._counts if self._bucket(username) in changed]:
+            del self._counts[username]
+        self._seen_generation = generation
+        self._seen_buckets = list(buckets)
+
+    def _publish(self, usernames=None):
+        """Anunciar un cambio local al resto de procesos (requiere _lock).
+
+        Con ``usernames`` solo avanzan sus grupos; None avanza la versión global.
+        """
+        if usernames is None:
+            version = self._version.bump(_GLOBAL)
+            # Si nadie más ha escrito entre medias, nuestra caché sigue siendo válida
+            if version != self._seen_version + 1:
+                self._counts.clear()
+                self._reset(version)
+            else:
+                self._seen_version = version
+            return
+        slots = sorted({self._bucket(username) for username in usernames})
+        if not slots:
+            return
+        versions = self._version.bump_many(slots + [_GENERATION])
+        if versions[-1] == self._seen_generation + 1:
+            self._seen_generation = versions[-1]
+            for slot, version in zip(slots, versions):
+                self._seen_buckets[slot - _FIRST_BUCKET] = version
+        # Si no, otro proceso también cambió algo: el siguiente _sync compara grupo a grupo
+
+    def get(self, username):
+        """No leídos del usuario (de memoria salvo la primera vez)"""
+        with self._lock:
+            self._sync()
+            count = self._counts.get(username)
+            if count is not None:
+                return count
+            changes = self._changes
+            cacheable = self._in_flight == 0
+            bucket = self._bucket(username)
+            versions = (self._version.value(_GLOBAL), self._version.value(bucket))
+
+        count = self._load_count(username)
+        with self._lock:
+            self._sync()
+            # Solo se guarda si ninguna escritura se cruzó con la consulta: su
+            # ajuste podría llegar después y contarse dos veces
+            if (cacheable and changes == self._changes
+                    and versions == (self._version.value(_GLOBAL), self._version.value(bucket))):
+                self._counts[username] = count
+        return count
+
+    def begin(self):
+        """Antes de escribir en la base de datos; emparejar siempre con end()"""
+        with self._lock:
+            self._changes += 1
+            self._in_flight += 1
+
+    def end(self):
+        """Después de confirmar (o abortar) la escritura y aplicar su ajuste"""
+        with self._lock:
+            self._in_flight -= 1
+
+    @contextmanager
+    def writing(self):
+        """Envuelve una escritura en la base de datos y el ajuste posterior del contador"""
+        self.begin()
+        try:
+            yield
+        finally:
+            self.end()
+
+    def cached(self, username):
+        """Valor en memoria o None, sin consultar la base de datos"""
+        with self._lock:
+            self._sync()
+            return self._counts.get(username)
+
+    def add(self, destinatarios):
+        """Nuevos comunicados: uno por destinatario ('todos' suma a cada usuario)"""
+        with self._lock:
+            self._sync()
+            everyone = sum(1 for destinatario in destinatarios if destinatario == 'todos')
+            direct = {}
+            for destinatario in destinatarios:
+                if destinatario != 'todos':
+                    direct[destinatario] = direct.get(destinatario, 0) + 1
+            for username in self._counts:
+                self._counts[username] += everyone + direct.get(username, 0)
+            self._publish(None if everyone else direct)
+
+    def read(self, username, newly_read=None):
+        """Comunicados marcados como leídos (None: todos; se recalcula al consultarlo,
+        por si llegó alguno nuevo mientras se marcaban)"""
+        with self._lock:
+            self._sync()
+            if newly_read is None:
+                self._counts.pop(username, None)
+            elif username in self._counts:
+                self._counts[username] = max(0, self._counts[username] - newly_read)
+            self._publish([username])
+
+    def invalidate(self, username=None):
+        """Olvidar un usuario (o todos) para recalcular en la siguiente consulta"""
+        with self._lock:
+            self._sync()
+            if username is None:
+                self._counts.clear()
+                self._publish()
+            else:
+                self._counts.pop(username, None)
+                self._publish([username])
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Importación y exportación masiva de usuarios (CSV o JSON lines)
+Usado por /import-users y /export-users y como herramienta de línea de comandos:
+
+    python3 user_bulk.py import usuarios.csv
+    python3 user_bulk.py export --format jsonl > usuarios.jsonl
+
+El coste lo marca scrypt: cada contraseña en claro son ~50 ms de CPU y se
+calculan como mucho PASSWORD_BULK_WORKERS a la vez (20.000 usuarios, unos 18
+minutos con un núcleo). Con la columna password_hash de un export hecho con
+--include-password-hashes no se calcula nada: 20.000 usuarios en menos de un
+segundo. Es el camino rápido para migraciones y restauraciones.
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+from password_hashing import is_hashed
+from structured_logging import get_logger
+
+logger = get_logger('user_bulk')
+
+# Usuarios por transacción al importar
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+
+FORMATS = ('csv', 'jsonl')
+EXPORT_FIELDS = ['id', 'username', 'role', 'created_at', 'updated_at']
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson'}
+
+
+def detect_format(content_type=None, filename=None, default='csv'):
+    """Formato a partir de la cabecera Content-Type o la extensión del archivo"""
+    content_type = (content_type or '').lower()
+    if 'json' in content_type:
+        return 'jsonl'
+    if 'csv' in content_type:
+        return 'csv'
+    if filename:
+        extension = os.path.splitext(filename)[1].lower()
+        if extension in ('.jsonl', '.ndjson', '.json'):
+            return 'jsonl'
+        if extension == '.csv':
+            return 'csv'
+    return default
+
+
+def read_user_rows(lines, fmt):
+    """Recorre las líneas de entrada y produce (número de línea, usuario o mensaje de error)"""
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, {key.strip(): (value or '').strip() for key, value in row.items() if key}
+    else:
+        for line_number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_number, 'JSON inválido'
+                continue
+            if not isinstance(row, dict):
+                yield line_number, 'Se esperaba un objeto JSON'
+                continue
+            yield line_number, row
+
+
+def validate_user_row(row):
+    """Usuario normalizado o mensaje de error"""
+    if isinstance(row, str):
+        return row
+    username = str(row.get('username') or '').strip()
+    password = row.get('password') or ''
+    password_hash = row.get('password_hash') or ''
+    if not username:
+        return 'Falta username'
+    if not password and not password_hash:
+        return 'Falta password o password_hash'
+    if password_hash and not password_hash.startswith('scrypt$'):
+        return 'password_hash no tiene formato scrypt'
+    return {
+        'username': username,
+        'password': password,
+        'password_hash': password_hash,
+        'role': str(row.get('role') or 'user').strip()
+    }
+
+
+def import_users(db, lines, fmt='csv', batch_size=IMPORT_BATCH_SIZE):
+    """Importar usuarios desde un iterable de líneas, una transacción por lote.
+
+    Devuelve un informe con los importados y, por línea, los conflictos
+    (usuario ya existente o repetido en el archivo) y los errores de formato.
+    """
+    report = {'success': True, 'imported': 0, 'conflicts': [], 'errors': []}
+    seen = set()
+    batch = []
+
+    def flush():
+        result = db.add_users([user for _, user in batch])
+        report['imported'] += len(result['imported'])
+        conflicts = set(result['conflicts'])
+        for line_number, user in batch:
+            if user['username'] in conflicts:
+                report['conflicts'].append({
+                    'line': line_number, 'username': user['username'], 'message': 'El usuario ya existe'
+                })
+        logger.info("Lote de usuarios importado", extra={
+            'last_line': batch[-1][0], 'imported': report['imported'], 'conflicts': len(report['conflicts'])
+        })
+        batch.clear()
+
+    for line_number, row in read_user_rows(lines, fmt):
+        user = validate_user_row(row)
+        if isinstance(user, str):
+            report['errors'].append({'line': line_number, 'message': user})
+            continue
+        if user['username'] in seen:
+            report['conflicts'].append({
+                'line': line_number, 'username': user['username'], 'message': 'Usuario repetido en el archivo'
+            })
+            continue
+        seen.add(user['username'])
+        batch.append((line_number, user))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    report['message'] = (f"{report['imported']} usuarios importados, "
+                         f"{len(report['conflicts'])} conflictos, {len(report['errors'])} errores")
+    return report
+
+
+def _without_plaintext(users):
+    """Contraseñas heredadas en texto plano: se exportan vacías, nunca en claro"""
+    for user in users:
+        if user['password_hash'] and not is_hashed(user['password_hash']):
+            user['password_hash'] = ''
+        yield user
+
+
+def export_users(db, fmt='csv', include_password_hashes=False):
+    """Generador de fragmentos de texto con todos los usuarios"""
+    fields = EXPORT_FIELDS + (['password_hash'] if include_password_hashes else [])
+    users = db.iter_users(include_password_hashes=include_password_hashes)
+    if include_password_hashes:
+        users = _without_plaintext(users)
+    if fmt == 'jsonl':
+        for user in users:
+            yield json.dumps(user, ensure_ascii=False) + '\n'
+        return
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, lineterminator='\n')
+    writer.writeheader()
+    for count, user in enumerate(users, start=1):
+        writer.writerow(user)
+        if count % 1000 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Importar o exportar usuarios en bloque')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help='Importar usuarios desde CSV o JSON lines')
+    import_parser.add_argument('file', help="Archivo de entrada ('-' para la entrada estándar)")
+    import_parser.add_argument('--format', choices=FORMATS, help='Formato (por defecto según la extensión)')
+    import_parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='Usuarios por transacción')
+
+    export_parser = subparsers.add_parser('export', help='Exportar usuarios a CSV o JSON lines')
+    export_parser.add_argument('--format', choices=FORMATS, default='csv')
+    export_parser.add_argument('--output', default='-', help="Archivo de salida ('-' para la salida estándar)")
+    export_parser.add_argument('--include-password-hashes', action='store_true',
+                               help='Incluir los hashes para volver a importarlos sin recalcularlos')
+    args = parser.parse_args()
+
+    from database_postgres import UserDatabase
+    db = UserDatabase()
+
+    if args.command == 'import':
+        fmt = args.format or detect_format(filename=args.file)
+        start = time.perf_counter()
+        if args.file == '-':
+            report = import_users(db, sys.stdin, fmt, args.batch_size)
+        else:
+            with open(args.file, newline='', encoding='utf-8') as f:
+                report = import_users(db, f, fmt, args.batch_size)
+        report['duration_s'] = round(time.perf_counter() - start, 3)
+        for problem in report['conflicts'] + report['errors']:
+            logger.warning("Línea no importada: %s", problem['message'],
+                           extra={'line': problem['line'], 'username': problem.get('username')})
+        logger.info(report['message'], extra={
+            'imported': report['imported'], 'conflicts': len(report['conflicts']),
+            'errors': len(report['errors']), 'duration_s': report['duration_s']
+        })
+        sys.exit(0 if not report['errors'] else 1)
+
+    start = time.perf_counter()
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', newline='', encoding='utf-8')
+    try:
+        for chunk in export_users(db, args.format, args.include_password_hashes):
+            output.write(chunk)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    logger.info("Usuarios exportados", extra={
+        'format': args.format, 'output': args.output, 'duration_s': round(time.perf_counter() - start, 3)
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Directorio de usuarios en memoria
+Mapa username -> usuario y respuesta JSON de /get-users ya serializada, con ETag
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from shared_version import SharedVersion
+
+# Archivo con la versión del directorio, compartido por los workers de la máquina
+USER_DIRECTORY_VERSION_FILE = os.environ.get('USER_DIRECTORY_VERSION_FILE', 'user_directory.version')
+
+
+class UserDirectory:
+    """Copia en memoria de la tabla de usuarios.
+
+    ``load_users`` devuelve la lista completa desde la base de datos y solo se
+    llama cuando la versión compartida cambia; las altas, ediciones y bajas
+    llaman a ``invalidate`` para que todos los procesos recarguen.
+    """
+
+    def __init__(self, load_users, version_path=USER_DIRECTORY_VERSION_FILE):
+        self._load_users = load_users
+        self._version = SharedVersion(version_path)
+        self._lock = threading.Lock()
+        self._seen_version = None
+        self._users = []
+        self._by_username = {}
+        self.body = b''
+        self.etag = None
+
+    def _refresh(self):
+        version = self._version.value()
+        if version == self._seen_version:
+            return
+        with self._lock:
+            if version == self._seen_version:
+                return
+            # _load_users no lee la contraseña: nunca sale del servidor
+            users = self._load_users()
+            body = json.dumps({'success': True, 'users': users}).encode('utf-8')
+            self._users = users
+            self._by_username = {user['username']: user for user in users}
+            self.body = body
+            self.etag = '"users-' + hashlib.sha256(body).hexdigest()[:32] + '"'
+            self._seen_version = version
+
+    def invalidate(self):
+        """Marcar el directorio como obsoleto en todos los procesos"""
+        self._version.bump()
+
+    def snapshot(self):
+        """(cuerpo JSON de /get-users, ETag) actualizados"""
+        self._refresh()
+        with self._lock:
+            return self.body, self.etag
+
+    def users(self):
+        self._refresh()
+        return self._users
+
+    def get(self, username):
+        """Usuario por nombre, o None si no existe"""
+        self._refresh()
+        return self._by_username.get(username)
+
+    def existing(self, usernames):
+        """Cuáles de los nombres indicados existen"""
+        self._refresh()
+        by_username = self._by_username
+        return {username for username in usernames if username in by_username}